@@ -1,7 +1,6 @@
 import os
-from cs50 import SQL
-from flask import Flask, flash, redirect, render_template, request, session, url_for
-from flask_socketio import SocketIO, join_room, leave_room
+from flask import Flask, flash, jsonify, redirect, render_template, request, session, url_for
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import uuid
 from werkzeug.security import check_password_hash, generate_password_hash
 from functools import wraps
@@ -14,12 +13,15 @@ import threading
 from threading import Lock
 import logging
 
+from commands import LobbyClosed
 from utilities import (
-    set_socketio, get_current_market_state,
-    bot_action, countdown_timer,
+    set_socketio, open_lobby_market,
+    bot_action, start_bot_trading_cycles, start_game_timer, get_time_remaining,
     is_lobby_full, create_game, finalize_game_results, mark_game_as_completed,
     get_fair_value, execute_trade, cleanup_lobby, cleanup_game_data,
-    cleanup_all, end_game_helper
+    cleanup_all, end_game_helper, get_market_snapshot, place_order,
+    get_leaderboard, start_leaderboard_updates, start_order_expiry, get_portfolio, portfolio_room,
+    get_history_page
 )
 
 import globals
@@ -78,7 +80,7 @@ def add_bot_to_lobby(lobby_id):
     bot_name = f"{bot_name} ({bot_level})"
 
     # Find the lobby
-    lobby = next((lobby for lobby in globals.lobbies if lobby["id"] == lobby_id), None)
+    lobby = globals.lobbies.get(lobby_id)
     if not lobby:
         flash("Lobby not found", "danger")
         return redirect(url_for("play"))
@@ -91,8 +93,8 @@ def add_bot_to_lobby(lobby_id):
     # Add bot to the lobby
     bot_id = str(uuid.uuid4())
     bot = create_bot(bot_id, bot_name, get_fair_value(lobby_id), lobby_id, bot_level)
-    lobby["players"].append({"name": bot_name, "ready": True, "is_bot": True,
-                            "last_active": datetime.now(), "id": bot_id})  # Mark bot as ready
+    globals.lobbies.add_player(lobby_id, {"name": bot_name, "ready": True, "is_bot": True,
+                                          "last_active": datetime.now(), "id": bot_id})  # Mark bot as ready
     db.execute("INSERT INTO game_participants (game_id, user_id, username) VALUES (:game_id, :user_id, :username)",
                game_id=lobby_id, user_id=bot_id, username=bot_name)
 
@@ -111,7 +113,7 @@ def start_bot_trading(lobby_id):
     """
     # Find the lobby
     print("finding lobby for bots")
-    lobby = next((lobby for lobby in globals.lobbies if lobby['id'] == lobby_id), None)
+    lobby = globals.lobbies.get(lobby_id)
     if not lobby:
         flash("Lobby not found. Cannot start trading.", "danger")
         return redirect(url_for('play'))
@@ -125,10 +127,9 @@ def start_bot_trading(lobby_id):
         return redirect(url_for('join_lobby', lobby_id=lobby_id))
 
     print("starting bot trading cycles")
-    bot_thread = threading.Thread(target=bot_action, args=(
-        lobby_id,))  # Use a separate thread for bot trading
-    bot_thread.daemon = True  # Set as daemon so it stops when the main program stops
-    bot_thread.start()  # Start the bot trading thread
+    if not start_bot_trading_cycles(lobby_id):
+        flash("Bot trading cycles are already running.", "warning")
+        return redirect(url_for('join_lobby', lobby_id=lobby_id))
 
     flash("Bot trading cycles started.", "success")
     return redirect(url_for('join_lobby', lobby_id=lobby_id))
@@ -146,13 +147,7 @@ def index():
         print(f"User ID from session: {user_id}")
 
         # Get user stats
-        stats = db.execute("""
-            SELECT
-                IFNULL(SUM(pnl), 0) AS total_pnl,
-                IFNULL(COUNT(id), 0) AS games_played
-            FROM game_results
-            WHERE user_id = :user_id
-        """, user_id=user_id)[0]
+        stats = globals.user_stats.get(user_id)
         print(f"Stats fetched: {stats}")
 
         username = db.execute("SELECT username FROM users WHERE id = :user_id",
@@ -247,15 +242,9 @@ def play():
     """
     Display the play page with lobbies and allow users to create or join a lobby
     """
-    username = session.get("username")
-    user_lobby_id = None
-
     # Check if the user is already in a lobby
-    for lobby in globals.lobbies:
-        for player in lobby["players"]:
-            if player["name"] == username:
-                user_lobby_id = lobby["id"]
-                break
+    user_lobby = globals.lobbies.lobby_of(str(session["user_id"]))
+    user_lobby_id = user_lobby["id"] if user_lobby else None
     return render_template("play.html", lobbies=globals.lobbies, user_lobby_id=user_lobby_id)
 
 
@@ -268,28 +257,23 @@ def history():
     user_id = session["user_id"]
 
     # Find users statistics
-    stats = db.execute("""
-        SELECT
-            IFNULL(SUM(pnl), 0) AS total_pnl,
-            IFNULL(COUNT(id), 0) AS total_games,
-            IFNULL(MAX(pnl), 0) AS best_pnl
-        FROM game_results
-        WHERE user_id = :user_id
-    """, user_id=user_id)[0]
+    stats = globals.user_stats.get(user_id)
 
     # Calculate winning percentage
-    total_games = stats["total_games"]
-    total_wins = db.execute(
-        "SELECT COUNT(id) FROM game_results WHERE user_id = :user_id AND pnl > 0", user_id=user_id)[0]["COUNT(id)"]
-    winning_percentage = (total_wins / total_games * 100) if total_games > 0 else 0
-
-    # Get detailed game history
-    games = db.execute("""
-        SELECT scenario, pnl
-        FROM game_results
-        WHERE user_id = :user_id
-        ORDER BY created_at DESC
-""", user_id=user_id)
+    total_games = stats["games_played"]
+    winning_percentage = (stats["wins"] / total_games * 100) if total_games > 0 else 0
+
+    # Get one page of detailed game history
+    filters = {
+        "scenario": request.args.get("scenario", "").strip(),
+        "start": request.args.get("start", ""),
+        "end": request.args.get("end", ""),
+    }
+    try:
+        games, next_cursor = get_history_page(user_id, cursor=request.args.get("cursor"), **filters)
+    except ValueError as e:
+        flash(str(e), "danger")
+        return redirect(url_for("history"))
 
     # Render the history page with all data
     return render_template(
@@ -297,11 +281,34 @@ def history():
         total_pnl=round(stats["total_pnl"], 2),
         total_games=total_games,
         best_pnl=stats["best_pnl"],
+        recent_pnl=round(stats["recent_pnl"], 2),
         winning_percentage=round(winning_percentage, 2),
-        games=games
+        games=games,
+        next_cursor=next_cursor,
+        filters=filters
     )
 
 
+@app.route("/api/history")
+@login_required
+def api_history():
+    """
+    Return one page of the user's game history as JSON. Pass back next_cursor to get the next page.
+    """
+    try:
+        games, next_cursor = get_history_page(
+            session["user_id"],
+            scenario=request.args.get("scenario", "").strip(),
+            start=request.args.get("start"),
+            end=request.args.get("end"),
+            cursor=request.args.get("cursor"),
+            limit=max(1, min(request.args.get("limit", globals.HISTORY_PAGE_SIZE, type=int), 100)),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"games": games, "next_cursor": next_cursor})
+
+
 @app.route("/settings", methods=["GET", "POST"])
 @login_required
 def settings():
@@ -392,18 +399,11 @@ def create_lobby():
     """
     Create a new game lobby, assign a random market, and add it to the list of lobbies
     """
-    player_name = session.get("username")
-
     # Check if the user is already in a lobby
-    current_lobby_id = None
-    for lobby in globals.lobbies:
-        for player in lobby["players"]:
-            if player["name"] == player_name:
-                current_lobby_id = lobby["id"]
-                break
+    current_lobby = globals.lobbies.lobby_of(str(session["user_id"]))
 
     # Prevent creating a new lobby if the user is already in one
-    if current_lobby_id:
+    if current_lobby:
         flash("You are already in a lobby. Leave the current lobby to create a new one.", "danger")
         return redirect(url_for("play"))
 
@@ -439,7 +439,7 @@ def create_lobby():
             "market_question": market["question"],
             "game_length": game_length,
         }
-        globals.lobbies.append(new_lobby)
+        globals.lobbies.add(new_lobby)
 
         # Notify via SocketIO
         socketio.emit("lobby_update", new_lobby)
@@ -459,32 +459,27 @@ def join_lobby(lobby_id):
     Let a user join a lobby
     """
     player_name = session.get("username")
+    player_id = str(session["user_id"])
 
     # Check if the user is already in a lobby
     print("checking if in lobby")
-    current_lobby_id = None
-    for lobby in globals.lobbies:
-        for player in lobby["players"]:
-            if player["name"] == player_name:
-                print("found player in lobby")
-                current_lobby_id = lobby["id"]
-                break
+    current_lobby = globals.lobbies.lobby_of(player_id)
 
     # Prevent joining another lobby if already in one
-    if current_lobby_id and current_lobby_id != lobby_id:
+    if current_lobby and current_lobby["id"] != lobby_id:
         flash("You are already in another lobby. Leave that lobby to join a new one.", "danger")
         return redirect(url_for("play"))
 
     # Find the lobby
     print("finding lobby")
-    lobby = next((lobby for lobby in globals.lobbies if lobby["id"] == lobby_id), None)
+    lobby = globals.lobbies.get(lobby_id)
     if not lobby:
         flash("Lobby not found", "danger")
         return redirect(url_for("play"))
 
     # Check if the user is already in the lobby
     print("checking if user is in lobby")
-    existing_player = next((p for p in lobby["players"] if p["name"] == player_name), None)
+    existing_player = globals.lobbies.get_player(lobby_id, player_id)
     if existing_player:
         print("user is in lobby")
         # Update their last active timestamp
@@ -509,10 +504,10 @@ def join_lobby(lobby_id):
 
         print("adding player to lobby")
         # Add the player to the lobby
-        lobby["players"].append({"name": player_name, "ready": False, "is_bot": False,
-                                "last_active": datetime.now(), "id": str(session["user_id"])})
+        globals.lobbies.add_player(lobby_id, {"name": player_name, "ready": False, "is_bot": False,
+                                              "last_active": datetime.now(), "id": player_id})
         db.execute("INSERT INTO game_participants (game_id, user_id, username) VALUES (:game_id, :user_id, :username)",
-                   game_id=lobby_id, user_id=str(session["user_id"]), username=session.get("username"))
+                   game_id=lobby_id, user_id=player_id, username=session.get("username"))
         lobby["current_players"] += 1
 
         print("emitting event")
@@ -537,29 +532,54 @@ def join_room_event(data):
     if not username or not lobby_id:
         return {"status": "error", "message": "Invalid lobby or user"}, 400
 
-    # Join the Socket.IO room
+    # Join the Socket.IO room, and the player's own room for their portfolio updates
     join_room(lobby_id)
+    join_room(portfolio_room(lobby_id, str(session["user_id"])))
     print(f"{username} joined room {lobby_id}")
 
     # Notify others in the room
     socketio.emit("player_joined", {"player": username}, to=lobby_id)
 
+    # Send a client joining a running game the full book to apply market_update deltas on top of,
+    # and the current standings until the next leaderboard update
+    lobby = globals.lobbies.get(lobby_id)
+    if lobby and lobby["status"] == "in_progress":
+        try:
+            emit("market_snapshot", get_market_snapshot(lobby_id))
+            emit("leaderboard_update", {"leaderboard": get_leaderboard(lobby_id, globals.LEADERBOARD_SIZE)})
+        except LobbyClosed:
+            pass  # The game ended while the client was joining; lobby_ended follows
+
+
+@socketio.on("request_market_snapshot")
+def request_market_snapshot(data):
+    """
+    Resend the full book to a client that detected a gap in market_update sequence numbers
+    """
+    lobby_id = data.get("lobby_id")
+    lobby = globals.lobbies.get(lobby_id)
+    if not session.get("username") or not lobby:
+        return {"status": "error", "message": "Invalid lobby or user"}, 400
+
+    try:
+        emit("market_snapshot", get_market_snapshot(lobby_id))
+    except LobbyClosed:
+        return {"status": "error", "message": "Game not in progress"}, 400
+
 
 @app.route("/toggle_ready/<lobby_id>", methods=["GET", "POST"])
 @login_required
 def toggle_ready(lobby_id):
     # Find lobby
-    for lobby in globals.lobbies:
-        if lobby['id'] == lobby_id:
-            # Find user
-            player_name = session.get('username')
-            player = next((player for player in lobby['players']
-                          if player['name'] == player_name), None)
-            if player:
-                # Update user's ready status
-                player['ready'] = not player['ready']
-                socketio.emit('force_refresh', to=lobby_id)
-            return redirect(url_for('join_lobby', lobby_id=lobby_id))
+    lobby = globals.lobbies.get(lobby_id)
+    if lobby:
+        # Find user
+        player = globals.lobbies.get_player(lobby_id, str(session["user_id"]))
+        if player:
+            # Update user's ready status
+            player['ready'] = not player['ready']
+            socketio.emit('force_refresh', to=lobby_id)
+        return redirect(url_for('join_lobby', lobby_id=lobby_id))
 
 
 @app.route("/execute_trade/<lobby_id>", methods=["POST"])
@@ -575,7 +595,13 @@ def player_trade(lobby_id):
     trade_quantity = float(request.form.get("quantity"))
 
     # Execute the trade using the main trading function
-    execute_trade(lobby_id, user_id, trade_type, trade_price, trade_quantity)
+    try:
+        fills = execute_trade(lobby_id, user_id, trade_type, trade_price, trade_quantity)
+    except LobbyClosed:
+        flash("The game is not running", "danger")
+        return redirect(url_for("play"))
+    if not fills:
+        flash("No matching ask found" if trade_type == "buy" else "No matching bid found", "danger")
 
     # Emit real-time player action update
     socketio.emit("player_action", {"lobby_id": lobby_id, "user_id": user_id,
@@ -595,34 +621,34 @@ def set_order(lobby_id):
     order_type = request.form.get("type")  # "bid" or "ask"
     order_price = float(request.form.get("price"))
     order_quantity = int(request.form.get("quantity"))
+    time_in_force = request.form.get("time_in_force", "GTC")  # "GTC", "IOC" or "GTT"
 
-    # Insert the new order into the database
+    # Submit the new order to the lobby's order book
     print(
-        f"inserting player trade of {lobby_id}, {user_id}, {order_type}, {order_price}, {order_quantity}")
-    print(f"{type(lobby_id)}, {type(user_id)}, {type(order_type)}, {type(order_price)}, {type(order_quantity)}")
-    db.execute("""
-        INSERT INTO orders (game_id, user_id, order_type, price, quantity, created_at)
-        VALUES (:game_id, :user_id, :type, :price, :quantity, CURRENT_TIMESTAMP)
-    """, game_id=lobby_id, user_id=user_id, type=order_type, price=order_price, quantity=order_quantity)
-
-    # Emit real-time market update
-    # Get market data
-    asks = db.execute("""
-        SELECT price, quantity FROM orders
-        WHERE game_id = :game_id AND order_type = 'ask'
-        ORDER BY price ASC, created_at ASC
-    """, game_id=lobby_id)
-    bids = db.execute("""
-        SELECT price, quantity FROM orders
-        WHERE game_id = :game_id AND order_type = 'bid'
-        ORDER BY price DESC, created_at ASC
-    """, game_id=lobby_id)
-    socketio.emit('market_update', {
-        'bids': bids,
-        'asks': asks,
-    }, room=lobby_id)
+        f"inserting player trade of {lobby_id}, {user_id}, {order_type}, {order_price}, {order_quantity}, {time_in_force}")
+    try:
+        expires_in = float(request.form.get("expires_in") or 0) if time_in_force == "GTT" else None
+        fills, rested = place_order(lobby_id, user_id, order_type, order_price, order_quantity, time_in_force,
+                                    expires_in)
+    except ValueError as e:
+        flash(str(e), "danger")
+        return redirect(url_for("game", lobby_id=lobby_id))
+    except LobbyClosed:
+        flash("The game is not running", "danger")
+        return redirect(url_for("play"))
 
-    flash(f"Your {order_type} order has been placed.", "success")
+    # Tell the player what actually happened to the order
+    filled = sum(fill["quantity"] for fill in fills)
+    if not filled and rested:
+        flash(f"Your {order_type} order has been placed.", "success")
+    elif filled and rested:
+        flash(f"Your {order_type} order traded {filled} and the other {rested} rest on the book.", "success")
+    elif filled:
+        cancelled = order_quantity - filled
+        flash(f"Your {order_type} order traded {filled}" + (f", the other {cancelled} were cancelled." if cancelled else "."),
+              "success")
+    else:
+        flash(f"Your {order_type} order was cancelled, nothing matched.", "warning")
     return redirect(url_for("game", lobby_id=lobby_id))
 
 
@@ -633,32 +659,23 @@ def game(lobby_id):
     Render the game page for a specific lobby
     """
     # Find the lobby
-    lobby = next((lobby for lobby in globals.lobbies if lobby["id"] == lobby_id), None)
+    lobby = globals.lobbies.get(lobby_id)
     if not lobby:
         flash("Lobby not found", "danger")
         return redirect(url_for("play"))
 
-    # Get market data
-    asks = db.execute("""
-        SELECT price, quantity FROM orders
-        WHERE game_id = :game_id AND order_type = 'ask'
-        ORDER BY price ASC, created_at ASC
-    """, game_id=lobby_id)
-
-    bids = db.execute("""
-        SELECT price, quantity FROM orders
-        WHERE game_id = :game_id AND order_type = 'bid'
-        ORDER BY price DESC, created_at ASC
-    """, game_id=lobby_id)
+    # Get market data, and the player's position, kept up to date as fills happen rather than replayed from history
+    try:
+        snapshot = get_market_snapshot(lobby_id)
+        user_portfolio = get_portfolio(lobby_id, session["user_id"])
+    except LobbyClosed:
+        flash("The game has not started yet", "warning")
+        return redirect(url_for("join_lobby", lobby_id=lobby_id))
+    asks = snapshot["asks"]
+    bids = snapshot["bids"]
+    market_stats = snapshot["stats"]
 
     # Get trade history
-    transactions = db.execute(
-        """SELECT * FROM transactions t where t.game_id = :game_id""", game_id=lobby_id)
-    print("transactions:", transactions)
-    game_participants = db.execute(
-        """SELECT * FROM game_participants gp where gp.game_id = :game_id""", game_id=lobby_id)
-    print("game participants:", game_participants)
-
     trade_history = db.execute("""
         SELECT DISTINCT
             t.price,
@@ -673,24 +690,14 @@ def game(lobby_id):
         ORDER BY t.created_at DESC
         LIMIT 10
     """, game_id=lobby_id)
-    print("trade history:", trade_history)
-
-    # Make trades into a portfolio
-    user_portfolio = {"contracts": 0, "cash": 0}
-    for trade in trade_history:
-        if trade["buyer"] == session["username"]:
-            user_portfolio["contracts"] += trade["quantity"]
-            user_portfolio["cash"] -= trade["price"] * trade["quantity"]
-        if trade["seller"] == session["username"]:
-            user_portfolio["contracts"] -= trade["quantity"]
-            user_portfolio["cash"] += trade["price"] * trade["quantity"]
-    user_portfolio["cash"] = round(user_portfolio["cash"], 2)
 
     # Prepare data for rendering
     context = {
         "lobby": lobby,
+        "time_remaining": round(get_time_remaining(lobby)),
         "asks": asks,
         "bids": bids,
+        "market_stats": market_stats,
         "trade_history": trade_history,
         "user_portfolio": user_portfolio,
     }
@@ -698,24 +705,37 @@ def game(lobby_id):
     return render_template("game.html", **context)
 
 
+@app.route("/portfolio/<lobby_id>", methods=["GET"])
+@login_required
+def portfolio(lobby_id):
+    """
+    Return the player's contracts and cash in a lobby as JSON
+    """
+    lobby = globals.lobbies.get(lobby_id)
+    if not lobby or lobby["status"] != "in_progress":
+        return jsonify({"error": "Game not in progress"}), 404
+    try:
+        return jsonify(get_portfolio(lobby_id, session["user_id"]))
+    except LobbyClosed:
+        return jsonify({"error": "Game not in progress"}), 404
+
+
 @app.route("/leave_lobby/<lobby_id>", methods=["POST"])
 @login_required
 def leave_lobby(lobby_id):
     """
     Handle a user leaving a lobby
     """
-    player_name = session.get("username")
-
     print("finding lobby")
     # Find the lobby
-    lobby = next((lobby for lobby in globals.lobbies if lobby["id"] == lobby_id), None)
+    lobby = globals.lobbies.get(lobby_id)
     if not lobby:
         flash("Lobby not found", "danger")
         return redirect(url_for("play"))
 
     print("removing player from lobby")
     # Remove the player from the lobby
-    lobby["players"] = [player for player in lobby["players"] if player["name"] != player_name]
+    globals.lobbies.remove_player(lobby_id, str(session["user_id"]))
     lobby["current_players"] = len(lobby["players"])
 
     # Notify the lobby of the updated players list
@@ -767,7 +787,7 @@ def start_game(lobby_id):
     print(f"starting game for lobby {lobby_id}")
 
     # Find the lobby
-    lobby = next((lobby for lobby in globals.lobbies if lobby["id"] == lobby_id), None)
+    lobby = globals.lobbies.get(lobby_id)
     if not lobby:
         flash("Lobby not found", "danger")
         return redirect(url_for("play"))
@@ -783,16 +803,23 @@ def start_game(lobby_id):
             flash("All players must be ready to start the game", "danger")
             return redirect(url_for("join_lobby", lobby_id=lobby_id))
 
-    # Update the lobby status to "in_progress"
-    lobby["status"] = "in_progress"
+    # Open the lobby's market and update the lobby status to "in_progress", unless another request already did
+    if not globals.lobbies.start(lobby_id, open_lobby_market):
+        flash("Game has already started", "warning")
+        return redirect(url_for("game", lobby_id=lobby_id))
 
-    # Start the timer in a new thread
+    # Start the game timer
     print(f"Starting timer for lobby {lobby_id}")
     redirect_url = url_for("play")
-    timer_thread = threading.Thread(target=countdown_timer, args=(lobby_id, redirect_url))
-    timer_thread.start()
+    start_game_timer(lobby_id, redirect_url)
     logging.debug(f"timer started for lobby {lobby_id}")
 
+    # Start streaming the live leaderboard
+    start_leaderboard_updates(lobby_id)
+
+    # Start expiring good-till-time orders
+    start_order_expiry(lobby_id)
+
     # Start the bots
     print(f"starting bots in lobby {lobby_id}")
     start_bot_trading(lobby_id)
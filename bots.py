@@ -1,67 +1,60 @@
 import random
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from marketstats import RECENT_TRADES, MarketStats
 
 BOTS = {}  # Dictionary to track active bots in all lobbies
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 
 class Bot:
-    def __init__(self, bot_id, name, fair_value, lobby_id, level="medium"):
+    def __init__(self, bot_id, name, fair_value, lobby_id, level="medium", clock=datetime.now, rng=random):
         """
-        Initialize the bot with its properties
+        Initialize the bot with its properties. The clock and random generator can be
+        swapped for simulated ones to replay games headless and deterministically.
         """
+        self.clock = clock
+        self.rng = rng
         self.bot_id = bot_id
         self.name = name
         self.fair_value = fair_value
         self.lobby_id = lobby_id
         self.level = level
-        self.pnl = 0
         self.current_bid = None
         self.current_ask = None
-        self.last_trade_time = datetime.now()
+        self.last_trade_time = self.clock()
         self.market_maturity = 0
         self.market_state = {
             "best_bid": None,
             "best_ask": None,
+            "bid_depth": 1,
+            "ask_depth": 1,
             "all_bids": [],
             "all_asks": [],
-            "recent_trades": []
+            "stats": MarketStats(),
         }
 
         # Add noise to the bot's estimation of fair value based on bot level
         fair_value_noise_percentage = {
-            "easy": random.uniform(-0.20, 0.20),  # +/-20% noise
-            "medium": random.uniform(-0.10, 0.10),
-            "hard": random.uniform(-0.05, 0.05),
-            "Jane Street": random.uniform(-0.02, 0.02),
+            "easy": self.rng.uniform(-0.20, 0.20),  # +/-20% noise
+            "medium": self.rng.uniform(-0.10, 0.10),
+            "hard": self.rng.uniform(-0.05, 0.05),
+            "Jane Street": self.rng.uniform(-0.02, 0.02),
         }
         noise_percentage = fair_value_noise_percentage.get(
-            self.level, random.uniform(-0.10, 0.10))
+            self.level, self.rng.uniform(-0.10, 0.10))
         self.estimated_fair_value = self.fair_value * (1 + noise_percentage)
 
     def update_market_state(self, market_state):
         """
-        Update the bot's view of the market state, excluding its own orders
+        Update the bot's view of the market state, as MarketSnapshot.view(bot_id) returns it:
+        best prices and depths already exclude the bot's own orders.
+        The market state is shared with other bots and must not be modified.
         """
         self.market_state = market_state
 
-        # Exclude the bot's own orders from best bid and ask
-        all_bids = [bid for bid in market_state.get("all_bids", [])
-                    if bid["user_id"] != self.bot_id]
-        all_asks = [ask for ask in market_state.get("all_asks", [])
-                    if ask["user_id"] != self.bot_id]
-
-        # Update best bid and ask excluding the bot's own orders
-        self.market_state["best_bid"] = max(
-            all_bids, key=lambda x: x["price"], default=None)
-        self.market_state["best_ask"] = min(
-            all_asks, key=lambda x: x["price"], default=None)
-
-        self.market_state["all_bids"] = all_bids
-        self.market_state["all_asks"] = all_asks
-
         # Update market maturity level (e.g., based on trades or time elapsed)
-        self.market_maturity = len(self.market_state.get("recent_trades", []))
+        self.market_maturity = min(self.market_state["stats"].trade_count, RECENT_TRADES)
 
         # Adjust the bot's estimated fair value based on recent trades
         self.adjust_estimated_fair_value()
@@ -70,14 +63,11 @@ class Bot:
         """
         Adjust the bot's estimated fair value based on recent trades
         """
-        last_trades = self.market_state.get("recent_trades", [])
-        if not last_trades:
+        # Average price of the recent trades, kept by the lobby's market statistics
+        avg_trade_price = self.market_state["stats"].recent_average()
+        if avg_trade_price is None:
             return
 
-        # Calculate average trade price
-        avg_trade_price = sum(
-            trade["price"] for trade in last_trades) / len(last_trades)
-
         # Adjust estimated fair value towards avg_trade_price
         adjustment_factor = 0.1  # Bot adjusts 10% towards the average price
         new_fair_value = (
@@ -87,12 +77,12 @@ class Bot:
 
         # Add dynamic noise to prevent exact centering
         level_noise = {
-            "easy": random.uniform(-0.05, 0.05),  # +/-5%
-            "medium": random.uniform(-0.02, 0.02),
-            "hard": random.uniform(-0.01, 0.01),
-            "Jane Street": random.uniform(-0.005, 0.005),
+            "easy": self.rng.uniform(-0.05, 0.05),  # +/-5%
+            "medium": self.rng.uniform(-0.02, 0.02),
+            "hard": self.rng.uniform(-0.01, 0.01),
+            "Jane Street": self.rng.uniform(-0.005, 0.005),
         }
-        noise = level_noise.get(self.level, random.uniform(-0.02, 0.02))
+        noise = level_noise.get(self.level, self.rng.uniform(-0.02, 0.02))
         self.estimated_fair_value = new_fair_value * (1 + noise)
 
     def generate_bid_ask(self):
@@ -101,12 +91,12 @@ class Bot:
         """
         # Generate random noise based on bot level
         level_noise = {
-            "easy": random.uniform(5, 10),
-            "medium": random.uniform(2, 5),
-            "hard": random.uniform(1, 2),
-            "Jane Street": random.uniform(0.5, 1),
+            "easy": self.rng.uniform(5, 10),
+            "medium": self.rng.uniform(2, 5),
+            "hard": self.rng.uniform(1, 2),
+            "Jane Street": self.rng.uniform(0.5, 1),
         }
-        noise = level_noise.get(self.level, random.uniform(2, 5))
+        noise = level_noise.get(self.level, self.rng.uniform(2, 5))
 
         # Calculate a margin based on the fair value
         margin_multiplier = {
@@ -130,10 +120,8 @@ class Bot:
         best_bid_price = best_bid["price"] if best_bid else self.fair_value - noise
         best_ask_price = best_ask["price"] if best_ask else self.fair_value + noise
 
-        all_bids = self.market_state.get("all_bids", [])
-        all_asks = self.market_state.get("all_asks", [])
-        avg_bid_depth = sum(bid["quantity"] for bid in all_bids) / len(all_bids) if all_bids else 1
-        avg_ask_depth = sum(ask["quantity"] for ask in all_asks) / len(all_asks) if all_asks else 1
+        avg_bid_depth = self.market_state.get("bid_depth", 1)
+        avg_ask_depth = self.market_state.get("ask_depth", 1)
 
         # Adjust behavior if the bot holds the top bid/ask
         reluctant_to_tighten_spread = False
@@ -145,23 +133,23 @@ class Bot:
 
         # Generate bid/ask prices
         bid_price = (
-            weight_on_market * (best_bid_price + random.uniform(-1, 0.5)) +
+            weight_on_market * (best_bid_price + self.rng.uniform(-1, 0.5)) +
             weight_on_fair_value * (self.fair_value - margin - noise)
-        ) + random.uniform(-avg_bid_depth / 10, avg_bid_depth / 10)
+        ) + self.rng.uniform(-avg_bid_depth / 10, avg_bid_depth / 10)
 
         ask_price = (
-            weight_on_market * (best_ask_price + random.uniform(0.5, 1)) +
+            weight_on_market * (best_ask_price + self.rng.uniform(0.5, 1)) +
             weight_on_fair_value * (self.fair_value + margin + noise)
-        ) + random.uniform(-avg_ask_depth / 10, avg_ask_depth / 10)
+        ) + self.rng.uniform(-avg_ask_depth / 10, avg_ask_depth / 10)
 
         # Adjust if the bot is reluctant to tighten the spread
         if reluctant_to_tighten_spread:
-            bid_price -= random.uniform(0, noise / 2)
-            ask_price += random.uniform(0, noise / 2)
+            bid_price -= self.rng.uniform(0, noise / 2)
+            ask_price += self.rng.uniform(0, noise / 2)
 
         # Ensure valid spread
         if ask_price <= bid_price:
-            ask_price = bid_price + random.uniform(0.5, 1)
+            ask_price = bid_price + self.rng.uniform(0.5, 1)
 
         # Update bot's current bid and ask
         self.current_bid = max(0, bid_price)
@@ -176,10 +164,9 @@ class Bot:
         """
         best_ask = self.market_state.get("best_ask", None)
         best_bid = self.market_state.get("best_bid", None)
-        last_trades = self.market_state.get("recent_trades", [])
 
         # Adjust trading probability based on market activity
-        trade_frequency_modifier = self._get_trade_frequency_modifier(last_trades)
+        trade_frequency_modifier = self._get_trade_frequency_modifier(self.market_state["stats"])
 
         # Trading margin logic
         trade_margin_multiplier = {
@@ -214,8 +201,8 @@ class Bot:
 
             if spread < tight_spread_threshold and self.market_maturity > 10:  # Favor tight spreads in mature markets
                 return {"type": "buy", "price": best_ask["price"], "quantity": trade_quantity}
-            elif spread > wide_spread_threshold and random.random() < trade_frequency_modifier:  # Favor wide spreads early
-                if random.random() < 0.6:
+            elif spread > wide_spread_threshold and self.rng.random() < trade_frequency_modifier:  # Favor wide spreads early
+                if self.rng.random() < 0.6:
                     return {"type": "buy", "price": best_ask["price"], "quantity": trade_quantity}
                 else:
                     return {"type": "sell", "price": best_bid["price"], "quantity": trade_quantity}
@@ -229,17 +216,13 @@ class Bot:
         # Higher probability for smaller quantities
         quantities = [1, 2, 3, 5, 8]  # Fibonacci-like for variability
         weights = [0.4, 0.3, 0.2, 0.07, 0.03]  # Higher weights for smaller quantities
-        return random.choices(quantities, weights=weights, k=1)[0]
+        return self.rng.choices(quantities, weights=weights, k=1)[0]
 
-    def _get_trade_frequency_modifier(self, last_trades):
+    def _get_trade_frequency_modifier(self, stats):
         """
         Determine how often the bot should trade based on market activity
         """
-        now = datetime.now()
-        recent_trades = [
-            trade for trade in last_trades if now - datetime.strptime(trade["created_at"], DATE_FORMAT) < timedelta(seconds=30)
-        ]
-        activity_level = len(recent_trades)
+        activity_level = stats.trades_within(30, self.clock().timestamp())
 
         # Increase trade frequency at the start
         if self.market_maturity < 5:  # Market is immature
@@ -253,20 +236,11 @@ class Bot:
         else:
             return 0.2  # Low activity, higher trade frequency
 
-    def update_pnl(self, trade_price, trade_type):
-        """
-        Update the bot's P&L based on completed trades
-        """
-        if trade_type == "buy":
-            self.pnl -= trade_price
-        elif trade_type == "sell":
-            self.pnl += trade_price
-
     def should_update_quotes(self):
         """
         Decide whether the bot should post new bid/ask prices based on market conditions and timing
         """
-        now = datetime.now()
+        now = self.clock()
         time_since_last_trade = (now - self.last_trade_time).total_seconds()
 
         # Probability-based update to reduce frequency
@@ -276,7 +250,7 @@ class Bot:
             "hard": 0.5,
             "Jane Street": 0.7,
         }
-        should_update = random.random() < update_probability.get(self.level, 0.25)
+        should_update = self.rng.random() < update_probability.get(self.level, 0.25)
 
         if not should_update:
             return False
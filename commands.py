@@ -0,0 +1,68 @@
+# commands.py contains the per-lobby command queue. Every read and write of a lobby's order book is submitted as a command and run by a single writer at a time, so bots and players never race on the same order while different lobbies still run in parallel. Once a lobby's final command closes its queue, no later command can touch the lobby's state.
+from collections import deque
+from concurrent.futures import Future
+from threading import Lock
+
+
+class LobbyClosed(Exception):
+    """
+    Raised for a command submitted to a lobby that is not running
+    """
+
+
+class CommandQueue:
+    def __init__(self):
+        """
+        Initialize an empty, open queue with no active writer
+        """
+        self.lock = Lock()
+        self.queue = deque()
+        self.writing = False
+        self.closed = False
+
+    def close(self):
+        """
+        Refuse every command after the current one. Called from inside the lobby's final command.
+        """
+        with self.lock:
+            self.closed = True
+
+    def submit(self, fn, *args):
+        """
+        Run `fn(*args)` as the lobby's single writer and return its result.
+        If no writer is active the calling thread becomes the writer and runs
+        every queued command in order; otherwise it waits for the active writer
+        to run its command. Raises LobbyClosed once the queue is closed.
+        """
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise LobbyClosed("The lobby is closed")
+            self.queue.append((fn, args, future))
+            become_writer = not self.writing
+            self.writing = True
+
+        if become_writer:
+            self._drain()
+        return future.result()
+
+    def _drain(self):
+        """
+        Run queued commands until the queue is empty, then step down as writer
+        """
+        while True:
+            with self.lock:
+                if not self.queue:
+                    self.writing = False
+                    return
+                fn, args, future = self.queue.popleft()
+                closed = self.closed
+            if closed:
+                # Queued before the close but behind the final command
+                future.set_exception(LobbyClosed("The lobby is closed"))
+                continue
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
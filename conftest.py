@@ -0,0 +1,73 @@
+# conftest.py contains the fixtures shared by the tests
+import sqlite3
+
+import pytest
+
+# The tables gamefiles.db had before the first migration
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL
+);
+CREATE TABLE game_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    game_id INTEGER NOT NULL,
+    scenario TEXT NOT NULL,
+    pnl REAL NOT NULL,
+    accuracy REAL NOT NULL,
+    time_taken REAL NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    trades_completed INTEGER DEFAULT 0
+);
+CREATE TABLE game_participants (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    pnl REAL DEFAULT 0,
+    accuracy REAL DEFAULT 0,
+    time_taken REAL DEFAULT 0,
+    trades_completed INTEGER DEFAULT 0,
+    username TEXT NOT NULL DEFAULT 'Unknown User'
+);
+CREATE TABLE games (
+    id TEXT PRIMARY KEY,
+    scenario TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    status TEXT NOT NULL DEFAULT 'waiting',
+    lobby_name TEXT,
+    game_length INTEGER DEFAULT 300
+);
+CREATE TABLE orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    order_type TEXT NOT NULL,
+    price REAL NOT NULL,
+    quantity REAL NOT NULL,
+    is_active BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_id INTEGER NOT NULL,
+    buyer_id TEXT NOT NULL,
+    seller_id TEXT NOT NULL,
+    price REAL NOT NULL,
+    quantity REAL NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+@pytest.fixture
+def baseline_database(tmp_path):
+    """
+    Path of a new gamefiles.db with the tables it had before any migration
+    """
+    path = str(tmp_path / "gamefiles.db")
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.close()
+    return path
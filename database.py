@@ -0,0 +1,141 @@
+# database.py contains the SQLite access layer shared by request, bot and timer threads. Statements borrow a connection from a small bounded pool of WAL connections, so readers never wait on writers and each connection keeps its cache of prepared statements across requests. execute keeps the calling convention of cs50's SQL so the rest of the code reads the same.
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class Database:
+    def __init__(self, path, pool_size=8, cache_size=-16000, mmap_size=64 * 1024 * 1024, statement_cache=256):
+        """
+        Initialize the access layer with at most `pool_size` open connections.
+        cache_size follows SQLite's PRAGMA (negative means KiB).
+        """
+        self.path = path
+        self.pool_size = pool_size
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.statement_cache = statement_cache
+        self.idle = queue.LifoQueue()  # Connections not lent out; the most recently used (warmest) first
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()  # The connection a thread holds for the length of a transaction
+
+    def _open(self):
+        """
+        Open and tune a new connection
+        """
+        # isolation_level=None leaves transactions to us: every statement
+        # autocommits unless it runs inside `transaction()`. The pool hands a
+        # connection to one thread at a time, so it may move between threads.
+        connection = sqlite3.connect(self.path, isolation_level=None, timeout=5,
+                                     cached_statements=self.statement_cache, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        connection.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        return connection
+
+    def _acquire(self):
+        """
+        Borrow an idle connection, opening one while the pool is below its size,
+        otherwise waiting for another thread to give one back
+        """
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            open_new = self.opened < self.pool_size
+            if open_new:
+                self.opened += 1
+        if not open_new:
+            return self.idle.get()
+        try:
+            return self._open()
+        except BaseException:
+            with self.lock:
+                self.opened -= 1
+            raise
+
+    @contextmanager
+    def _connection(self):
+        """
+        Lend a connection for one statement. Inside a transaction that is the
+        transaction's own connection, which stays with the thread until it ends.
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            yield connection
+            return
+
+        connection = self._acquire()
+        try:
+            yield connection
+        finally:
+            self.idle.put(connection)
+
+    def execute(self, sql, **params):
+        """
+        Run one statement. Returns the rows of a SELECT as dicts, the new row id of an
+        INSERT, and the number of rows changed by an UPDATE or DELETE.
+        """
+        with self._connection() as connection:
+            try:
+                cursor = connection.execute(sql, params)
+            except sqlite3.IntegrityError as e:
+                raise ValueError(str(e)) from e
+
+            command = sql.lstrip().split(None, 1)[0].upper()
+            if command in ("SELECT", "WITH", "PRAGMA", "EXPLAIN"):
+                return [dict(row) for row in cursor.fetchall()]
+            if command in ("INSERT", "REPLACE"):
+                return cursor.lastrowid
+            if command in ("UPDATE", "DELETE"):
+                return cursor.rowcount
+            return True
+
+    def executemany(self, sql, rows):
+        """
+        Run one statement for every parameter dict in `rows`, reusing the prepared statement
+        """
+        with self._connection() as connection:
+            try:
+                return connection.executemany(sql, rows).rowcount
+            except sqlite3.IntegrityError as e:
+                raise ValueError(str(e)) from e
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the enclosed statements as one transaction that commits once, on a
+        connection the thread keeps until then. Nested transactions join the outermost one.
+        """
+        if getattr(self.local, "connection", None) is not None:
+            self.local.depth += 1
+            try:
+                yield self
+            finally:
+                self.local.depth -= 1
+            return
+
+        with self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            self.local.connection = connection
+            self.local.depth = 1
+            try:
+                yield self
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            else:
+                try:
+                    connection.execute("COMMIT")
+                except BaseException:
+                    # Never hand a connection back to the pool mid-transaction
+                    connection.execute("ROLLBACK")
+                    raise
+            finally:
+                self.local.connection = None
+                self.local.depth = 0
@@ -1,13 +1,45 @@
 # globals.py
-from cs50 import SQL
-from threading import Lock
+from database import Database
+from lobbies import LobbyRegistry
+from migrations import migrate
+from scheduler import Scheduler
+from userstats import UserStatsCache
+from writebehind import WriteBehindQueue
 
-# Shared database connection
-db = SQL("sqlite:///gamefiles.db")
+# Bring the schema up to date, then open the shared database (a bounded pool of WAL connections)
+DATABASE = "gamefiles.db"
+DATABASE_POOL_SIZE = 8  # Most connections open at once; request, bot and writer threads borrow them per statement
+migrate(DATABASE)
+db = Database(DATABASE, pool_size=DATABASE_POOL_SIZE)
+user_stats = UserStatsCache(db)  # Per-user statistics for the homepage and history page
 
 # Shared state
-lobbies = []
+lobbies = LobbyRegistry()  # Live lobbies, indexed by lobby id and player id
 markets = {}
+lobby_markets = {}  # lobby id -> LobbyMarket: the lobby's order book, ledger, statistics and expiry wheel
+command_queues = {}  # lobby id -> CommandQueue, the single writer of the lobby's book
+vector_bots = {}  # lobby id -> VectorBotEngine, for lobbies with at least VECTOR_BOT_THRESHOLD bots
 
-# Locks
-bot_lock = Lock()
+# Settings
+MARKET_DEPTH_LEVELS = 10  # Price levels per side published in market data
+MARKET_UPDATE_WINDOW = 0.05  # Seconds of market updates conflated into one emission per room
+BOT_TICK_INTERVAL = 5  # Seconds between bot trading ticks in a lobby
+VECTOR_BOT_THRESHOLD = 50  # Bots in a lobby from which they run on the vectorized engine instead of one by one
+MAX_LIVE_QUOTES_PER_SIDE = 1  # Resting quotes a bot keeps per side; older ones are cancelled when it requotes
+BOT_QUOTE_LIFETIME = 30  # Seconds a bot quote rests before it expires, None for good till cancelled
+MAX_ORDER_LIFETIME = 3600  # Most seconds a player's good-till-time order may rest before it expires
+ORDER_EXPIRY_INTERVAL = 1  # Seconds between sweeps of a lobby's expired orders
+SCHEDULER_WORKERS = 4  # Worker threads shared by every lobby's scheduled jobs
+TIMER_RESYNC_INTERVAL = 30  # Seconds between game timer resyncs sent to clients
+LEADERBOARD_UPDATE_INTERVAL = 1  # Seconds between live leaderboard updates sent to a lobby
+LEADERBOARD_SIZE = 10  # Players shown on the live leaderboard
+HISTORY_PAGE_SIZE = 20  # Games per page of a user's history
+TICK_DIRECTORY = "ticks"  # Tick logs of running games and archives of finished ones
+WRITE_QUEUE_CAPACITY = 10000  # Order and fill writes waiting to be persisted before producers block
+WRITE_BATCH_INTERVAL = 0.005  # Seconds of writes grouped into one commit
+
+# Shared scheduler for bot ticks and game timers
+scheduler = Scheduler(workers=SCHEDULER_WORKERS)
+
+# Background writer that persists orders and fills in group commits
+writer = WriteBehindQueue(db, capacity=WRITE_QUEUE_CAPACITY, interval=WRITE_BATCH_INTERVAL)
@@ -0,0 +1,121 @@
+# ledger.py contains the per-lobby ledger of every participant's position. It is updated as each fill happens, so live and end-of-game leaderboards are read straight from memory instead of being re-aggregated from the transactions table.
+import heapq
+
+
+class Position:
+    """
+    One participant's contracts, cash and trade record in a lobby
+    """
+    __slots__ = ("contracts", "cash", "trade_count", "winning_trades")
+
+    def __init__(self):
+        self.contracts = 0
+        self.cash = 0.0
+        self.trade_count = 0
+        self.winning_trades = 0
+
+
+class Ledger:
+    def __init__(self, lobby_id, fair_value):
+        """
+        Initialize an empty ledger for a lobby. Final results are marked to the market's fair value.
+        """
+        self.lobby_id = lobby_id
+        self.fair_value = fair_value
+        self.positions = {}  # participant id -> Position
+        self.version = 0  # Bumped on every fill, so readers can tell whether standings changed
+
+    def _position(self, user_id):
+        position = self.positions.get(user_id)
+        if position is None:
+            position = self.positions[user_id] = Position()
+        return position
+
+    def record_fill(self, buyer_id, seller_id, price, quantity):
+        """
+        Apply one fill to the buyer and the seller. A trade wins if it was done at a better price than fair value.
+        """
+        buyer = self._position(buyer_id)
+        buyer.contracts += quantity
+        buyer.cash -= price * quantity
+        buyer.trade_count += 1
+        buyer.winning_trades += price < self.fair_value
+
+        seller = self._position(seller_id)
+        seller.contracts -= quantity
+        seller.cash += price * quantity
+        seller.trade_count += 1
+        seller.winning_trades += price > self.fair_value
+
+        self.version += 1
+
+    def pnl(self, user_id, mark=None):
+        """
+        P&L of a participant: cash plus contracts valued at the `mark` price, fair value by default
+        """
+        position = self.positions.get(user_id)
+        if position is None:
+            return 0.0
+        return position.cash + position.contracts * (self.fair_value if mark is None else mark)
+
+    def portfolio(self, user_id):
+        """
+        A participant's contracts and cash, zero if they have not traded. There is no P&L:
+        marked to fair value it would give the market's answer away while the game runs.
+        """
+        position = self.positions.get(user_id)
+        if position is None:
+            return {"contracts": 0, "cash": 0.0}
+        return {
+            "contracts": position.contracts,
+            "cash": round(position.cash, 2),
+        }
+
+    def _ranked(self, mark, limit):
+        """
+        Participant ids by P&L at `mark`, best first (the top `limit`, or everyone)
+        """
+        def pnl(user_id):
+            position = self.positions[user_id]
+            return position.cash + position.contracts * mark
+
+        if limit is None:
+            return sorted(self.positions, key=pnl, reverse=True)
+        return heapq.nlargest(limit, self.positions, key=pnl)
+
+    def standings(self, mark, limit=None):
+        """
+        Live standings (the top `limit`, or everyone), best P&L first, marked to `mark`, a public price such as
+        the last trade. Accuracy is left out: it counts trades against the fair value, which must stay hidden.
+        """
+        standings = []
+        for user_id in self._ranked(mark, limit):
+            position = self.positions[user_id]
+            standings.append({
+                "user_id": user_id,
+                "contracts": position.contracts,
+                "cash": position.cash,
+                "pnl": self.pnl(user_id, mark),
+                "trade_count": position.trade_count,
+            })
+        return standings
+
+    def entry(self, user_id):
+        """
+        Summarize one participant's final position, marked to fair value
+        """
+        position = self.positions[user_id]
+        return {
+            "user_id": user_id,
+            "contracts": position.contracts,
+            "cash": position.cash,
+            "pnl": self.pnl(user_id),
+            "trade_count": position.trade_count,
+            "accuracy": round(position.winning_trades * 100.0 / position.trade_count, 2) if position.trade_count else 0,
+        }
+
+    def results(self, limit=None):
+        """
+        Final results of every participant who traded (or the top `limit`), best P&L at fair value first
+        """
+        return [self.entry(user_id) for user_id in self._ranked(self.fair_value, limit)]
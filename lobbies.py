@@ -0,0 +1,102 @@
+# lobbies.py contains the lobby registry. It keeps every live lobby indexed by id, which lobby each player is in, and each lobby's players by id, so routes never have to scan every lobby or every player.
+from threading import RLock
+
+
+class LobbyRegistry:
+    def __init__(self):
+        """
+        Initialize an empty registry
+        """
+        self.lock = RLock()
+        self.by_id = {}  # lobby id -> lobby dict
+        self.player_lobby = {}  # player id -> lobby id
+        self.players = {}  # lobby id -> {player id -> player dict}
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.by_id.values()))
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get(self, lobby_id):
+        """
+        Find a lobby by id, or None
+        """
+        return self.by_id.get(lobby_id)
+
+    def add(self, lobby):
+        """
+        Register a new lobby, along with any players it already has
+        """
+        with self.lock:
+            self.by_id[lobby["id"]] = lobby
+            self.players[lobby["id"]] = {}
+            for player in lobby["players"]:
+                self.players[lobby["id"]][player["id"]] = player
+                self.player_lobby[player["id"]] = lobby["id"]
+
+    def remove(self, lobby_id):
+        """
+        Drop a lobby and forget which players were in it
+        """
+        with self.lock:
+            self.by_id.pop(lobby_id, None)
+            for player_id in self.players.pop(lobby_id, {}):
+                if self.player_lobby.get(player_id) == lobby_id:
+                    del self.player_lobby[player_id]
+
+    def start(self, lobby_id, open_market):
+        """
+        Start a waiting lobby: call open_market(lobby_id), then mark it in progress, as one step so two
+        requests can never both start it. Returns False, without opening anything, if it was not waiting.
+        """
+        with self.lock:
+            lobby = self.by_id.get(lobby_id)
+            if not lobby or lobby["status"] != "waiting":
+                return False
+            open_market(lobby_id)
+            lobby["status"] = "in_progress"
+            return True
+
+    def add_player(self, lobby_id, player):
+        """
+        Add a player (or bot) to a lobby
+        """
+        with self.lock:
+            lobby = self.by_id[lobby_id]
+            lobby["players"].append(player)
+            self.players[lobby_id][player["id"]] = player
+            self.player_lobby[player["id"]] = lobby_id
+
+    def remove_player(self, lobby_id, player_id):
+        """
+        Remove a player from a lobby
+        """
+        with self.lock:
+            lobby = self.by_id.get(lobby_id)
+            if not lobby or self.players[lobby_id].pop(player_id, None) is None:
+                return
+            lobby["players"] = [player for player in lobby["players"] if player["id"] != player_id]
+            if self.player_lobby.get(player_id) == lobby_id:
+                del self.player_lobby[player_id]
+
+    def lobby_of(self, player_id):
+        """
+        Find the lobby a player is in, or None
+        """
+        lobby_id = self.player_lobby.get(player_id)
+        return self.by_id.get(lobby_id) if lobby_id else None
+
+    def get_player(self, lobby_id, player_id):
+        """
+        Find a player in a lobby by id, or None
+        """
+        return self.players.get(lobby_id, {}).get(player_id)
+
+    def player_name(self, lobby_id, player_id):
+        """
+        Find the display name of a player in a lobby, or None
+        """
+        player = self.get_player(lobby_id, player_id)
+        return player["name"] if player else None
@@ -0,0 +1,230 @@
+# lobbymarket.py contains the trading commands of one lobby's market: placing, cancelling and expiring orders, sweeping trades, and bot turns, along with the book, ledger, statistics and expiry wheel they keep up to date. The app runs them as lobby commands with the write-behind queue, the tick log, the room publisher and the wall clock plugged in; the simulator runs the very same code with a simulated clock and no database.
+import itertools
+import math
+import random
+import time
+from datetime import datetime
+
+from ledger import Ledger
+from marketstats import MarketStats
+from orderbook import MarketSnapshot, OrderBook
+from timingwheel import TimingWheel
+
+# Time in force of an order: good till cancelled, immediate or cancel (never rests), or good till a number of seconds
+TIME_IN_FORCE = ("GTC", "IOC", "GTT")
+
+
+class LobbyMarket:
+    def __init__(self, lobby_id, fair_value, depth=10, clock=time.time, rng=random, order_ids=None,
+                 writer=None, tick_log=None, on_fills=None, on_book_change=None,
+                 max_live_quotes=1, quote_lifetime=None):
+        """
+        Initialize an empty market for a lobby. clock returns epoch seconds and rng draws bot quantities.
+        writer persists orders and fills and tick_log records them, if given. on_fills is called with the
+        fills of each aggressive order and on_book_change after each change to the book, to publish them.
+        Bot quotes are limited to max_live_quotes per side and expire after quote_lifetime seconds if it is set.
+        """
+        self.lobby_id = lobby_id
+        self.clock = clock
+        self.rng = rng
+        self.order_ids = order_ids or itertools.count(1)
+        self.writer = writer
+        self.tick_log = tick_log
+        self.on_fills = on_fills
+        self.on_book_change = on_book_change
+        self.max_live_quotes = max_live_quotes
+        self.quote_lifetime = quote_lifetime
+
+        self.book = OrderBook(lobby_id, depth=depth)
+        self.ledger = Ledger(lobby_id, fair_value)
+        self.stats = MarketStats()
+        self.expiry = TimingWheel(clock())  # Deadlines of the good-till-time orders
+        self.cancelled = 0  # Orders taken off the book before they traded, expired ones included
+
+    def _write(self, sql, **params):
+        if self.writer:
+            self.writer.add(sql, **params)
+
+    def _book_changed(self, fills):
+        """
+        Note the new top of the book and publish what happened
+        """
+        best_bid = self.book.best("bid")
+        best_ask = self.book.best("ask")
+        self.stats.record_spread(best_bid.price if best_bid else None, best_ask.price if best_ask else None,
+                                 self.clock())
+        if fills and self.on_fills:
+            self.on_fills(fills)
+        if self.on_book_change:
+            self.on_book_change()
+
+    def snapshot(self):
+        """
+        Take a snapshot of the market for one tick of bots
+        """
+        return MarketSnapshot(self.book, self.stats)
+
+    def record_fills(self, fills, resting_type):
+        """
+        Apply the fills of one aggressive order against resting orders of `resting_type` to the ledger, the
+        statistics and the tick log, and queue their database writes. Writes of the same kind are queued
+        together so they are committed with one executemany.
+        """
+        now = self.clock()
+        for fill in fills:
+            self.ledger.record_fill(fill["buyer_id"], fill["seller_id"], fill["price"], fill["quantity"])
+            self.stats.record_trade(fill["price"], fill["quantity"], now)
+            if self.tick_log:
+                self.tick_log.record_fill(fill, resting_type)
+            self._write("""
+                INSERT INTO transactions (game_id, buyer_id, seller_id, price, quantity, created_at)
+                VALUES (:game_id, :buyer_id, :seller_id, :price, :quantity, CURRENT_TIMESTAMP)
+            """, game_id=self.lobby_id, buyer_id=fill["buyer_id"], seller_id=fill["seller_id"],
+                price=fill["price"], quantity=fill["quantity"])
+
+        # Delete the resting orders that were fulfilled, update the one left partially filled
+        for fill in fills:
+            if fill["remaining"] <= 0:
+                self.expiry.cancel(fill["order_id"])
+                self._write("DELETE FROM orders WHERE id = :id", id=fill["order_id"])
+        for fill in fills:
+            if fill["remaining"] > 0:
+                self._write("""
+                    UPDATE orders SET quantity = :quantity WHERE id = :id
+                """, quantity=fill["remaining"], id=fill["order_id"])
+
+    def _prevent_self_trade(self, user_id, trade_type, price, snapshot):
+        """
+        Cancel the user's own resting orders that their incoming buy/sell would reach, so it neither trades
+        with them nor rests through them and crosses the book. Returns how many were cancelled.
+        """
+        crossing = self.book.crossing_orders(user_id, trade_type, price)
+        for order_id in crossing:
+            order = self.cancel_order(order_id)
+            if snapshot:
+                snapshot.remove_order(order)
+        return len(crossing)
+
+    def place_order(self, user_id, order_type, price, quantity, time_in_force="GTC", expires_in=None, snapshot=None):
+        """
+        Match a new bid or ask against the book and rest what is left, unless it is immediate or cancel.
+        A good-till-time order expires `expires_in` seconds after it rests. The user's own opposite orders
+        it crosses are cancelled first. The snapshot, if given, is updated too.
+        Returns the fills and the rested order, if any.
+        """
+        if time_in_force not in TIME_IN_FORCE:
+            raise ValueError(f"Unknown time in force: {time_in_force}")
+        if time_in_force == "GTT" and not (expires_in and math.isfinite(expires_in) and expires_in > 0):
+            raise ValueError("A good-till-time order needs a finite, positive number of seconds")
+
+        trade_type = "buy" if order_type == "bid" else "sell"
+        self._prevent_self_trade(user_id, trade_type, price, snapshot)
+        fills = self.book.match(user_id, trade_type, price, quantity)
+        self.record_fills(fills, "ask" if order_type == "bid" else "bid")
+        if snapshot:
+            snapshot.apply_fills(fills, "ask" if order_type == "bid" else "bid")
+        remaining = quantity - sum(fill["quantity"] for fill in fills)
+
+        order = None
+        if remaining > 0 and time_in_force != "IOC":
+            # The expiry is scheduled first, so an order never rests without it
+            order_id = next(self.order_ids)
+            if time_in_force == "GTT":
+                self.expiry.schedule(order_id, self.clock() + expires_in)
+            # The database row is only a durable record, the book is the source of truth
+            order = self.book.add_order(order_id, user_id, order_type, price, remaining)
+            if self.tick_log:
+                self.tick_log.record_order(order)
+            self._write("""
+                INSERT INTO orders (id, game_id, user_id, order_type, price, quantity, created_at)
+                VALUES (:id, :game_id, :user_id, :order_type, :price, :quantity, CURRENT_TIMESTAMP)
+            """, id=order.id, game_id=self.lobby_id, user_id=user_id, order_type=order_type, price=price,
+                quantity=remaining)
+            if snapshot:
+                snapshot.add_order(order)
+
+        self._book_changed(fills)
+        return fills, order
+
+    def cancel_order(self, order_id):
+        """
+        Take a resting order off the book and queue the removal of its row.
+        Returns the cancelled order, or None if it already traded away.
+        """
+        order = self.book.cancel(order_id)
+        if order:
+            self.expiry.cancel(order_id)
+            self.cancelled += 1
+            if self.tick_log:
+                self.tick_log.record_cancel(order)
+            self._write("DELETE FROM orders WHERE id = :id", id=order_id)
+        return order
+
+    def execute_trade(self, user_id, trade_type, price, quantity, snapshot=None):
+        """
+        Sweep the asks (for a buy) or the bids (for a sell) up to a price, returning the fills.
+        The user's own orders in the way are cancelled first. The snapshot, if given, is updated too.
+        """
+        cancelled = self._prevent_self_trade(user_id, trade_type, price, snapshot)
+        fills = self.book.match(user_id, trade_type, price, quantity)
+        self.record_fills(fills, "ask" if trade_type == "buy" else "bid")
+        if snapshot:
+            snapshot.apply_fills(fills, "ask" if trade_type == "buy" else "bid")
+        if fills or cancelled:
+            self._book_changed(fills)
+        return fills
+
+    def expire_orders(self):
+        """
+        Cancel the good-till-time orders whose time ran out, returning how many there were
+        """
+        expired = [order_id for order_id in self.expiry.advance(self.clock()) if self.cancel_order(order_id)]
+        if expired:
+            self._book_changed([])
+        return len(expired)
+
+    def place_quote(self, bot_id, order_type, price, quantity, snapshot):
+        """
+        Cancel-replace a bot's quote on one side. Its oldest quotes are cancelled so that, with the
+        new one, it never has more than max_live_quotes resting. The snapshot is updated too.
+        """
+        live = self.book.user_orders(bot_id, order_type)
+        for order_id in live[:max(0, len(live) - self.max_live_quotes + 1)]:
+            snapshot.remove_order(self.cancel_order(order_id))
+
+        time_in_force = "GTT" if self.quote_lifetime else "GTC"
+        self.place_order(bot_id, order_type, price, quantity, time_in_force, self.quote_lifetime, snapshot)
+
+    def bot_turn(self, bot, snapshot):
+        """
+        Let one bot look at the tick's market snapshot, requote and trade.
+        The snapshot is updated with the bot's own orders and fills for the bots after it.
+        """
+        bot.update_market_state(snapshot.view(bot.bot_id))
+
+        # Decide whether to post new bid/ask prices
+        if bot.should_update_quotes():
+            # Get the new bid and ask prices and post orders
+            bid, ask = bot.generate_bid_ask()
+            for price, order_type in [(bid, "bid"), (ask, "ask")]:
+                self.place_quote(bot.bot_id, order_type, price, self.rng.randint(1, 10), snapshot)
+
+        # Decide to trade or not
+        trade = bot.decide_to_trade()
+        if trade:
+            self.execute_trade(bot.bot_id, trade["type"], trade["price"], self.rng.randint(1, 10), snapshot)
+
+    def vector_bot_tick(self, engine, snapshot):
+        """
+        Let the vectorized bots look at the tick's market snapshot, requote and trade, batch by batch.
+        The snapshot is updated with each batch's orders and fills for the batches after it.
+        """
+        now = datetime.fromtimestamp(self.clock())
+        start = 0
+        while start < len(engine):
+            actions, start = engine.tick(snapshot, now, start)
+            for action, bot_id, side, price, quantity in actions:
+                if action == "order":
+                    self.place_quote(bot_id, side, price, quantity, snapshot)
+                else:
+                    self.execute_trade(bot_id, side, price, quantity, snapshot)
@@ -0,0 +1,123 @@
+# marketstats.py contains the streaming statistics of a lobby's market. They are updated once per fill and once per book change, with epoch timestamps, so bots and the game page read VWAP, moving averages, trade rates, volatility and spreads in constant time instead of re-deriving them from trade rows every tick.
+import math
+from collections import deque
+
+RECENT_TRADES = 10  # Trades in the recent average price that bots follow
+TRADE_WINDOWS = (30, 60, 300)  # Seconds of the rolling trade counts
+EWMA_WEIGHT = 0.1  # Weight of each new trade in the exponentially weighted average price
+
+
+class MarketStats:
+    def __init__(self, windows=TRADE_WINDOWS):
+        """
+        Initialize the statistics of a market with no trades yet
+        """
+        self.trade_count = 0
+        self.volume = 0
+        self.notional = 0.0  # Sum of price * quantity, for the VWAP
+        self.last_price = None
+        self.ewma = None
+        self.recent = deque(maxlen=RECENT_TRADES)  # Prices of the last trades
+        self.windows = {window: deque() for window in windows}  # window -> times of the trades within it
+
+        # Log returns between consecutive trades, as a running mean and sum of squared deviations
+        self.returns = 0
+        self.return_mean = 0.0
+        self.return_m2 = 0.0
+
+        # The current spread and its average weighted by how long each spread stood
+        self.spread = None
+        self.spread_since = None
+        self.spread_time = 0.0
+        self.spread_area = 0.0
+
+    def record_trade(self, price, quantity, at):
+        """
+        Fold one fill, at epoch time `at`, into the statistics
+        """
+        if self.last_price and price > 0:
+            log_return = math.log(price / self.last_price)
+            self.returns += 1
+            delta = log_return - self.return_mean
+            self.return_mean += delta / self.returns
+            self.return_m2 += delta * (log_return - self.return_mean)
+
+        self.trade_count += 1
+        self.volume += quantity
+        self.notional += price * quantity
+        self.last_price = price
+        self.ewma = price if self.ewma is None else self.ewma + EWMA_WEIGHT * (price - self.ewma)
+        self.recent.append(price)
+        for times in self.windows.values():
+            times.append(at)
+
+    def record_spread(self, best_bid, best_ask, at):
+        """
+        Note the top of the book after it changed at epoch time `at`. Either side may be None.
+        """
+        if self.spread is not None:
+            self.spread_time += at - self.spread_since
+            self.spread_area += self.spread * (at - self.spread_since)
+        self.spread = best_ask - best_bid if best_bid is not None and best_ask is not None else None
+        self.spread_since = at
+
+    def vwap(self):
+        """
+        Volume-weighted average price of every trade, or None before the first one
+        """
+        return self.notional / self.volume if self.volume else None
+
+    def recent_average(self):
+        """
+        Average price of the last RECENT_TRADES trades, or None before the first one
+        """
+        return sum(self.recent) / len(self.recent) if self.recent else None
+
+    def trades_within(self, window, now):
+        """
+        Number of trades in the last `window` seconds, for one of the configured windows
+        """
+        times = self.windows[window]
+        while times and times[0] <= now - window:
+            times.popleft()
+        return len(times)
+
+    def volatility(self):
+        """
+        Standard deviation of the log returns between consecutive trades, or None before there are two returns
+        """
+        if self.returns < 2:
+            return None
+        return math.sqrt(self.return_m2 / (self.returns - 1))
+
+    def mean_spread(self, now):
+        """
+        Average spread, weighted by how long each one stood up to `now`, or None if there has not been one
+        """
+        time = self.spread_time
+        area = self.spread_area
+        if self.spread is not None:
+            time += now - self.spread_since
+            area += self.spread * (now - self.spread_since)
+        if time > 0:
+            return area / time
+        return self.spread
+
+    def summary(self, now):
+        """
+        Every statistic as a dict for the game page, with prices rounded to cents
+        """
+        def rounded(value, digits=2):
+            return round(value, digits) if value is not None else None
+
+        return {
+            "last_price": self.last_price,
+            "vwap": rounded(self.vwap()),
+            "ewma": rounded(self.ewma),
+            "volatility": rounded(self.volatility(), 4),
+            "spread": rounded(self.spread),
+            "mean_spread": rounded(self.mean_spread(now)),
+            "trade_count": self.trade_count,
+            "volume": self.volume,
+            "trades_within": {window: self.trades_within(window, now) for window in self.windows},
+        }
@@ -0,0 +1,242 @@
+# migrations.py contains the versioned schema migrations for gamefiles.db and a check of the query plans of the hot statements. Migrations are applied on startup; the database's PRAGMA user_version records the last one applied.
+import re
+import sqlite3
+import sys
+
+from userstats import RECENT_GAMES
+
+# Each migration is (version, description, statements), applied in order inside one transaction
+MIGRATIONS = [
+    (1, "Store game ids as TEXT in transactions and game_results", [
+        """
+        CREATE TABLE transactions_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            game_id TEXT NOT NULL, -- Links to a specific game
+            buyer_id TEXT NOT NULL, -- User who bought the asset
+            seller_id TEXT NOT NULL, -- User who sold the asset
+            price REAL NOT NULL, -- Price at which the trade occurred
+            quantity REAL NOT NULL, -- Quantity traded
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        INSERT INTO transactions_new (id, game_id, buyer_id, seller_id, price, quantity, created_at)
+        SELECT id, CAST(game_id AS TEXT), buyer_id, seller_id, price, quantity, created_at FROM transactions
+        """,
+        "DROP TABLE transactions",
+        "ALTER TABLE transactions_new RENAME TO transactions",
+        """
+        CREATE TABLE game_results_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            game_id TEXT NOT NULL,
+            scenario TEXT NOT NULL,
+            pnl REAL NOT NULL,
+            accuracy REAL NOT NULL,
+            time_taken REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            trades_completed INTEGER DEFAULT 0
+        )
+        """,
+        """
+        INSERT INTO game_results_new (id, user_id, game_id, scenario, pnl, accuracy, time_taken, created_at, trades_completed)
+        SELECT id, user_id, CAST(game_id AS TEXT), scenario, pnl, accuracy, time_taken, created_at, trades_completed FROM game_results
+        """,
+        "DROP TABLE game_results",
+        "ALTER TABLE game_results_new RENAME TO game_results",
+    ]),
+    (2, "Add covering indexes for the hot queries", [
+        # Recent trades, trade history, leaderboards and game cleanup, all by game in time order
+        """
+        CREATE INDEX IF NOT EXISTS transactions_game_created
+        ON transactions (game_id, created_at, buyer_id, seller_id, price, quantity)
+        """,
+        # Resting orders of a game by side and price, and game cleanup
+        """
+        CREATE INDEX IF NOT EXISTS orders_game_type_price
+        ON orders (game_id, order_type, price, created_at)
+        """,
+        # Homepage and history statistics and the per-game history list
+        """
+        CREATE INDEX IF NOT EXISTS game_results_user_created
+        ON game_results (user_id, created_at, pnl, scenario)
+        """,
+        # Participants of a game, and buyer/seller names in the trade history
+        "CREATE INDEX IF NOT EXISTS game_participants_game ON game_participants (game_id)",
+        "CREATE INDEX IF NOT EXISTS game_participants_user ON game_participants (user_id, username)",
+    ]),
+    (3, "Materialize per-user statistics in user_stats", [
+        """
+        CREATE TABLE user_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_pnl REAL NOT NULL DEFAULT 0,
+            games_played INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            best_pnl REAL NOT NULL DEFAULT 0,
+            recent_pnl REAL NOT NULL DEFAULT 0, -- P&L over the user's last 10 games
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Backfill from the results recorded so far; bots have no user id and no statistics
+        """
+        INSERT INTO user_stats (user_id, total_pnl, games_played, wins, best_pnl, recent_pnl)
+        SELECT
+            user_id,
+            SUM(pnl),
+            COUNT(*),
+            SUM(pnl > 0),
+            MAX(pnl),
+            SUM(CASE WHEN recency <= 10 THEN pnl ELSE 0 END)
+        FROM (
+            SELECT user_id, pnl,
+                ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY created_at DESC, id DESC) AS recency
+            FROM game_results
+            WHERE typeof(user_id) = 'integer'
+        )
+        GROUP BY user_id
+        """,
+    ]),
+    (4, "Index game results for keyset pagination of the history", [
+        # Ending in id lets pages walk the index in (created_at, id) order without a sort
+        "CREATE INDEX IF NOT EXISTS game_results_user_created_id ON game_results (user_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS game_results_user_scenario_created_id ON game_results (user_id, scenario, created_at, id)",
+        # Statistics now come from user_stats, so the old covering index only duplicates the first one
+        "DROP INDEX IF EXISTS game_results_user_created",
+    ]),
+    (5, "Repair game results recorded with their columns shifted", [
+        # Results used to be inserted with trades_completed, accuracy, time_taken and created_at one column
+        # to the left of where they belong, which left the game length in created_at and the time in
+        # trades_completed. Rotate them back wherever created_at is a number.
+        """
+        UPDATE game_results
+        SET accuracy = time_taken,
+            time_taken = created_at,
+            created_at = trades_completed,
+            trades_completed = accuracy
+        WHERE typeof(created_at) IN ('integer', 'real') AND typeof(trades_completed) = 'text'
+        """,
+        # The recent P&L windows were backfilled in the shifted order
+        f"""
+        UPDATE user_stats
+        SET recent_pnl = IFNULL((
+            SELECT SUM(pnl) FROM game_results
+            WHERE id IN (
+                SELECT id FROM game_results WHERE user_id = user_stats.user_id
+                ORDER BY created_at DESC, id DESC LIMIT {RECENT_GAMES}
+            )
+        ), 0)
+        """,
+    ]),
+]
+
+# Statements on the request path, with sample parameters, that must never scan a whole table
+HOT_QUERIES = {
+    "recent trades": ("""
+        SELECT buyer_id, seller_id, price, quantity, created_at FROM transactions
+        WHERE game_id = :game_id
+        ORDER BY created_at DESC LIMIT 10
+    """, {"game_id": "game"}),
+    "trade history": ("""
+        SELECT DISTINCT
+            t.price,
+            t.quantity,
+            t.created_at,
+            buyer.username AS buyer,
+            seller.username AS seller
+        FROM transactions t
+        LEFT JOIN game_participants buyer ON t.buyer_id = buyer.user_id
+        LEFT JOIN game_participants seller ON t.seller_id = seller.user_id
+        WHERE t.game_id = :game_id
+        ORDER BY t.created_at DESC
+        LIMIT 10
+    """, {"game_id": "game"}),
+    "update resting order": ("UPDATE orders SET quantity = :quantity WHERE id = :id", {"quantity": 1, "id": 1}),
+    "delete filled order": ("DELETE FROM orders WHERE id = :id", {"id": 1}),
+    "delete game orders": ("DELETE FROM orders WHERE game_id = :game_id", {"game_id": "game"}),
+    "delete game transactions": ("DELETE FROM transactions WHERE game_id = :game_id", {"game_id": "game"}),
+    "delete game participants": ("DELETE FROM game_participants WHERE game_id = :game_id", {"game_id": "game"}),
+    "user stats": ("""
+        SELECT total_pnl, games_played, wins, best_pnl, recent_pnl
+        FROM user_stats WHERE user_id = :user_id
+    """, {"user_id": 1}),
+    "user stats recent window": ("""
+        SELECT pnl FROM game_results WHERE user_id = :user_id
+        ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET 10
+    """, {"user_id": 1}),
+    "history page": ("""
+        SELECT id, game_id, scenario, pnl, accuracy, trades_completed, time_taken, created_at
+        FROM game_results
+        WHERE user_id = :user_id AND (created_at, id) < (:cursor_created_at, :cursor_id)
+        ORDER BY created_at DESC, id DESC
+        LIMIT 21
+    """, {"user_id": 1, "cursor_created_at": "2030-01-01", "cursor_id": 1}),
+    "history page by scenario and date": ("""
+        SELECT id, game_id, scenario, pnl, accuracy, trades_completed, time_taken, created_at
+        FROM game_results
+        WHERE user_id = :user_id AND scenario = :scenario
+            AND created_at >= :start AND created_at < date(:end, '+1 day')
+        ORDER BY created_at DESC, id DESC
+        LIMIT 21
+    """, {"user_id": 1, "scenario": "scenario", "start": "2024-01-01", "end": "2024-12-31"}),
+    "user by name": ("SELECT * FROM users WHERE username = :username", {"username": "user"}),
+    "user by id": ("SELECT username FROM users WHERE id = :user_id", {"user_id": 1}),
+    "game by id": ("UPDATE games SET status = 'completed' WHERE id = :game_id", {"game_id": "game"}),
+}
+
+
+def migrate(path):
+    """
+    Apply every migration newer than the database's user_version
+    """
+    connection = sqlite3.connect(path, isolation_level=None)
+    try:
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        for number, description, statements in MIGRATIONS:
+            if number <= version:
+                continue
+            print(f"Applying migration {number}: {description}")
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for statement in statements:
+                    connection.execute(statement)
+                connection.execute(f"PRAGMA user_version = {number}")
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+    finally:
+        connection.close()
+
+
+def check_query_plans(path):
+    """
+    Run EXPLAIN QUERY PLAN on every hot statement and return the ones that scan a whole table
+    """
+    connection = sqlite3.connect(path)
+    problems = []
+    try:
+        for name, (sql, params) in HOT_QUERIES.items():
+            plan = [row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+            # Scanning a subquery's own rows is fine, scanning a table or index is not
+            subqueries = {match.group(2) for match in
+                          (re.match(r"(CO-ROUTINE|MATERIALIZE) (\w+)", detail) for detail in plan) if match}
+            for detail in plan:
+                match = re.match(r"SCAN (\w+)", detail)
+                if match and match.group(1) not in subqueries:
+                    problems.append((name, detail))
+    finally:
+        connection.close()
+    return problems
+
+
+if __name__ == "__main__":
+    # Usage: python migrations.py [path/to/database]
+    database = sys.argv[1] if len(sys.argv) > 1 else "gamefiles.db"
+    migrate(database)
+    problems = check_query_plans(database)
+    for name, detail in problems:
+        print(f"Full scan in {name}: {detail}")
+    if problems:
+        sys.exit(1)
+    print(f"All {len(HOT_QUERIES)} hot queries use an index")
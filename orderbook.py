@@ -0,0 +1,427 @@
+# orderbook.py contains the in-memory matching engine used by every lobby. Each lobby owns one OrderBook which keeps its bids and asks in sorted price levels with a FIFO queue per level, so matching never has to touch the database.
+import bisect
+import itertools
+from collections import deque
+from itertools import islice
+
+# Monotonic counter used to break ties between orders at the same price
+_sequence = itertools.count(1)
+
+COMPACTION_SLACK = 16  # Cancelled orders a price level may hold beyond its live ones before its queue is rebuilt
+
+
+class Order:
+    """
+    A resting order in the book
+    """
+    __slots__ = ("id", "user_id", "order_type", "price", "quantity", "seq", "live")
+
+    def __init__(self, order_id, user_id, order_type, price, quantity):
+        self.id = order_id
+        self.user_id = user_id
+        self.order_type = order_type
+        self.price = price
+        self.quantity = quantity
+        self.seq = next(_sequence)
+        self.live = True  # False once cancelled; the order stays in its level's queue until it is swept out
+
+
+class PriceLevel:
+    """
+    All resting orders at a single price, in time priority, with their total quantity and count.
+    The queue may also hold cancelled orders, which the quantity and count leave out.
+    """
+    __slots__ = ("price", "orders", "quantity", "count")
+
+    def __init__(self, price):
+        self.price = price
+        self.orders = deque()
+        self.quantity = 0
+        self.count = 0
+
+
+class OwnedOrders:
+    """
+    One participant's resting orders on a side of a market snapshot: their sort keys in book order and total quantity
+    """
+    __slots__ = ("keys", "quantity")
+
+    def __init__(self):
+        self.keys = []
+        self.quantity = 0
+
+
+class OrderBook:
+    def __init__(self, lobby_id, depth=10):
+        """
+        Initialize an empty book for a lobby. Market data covers only the best `depth` levels per side.
+        """
+        self.lobby_id = lobby_id
+        self.depth_levels = depth
+        self.orders = {}  # order id -> Order
+        self.owners = {}  # user id -> {"bid": {order id: Order}, "ask": {...}}, each oldest first
+
+        # Price levels for each side, plus a sorted list of keys per side.
+        # Keys are ordered so that the best price is always the last element:
+        # bids use the price itself, asks use the negated price.
+        self.levels = {"bid": {}, "ask": {}}
+        self.keys = {"bid": [], "ask": []}
+
+        # Market data state: the version of the last published delta, which sides
+        # changed since then, and the top levels clients were last sent
+        self.version = 0
+        self.changed = {"bid": False, "ask": False}
+        self.published = {"bid": {}, "ask": {}}
+
+    @staticmethod
+    def _key(order_type, price):
+        return price if order_type == "bid" else -price
+
+    def add_order(self, order_id, user_id, order_type, price, quantity):
+        """
+        Rest a new order at the back of its price level
+        """
+        order = Order(order_id, user_id, order_type, price, quantity)
+        levels = self.levels[order_type]
+        level = levels.get(price)
+        if level is None:
+            level = levels[price] = PriceLevel(price)
+            bisect.insort(self.keys[order_type], self._key(order_type, price))
+        level.orders.append(order)
+        level.quantity += quantity
+        level.count += 1
+        self.orders[order_id] = order
+        owned = self.owners.get(user_id)
+        if owned is None:
+            owned = self.owners[user_id] = {"bid": {}, "ask": {}}
+        owned[order_type][order_id] = order
+        self.changed[order_type] = True
+        return order
+
+    def cancel(self, order_id):
+        """
+        Take a resting order off the book in O(1), returning it, or None if it is no longer resting.
+        The order is only marked cancelled in its level's queue, which matching sweeps out later.
+        """
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return None
+        order.live = False
+        del self.owners[order.user_id][order.order_type][order_id]
+        self.changed[order.order_type] = True
+
+        level = self.levels[order.order_type][order.price]
+        level.quantity -= order.quantity
+        level.count -= 1
+        if level.count == 0:
+            self._remove_level(order.order_type, order.price)
+        elif len(level.orders) > 2 * level.count + COMPACTION_SLACK:
+            # Rebuild a queue that is mostly cancelled orders, so each cancel stays amortized O(1)
+            level.orders = deque(resting for resting in level.orders if resting.live)
+        return order
+
+    def user_orders(self, user_id, order_type):
+        """
+        Return the ids of a user's resting orders on a side, oldest first
+        """
+        owned = self.owners.get(user_id)
+        return list(owned[order_type]) if owned else []
+
+    def crossing_orders(self, user_id, trade_type, limit_price):
+        """
+        Return the ids of a user's own resting orders that their incoming buy/sell up to `limit_price` would reach
+        """
+        owned = self.owners.get(user_id)
+        if not owned:
+            return []
+        if trade_type == "buy":
+            return [order_id for order_id, order in owned["ask"].items() if order.price <= limit_price]
+        return [order_id for order_id, order in owned["bid"].items() if order.price >= limit_price]
+
+    def _remove_level(self, order_type, price):
+        """
+        Drop an empty price level and its key
+        """
+        del self.levels[order_type][price]
+        keys = self.keys[order_type]
+        del keys[bisect.bisect_left(keys, self._key(order_type, price))]
+
+    def best(self, order_type):
+        """
+        Return the best price level on a side, or None if the side is empty
+        """
+        keys = self.keys[order_type]
+        if not keys:
+            return None
+        key = keys[-1]
+        return self.levels[order_type][key if order_type == "bid" else -key]
+
+    def match(self, user_id, trade_type, limit_price, quantity):
+        """
+        Sweep an incoming buy/sell across as many resting orders and price levels as
+        needed, up to its limit price. The user's own resting orders are skipped, so callers
+        cancel the ones returned by crossing_orders first rather than rest through them.
+        """
+        resting_type = "ask" if trade_type == "buy" else "bid"
+        levels = self.levels[resting_type]
+        keys = self.keys[resting_type]
+        fills = []
+        emptied = []
+
+        for key in reversed(keys):
+            if quantity <= 0:
+                break
+            level = levels[key if resting_type == "bid" else -key]
+            if trade_type == "buy" and level.price > limit_price:
+                break
+            if trade_type == "sell" and level.price < limit_price:
+                break
+
+            # Walk the level in time priority
+            queue = level.orders
+            i = 0
+            while i < len(queue) and quantity > 0:
+                resting = queue[i]
+                if not resting.live:
+                    del queue[i]
+                    continue
+                if resting.user_id == user_id:
+                    i += 1
+                    continue
+                fill_quantity = min(resting.quantity, quantity)
+                resting.quantity -= fill_quantity
+                level.quantity -= fill_quantity
+                quantity -= fill_quantity
+                self.changed[resting_type] = True
+                fills.append({
+                    "order_id": resting.id,
+                    "buyer_id": user_id if trade_type == "buy" else resting.user_id,
+                    "seller_id": resting.user_id if trade_type == "buy" else user_id,
+                    "price": resting.price,
+                    "quantity": fill_quantity,
+                    "remaining": resting.quantity,
+                })
+                if resting.quantity <= 0:
+                    del queue[i]
+                    del self.orders[resting.id]
+                    del self.owners[resting.user_id][resting_type][resting.id]
+                    level.count -= 1
+            if level.count == 0:
+                emptied.append(level.price)
+
+        for price in emptied:
+            self._remove_level(resting_type, price)
+        return fills
+
+    def top_levels(self, order_type):
+        """
+        Return the best `depth` price levels on a side as price -> (quantity, orders)
+        """
+        return {level.price: (level.quantity, level.count)
+                for level in islice(self.iter_levels(order_type), self.depth_levels)}
+
+    def drain_deltas(self):
+        """
+        Diff the top levels of each side that changed since the last call against what
+        clients were last sent, returning add/modify/remove deltas and the new version
+        """
+        deltas = []
+        for order_type in ("bid", "ask"):
+            if not self.changed[order_type]:
+                continue
+            self.changed[order_type] = False
+            published = self.published[order_type]
+            current = self.top_levels(order_type)
+
+            # Levels that filled, or were pushed out of the top by better prices
+            for price in [price for price in published if price not in current]:
+                del published[price]
+                deltas.append({"action": "remove", "side": order_type, "price": price})
+
+            # New levels, and levels whose quantity or order count changed
+            for price, level in current.items():
+                if price not in published:
+                    action = "add"
+                elif published[price] != level:
+                    action = "modify"
+                else:
+                    continue
+                published[price] = level
+                deltas.append({"action": action, "side": order_type,
+                              "price": price, "quantity": level[0], "orders": level[1]})
+
+        if deltas:
+            self.version += 1
+        return self.version, deltas
+
+    def snapshot(self):
+        """
+        Return the top of the book as clients were last sent it, tagged with that version.
+        Changes not drained yet are left out, so the deltas that follow apply on top of it.
+        """
+        def levels(order_type):
+            published = self.published[order_type]
+            return [{"price": price, "quantity": published[price][0], "orders": published[price][1]}
+                    for price in sorted(published, reverse=order_type == "bid")]
+
+        return {"seq": self.version, "bids": levels("bid"), "asks": levels("ask")}
+
+    def iter_levels(self, order_type):
+        """
+        Yield the price levels on a side, best first
+        """
+        levels = self.levels[order_type]
+        for key in reversed(self.keys[order_type]):
+            yield levels[key if order_type == "bid" else -key]
+
+    def iter_orders(self, order_type):
+        """
+        Yield resting orders on a side in price-time priority
+        """
+        for level in self.iter_levels(order_type):
+            for order in level.orders:
+                if order.live:
+                    yield order
+
+
+class MarketSnapshot:
+    """
+    Read-only view of a lobby's market shared by every bot in a tick. It is
+    taken from the book once and then updated incrementally with the orders
+    and fills of that tick's bots, instead of being rebuilt for each bot.
+    Per-side totals and per-owner indexes let each bot see the market without
+    its own orders without copying or scanning the rows.
+    """
+
+    def __init__(self, book, stats):
+        self.rows = {"bid": [], "ask": []}  # resting orders as dicts, best first
+        self.keys = {"bid": [], "ask": []}  # matching sort keys, for bisect
+        self.by_id = {}  # order id -> sort key
+        self.quantity = {"bid": 0, "ask": 0}  # total resting quantity per side
+        self.owned = {"bid": {}, "ask": {}}  # user id -> OwnedOrders, per side
+        for order_type in ("bid", "ask"):
+            for order in book.iter_orders(order_type):
+                key = self._key(order)
+                self.rows[order_type].append(self._row(order))
+                self.keys[order_type].append(key)
+                self.by_id[order.id] = key
+                self._own(order_type, order.user_id, order.quantity).keys.append(key)
+                self.quantity[order_type] += order.quantity
+        self.stats = stats  # The lobby's MarketStats, kept up to date by the fills themselves
+
+    @staticmethod
+    def _key(order):
+        return (-order.price if order.order_type == "bid" else order.price, order.seq)
+
+    @staticmethod
+    def _row(order):
+        return {"price": order.price, "user_id": order.user_id, "quantity": order.quantity}
+
+    def _own(self, order_type, user_id, quantity):
+        """
+        Add quantity to a participant's resting total on a side, returning their orders there
+        """
+        owned = self.owned[order_type].get(user_id)
+        if owned is None:
+            owned = self.owned[order_type][user_id] = OwnedOrders()
+        owned.quantity += quantity
+        return owned
+
+    def add_order(self, order):
+        """
+        Add an order that was just rested in the book
+        """
+        key = self._key(order)
+        i = bisect.bisect_left(self.keys[order.order_type], key)
+        self.keys[order.order_type].insert(i, key)
+        self.rows[order.order_type].insert(i, self._row(order))
+        self.by_id[order.id] = key
+        bisect.insort(self._own(order.order_type, order.user_id, order.quantity).keys, key)
+        self.quantity[order.order_type] += order.quantity
+
+    def _drop(self, order_type, i, order_id):
+        """
+        Remove the row at position i, which holds the given order
+        """
+        key = self.keys[order_type][i]
+        user_id = self.rows[order_type][i]["user_id"]
+        del self.keys[order_type][i]
+        del self.rows[order_type][i]
+        del self.by_id[order_id]
+        owned = self.owned[order_type][user_id]
+        del owned.keys[bisect.bisect_left(owned.keys, key)]
+        if not owned.keys:
+            del self.owned[order_type][user_id]
+
+    def remove_order(self, order):
+        """
+        Remove an order that was just cancelled from the book
+        """
+        key = self.by_id.get(order.id)
+        if key is None:
+            return
+        i = bisect.bisect_left(self.keys[order.order_type], key)
+        quantity = self.rows[order.order_type][i]["quantity"]
+        self._own(order.order_type, order.user_id, -quantity)
+        self.quantity[order.order_type] -= quantity
+        self._drop(order.order_type, i, order.id)
+
+    def apply_fills(self, fills, resting_type):
+        """
+        Reduce or remove the resting orders hit by a sweep
+        """
+        keys = self.keys[resting_type]
+        rows = self.rows[resting_type]
+        for fill in fills:
+            key = self.by_id.get(fill["order_id"])
+            if key is None:
+                continue
+            i = bisect.bisect_left(keys, key)
+            self._own(resting_type, rows[i]["user_id"], -fill["quantity"])
+            self.quantity[resting_type] -= fill["quantity"]
+            if fill["remaining"] > 0:
+                rows[i] = dict(rows[i], quantity=fill["remaining"])
+            else:
+                self._drop(resting_type, i, fill["order_id"])
+
+    def best(self, order_type, exclude=None):
+        """
+        Return the best resting order on a side as a row, skipping the orders of `exclude`
+        """
+        rows = self.rows[order_type]
+        owned = self.owned[order_type].get(exclude)
+        i = 0
+        if owned:
+            # The excluded orders are a sorted subset of the side, so only those at the very top are passed over
+            keys = self.keys[order_type]
+            while i < len(owned.keys) and keys[i] == owned.keys[i]:
+                i += 1
+        return rows[i] if i < len(rows) else None
+
+    def average_quantity(self, order_type, exclude=None):
+        """
+        Average quantity of the resting orders on a side, leaving out the orders of `exclude`, 1 if there are none
+        """
+        quantity = self.quantity[order_type]
+        count = len(self.rows[order_type])
+        owned = self.owned[order_type].get(exclude)
+        if owned:
+            quantity -= owned.quantity
+            count -= len(owned.keys)
+        return quantity / count if count else 1
+
+    def view(self, user_id=None):
+        """
+        Return the market state in the shape bots expect. For a given participant the best
+        prices and average depths leave out their own orders; all_bids and all_asks are
+        the shared rows and include them.
+        """
+        return {
+            "best_bid": self.best("bid", user_id),
+            "best_ask": self.best("ask", user_id),
+            "bid_depth": self.average_quantity("bid", user_id),
+            "ask_depth": self.average_quantity("ask", user_id),
+            "all_bids": self.rows["bid"],
+            "all_asks": self.rows["ask"],
+            "stats": self.stats,
+        }
@@ -0,0 +1,78 @@
+# publisher.py contains the per-room publisher that batches Socket.IO emissions. State updates (like the order book) are conflated so a burst of changes is sent once with the latest state, while events that must all arrive (like trade prints) are queued and sent in order.
+import heapq
+import threading
+import time
+from collections import deque
+
+
+class RoomPublisher:
+    def __init__(self, emit, window=0.05):
+        """
+        Initialize the publisher with the function used to emit and the conflation window in seconds
+        """
+        self.emit = emit
+        self.window = window
+        self.condition = threading.Condition()
+        self.pending = {}  # room -> {"events": deque of (event, payload), "latest": {event: build}}
+        self.due = []  # heap of (flush time, room)
+        self.thread = None
+
+    def _room(self, room):
+        """
+        Get the pending emissions of a room, scheduling a flush if there were none
+        """
+        pending = self.pending.get(room)
+        if pending is None:
+            pending = self.pending[room] = {"events": deque(), "latest": {}}
+            heapq.heappush(self.due, (time.monotonic() + self.window, room))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return pending
+
+    def publish_in_order(self, room, event, payload):
+        """
+        Queue an event that must be delivered, in order, with the room's next flush
+        """
+        with self.condition:
+            self._room(room)["events"].append((event, payload))
+
+    def publish_latest(self, room, event, build):
+        """
+        Mark a conflated event as stale. `build` is called once at flush time and
+        returns the payload to send, or None if there is nothing to send.
+        """
+        with self.condition:
+            self._room(room)["latest"][event] = build
+
+    def flush(self, room):
+        """
+        Send everything pending for a room right away
+        """
+        with self.condition:
+            pending = self.pending.pop(room, None)
+        if pending is None:
+            return
+
+        # In-order events go first, so the state that follows already reflects them
+        for event, payload in pending["events"]:
+            self.emit(event, payload, room=room)
+        for event, build in pending["latest"].items():
+            payload = build()
+            if payload is not None:
+                self.emit(event, payload, room=room)
+
+    def _run(self):
+        """
+        Flush each room once its conflation window has passed
+        """
+        while True:
+            with self.condition:
+                while not self.due or self.due[0][0] > time.monotonic():
+                    self.condition.wait(self.due[0][0] - time.monotonic() if self.due else None)
+                _, room = heapq.heappop(self.due)
+            try:
+                self.flush(room)
+            except Exception as e:
+                print(f"Error publishing to room {room}: {e}")
@@ -0,0 +1,114 @@
+# scheduler.py contains the shared job scheduler. A single dispatcher thread keeps every job in a timer heap and hands due jobs to a small worker pool, so hundreds of lobbies do not each need their own sleeping thread.
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """
+    A scheduled call, optionally repeating every `interval` seconds
+    """
+    __slots__ = ("key", "fn", "interval", "cancelled")
+
+    def __init__(self, key, fn, interval):
+        self.key = key
+        self.fn = fn
+        self.interval = interval
+        self.cancelled = False
+
+
+class Scheduler:
+    def __init__(self, workers=4):
+        """
+        Initialize the scheduler with the size of its worker pool
+        """
+        self.workers = workers
+        self.condition = threading.Condition()
+        self.heap = []  # (run at, tie breaker, job)
+        self.jobs = {}  # key -> Job
+        self.counter = itertools.count()
+        self.pool = None
+        self.thread = None
+
+    def _push(self, job, delay):
+        heapq.heappush(self.heap, (time.monotonic() + delay, next(self.counter), job))
+        self.condition.notify()
+
+    def _start(self):
+        if self.thread is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduler")
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def every(self, key, interval, fn, delay=0):
+        """
+        Run `fn` every `interval` seconds until it returns False or the key is cancelled.
+        Returns False without scheduling anything if the key is already scheduled.
+        """
+        with self.condition:
+            if key in self.jobs:
+                return False
+            job = self.jobs[key] = Job(key, fn, interval)
+            self._start()
+            self._push(job, delay)
+            return True
+
+    def call_later(self, key, delay, fn):
+        """
+        Run `fn` once after `delay` seconds, replacing any job already scheduled under the key
+        """
+        with self.condition:
+            self._cancel(key)
+            job = self.jobs[key] = Job(key, fn, None)
+            self._start()
+            self._push(job, delay)
+
+    def _cancel(self, key):
+        job = self.jobs.pop(key, None)
+        if job:
+            job.cancelled = True
+
+    def cancel(self, key):
+        """
+        Unschedule a job. A run already in progress finishes but is not repeated.
+        """
+        with self.condition:
+            self._cancel(key)
+
+    def is_scheduled(self, key):
+        with self.condition:
+            return key in self.jobs
+
+    def _run(self):
+        """
+        Hand each job to the worker pool when it comes due
+        """
+        while True:
+            with self.condition:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.condition.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                _, _, job = heapq.heappop(self.heap)
+            if not job.cancelled:
+                self.pool.submit(self._execute, job)
+
+    def _execute(self, job):
+        """
+        Run a job, then put it back in the heap if it repeats. A job is only
+        requeued after it finishes, so the same key never runs twice at once.
+        """
+        try:
+            result = job.fn()
+        except Exception as e:
+            print(f"Error in scheduled job {job.key}: {e}")
+            result = None
+
+        with self.condition:
+            if job.cancelled:
+                return
+            if job.interval is None or result is False:
+                if self.jobs.get(job.key) is job:
+                    del self.jobs[job.key]
+                return
+            self._push(job, job.interval)
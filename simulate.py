@@ -0,0 +1,265 @@
+# simulate.py contains the headless game simulator. It plays whole games of bots, and optionally a scripted human, through the same lobby market commands as the app, with a simulated clock and a seeded random generator. Games run as fast as the CPU allows and are spread across a process pool, and the report covers fills per second, spreads, price discovery error and P&L per bot level, for tuning bots and catching performance regressions offline.
+# Usage: python simulate.py --games 20 --bots easy=2,medium=2,hard=1 --seed 1 --workers 4 [--engine vector]
+import argparse
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from bots import Bot
+from lobbymarket import LobbyMarket
+from markets import MARKETS
+from vectorbots import VectorBotEngine
+
+HUMAN_ID = "human"
+
+
+class SimulatedClock:
+    """
+    A clock that only moves when the simulation advances it
+    """
+
+    def __init__(self, start=datetime(2024, 1, 1)):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def advance(self, seconds):
+        self.current += timedelta(seconds=seconds)
+
+
+# Scripted humans: called once per tick with the tick number, the market view and the game's
+# random generator, they return the orders and trades the human sends that tick
+def taker_script(tick, market, rng):
+    """
+    Every third tick, lift the best ask or hit the best bid for a few contracts
+    """
+    if tick % 3:
+        return []
+    side = "best_ask" if rng.random() < 0.5 else "best_bid"
+    if not market[side]:
+        return []
+    trade_type = "buy" if side == "best_ask" else "sell"
+    return [{"action": "trade", "type": trade_type, "price": market[side]["price"], "quantity": rng.randint(1, 3)}]
+
+
+def quoter_script(tick, market, rng):
+    """
+    Every fifth tick, join the best bid and the best ask
+    """
+    if tick % 5 or not market["best_bid"] or not market["best_ask"]:
+        return []
+    return [
+        {"action": "order", "type": "bid", "price": market["best_bid"]["price"], "quantity": rng.randint(1, 5)},
+        {"action": "order", "type": "ask", "price": market["best_ask"]["price"], "quantity": rng.randint(1, 5)},
+    ]
+
+
+SCRIPTS = {
+    "taker": taker_script,
+    "quoter": quoter_script,
+}
+
+
+class SimulatedGame:
+    def __init__(self, question, bot_levels, seed, game_length=300, tick_interval=5, human=None, engine="objects",
+                 max_live_quotes=1, quote_lifetime=None):
+        """
+        Set up a game on one market question. bot_levels maps a bot level to how many bots play at it.
+        The bots are Bot objects, or one VectorBotEngine for all of them with engine="vector",
+        and keep at most max_live_quotes resting quotes per side, each expiring after quote_lifetime
+        seconds if it is set.
+        """
+        self.question = question
+        self.fair_value = MARKETS[question]
+        self.game_length = game_length
+        self.tick_interval = tick_interval
+        self.human = SCRIPTS[human] if human else None
+        self.rng = random.Random(seed)
+        self.clock = SimulatedClock()
+
+        # The same market and commands as a live lobby, without the database or the room to publish to
+        lobby_id = f"sim-{seed}"
+        self.market = LobbyMarket(lobby_id, self.fair_value, clock=lambda: self.clock.now().timestamp(),
+                                  rng=self.rng, on_fills=self._record,
+                                  max_live_quotes=max_live_quotes, quote_lifetime=quote_lifetime)
+        self.levels = {f"{level}-{i}": level for level, count in bot_levels.items() for i in range(count)}
+        self.bots = []
+        self.engine = None
+        if engine == "vector":
+            self.engine = VectorBotEngine(list(self.levels), list(self.levels.values()),
+                                          self.fair_value, self.clock.now(), np.random.default_rng(seed))
+        else:
+            self.bots = [Bot(bot_id, bot_id, self.fair_value, lobby_id, level, clock=self.clock.now, rng=self.rng)
+                         for bot_id, level in self.levels.items()]
+        if self.human:
+            self.levels[HUMAN_ID] = f"human ({human})"
+
+        self.fills = 0
+        self.expired = 0
+        self.volume = 0
+        self.spreads = []  # Relative spread sampled at the end of every tick
+        self.trade_prices = []
+
+    def _record(self, fills):
+        for fill in fills:
+            self.trade_prices.append(fill["price"])
+            self.volume += fill["quantity"]
+        self.fills += len(fills)
+
+    def run(self):
+        """
+        Play the whole game and return its metrics
+        """
+        market = self.market
+        started = time.perf_counter()
+        for tick in range(self.game_length // self.tick_interval):
+            self.clock.advance(self.tick_interval)
+            self.expired += market.expire_orders()
+            snapshot = market.snapshot()
+            if self.engine:
+                market.vector_bot_tick(self.engine, snapshot)
+            else:
+                for bot in self.bots:
+                    market.bot_turn(bot, snapshot)
+
+            if self.human:
+                for action in self.human(tick, snapshot.view(), self.rng):
+                    if action["action"] == "order":
+                        market.place_order(HUMAN_ID, action["type"], action["price"], action["quantity"],
+                                           snapshot=snapshot)
+                    else:
+                        market.execute_trade(HUMAN_ID, action["type"], action["price"], action["quantity"], snapshot)
+
+            best_bid = market.book.best("bid")
+            best_ask = market.book.best("ask")
+            if best_bid and best_ask:
+                self.spreads.append((best_ask.price - best_bid.price) / self.fair_value)
+        elapsed = time.perf_counter() - started
+
+        # Price discovery: how far the last trades of the game ended up from the answer
+        closing = self.trade_prices[-10:]
+        discovery_error = abs(statistics.fmean(closing) - self.fair_value) / self.fair_value if closing else None
+        return {
+            "question": self.question,
+            "elapsed": elapsed,
+            "fills": self.fills,
+            "cancels": market.cancelled - self.expired,
+            "expired": self.expired,
+            "resting": len(market.book.orders),
+            "volume": self.volume,
+            "mean_spread": statistics.fmean(self.spreads) if self.spreads else None,
+            "discovery_error": discovery_error,
+            "pnl": [dict(entry, level=self.levels[entry["user_id"]]) for entry in market.ledger.results()],
+        }
+
+
+def run_game(config):
+    """
+    Play one game from a config dict, in a worker process
+    """
+    return SimulatedGame(**config).run()
+
+
+def run_games(configs, workers=None):
+    """
+    Play every game across a process pool and return their metrics, in order
+    """
+    if workers == 1:
+        return [run_game(config) for config in configs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_game, configs))
+
+
+def summarize(results, elapsed):
+    """
+    Aggregate the metrics of many games into one report
+    """
+    fills = sum(result["fills"] for result in results)
+    spreads = [result["mean_spread"] for result in results if result["mean_spread"] is not None]
+    errors = [result["discovery_error"] for result in results if result["discovery_error"] is not None]
+    pnl_by_level = {}
+    for result in results:
+        for entry in result["pnl"]:
+            pnl_by_level.setdefault(entry["level"], []).append(entry["pnl"] / MARKETS[result["question"]])
+    return {
+        "games": len(results),
+        "fills": fills,
+        "cancels": sum(result["cancels"] for result in results),
+        "expired": sum(result["expired"] for result in results),
+        "mean_resting": statistics.fmean(result["resting"] for result in results) if results else 0,
+        "fills_per_second": fills / elapsed if elapsed else 0,
+        "engine_fills_per_second": fills / sum(result["elapsed"] for result in results) if fills else 0,
+        "mean_spread": statistics.fmean(spreads) if spreads else None,
+        "mean_discovery_error": statistics.fmean(errors) if errors else None,
+        # P&L relative to the market's fair value, so different questions can be compared
+        "pnl_by_level": {level: statistics.fmean(values) for level, values in pnl_by_level.items()},
+    }
+
+
+def parse_bots(value):
+    """
+    Parse "easy=2,medium=3" into {"easy": 2, "medium": 3}
+    """
+    levels = {}
+    for part in value.split(","):
+        level, _, count = part.partition("=")
+        levels[level.strip()] = int(count or 1)
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play headless games of bots as fast as possible")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--bots", type=parse_bots, default=parse_bots("easy=1,medium=2,hard=1,Jane Street=1"),
+                        help='bots per level, e.g. "easy=2,medium=2,hard=1"')
+    parser.add_argument("--question", action="append", help="market question to play (repeatable), random by default")
+    parser.add_argument("--human", choices=sorted(SCRIPTS), help="add a scripted human to every game")
+    parser.add_argument("--length", type=int, default=300, help="simulated game length in seconds")
+    parser.add_argument("--tick", type=int, default=5, help="simulated seconds between bot ticks")
+    parser.add_argument("--engine", choices=["objects", "vector"], default="objects",
+                        help="one Bot object per bot, or the vectorized engine for all of them")
+    parser.add_argument("--max-quotes", type=int, default=1, help="resting quotes each bot keeps per side")
+    parser.add_argument("--quote-lifetime", type=float, default=None, help="seconds before a bot quote expires")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, 1 to run in-process")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    questions = args.question or list(MARKETS)
+    configs = [
+        {
+            "question": rng.choice(questions),
+            "bot_levels": args.bots,
+            "seed": args.seed + i,
+            "game_length": args.length,
+            "tick_interval": args.tick,
+            "human": args.human,
+            "engine": args.engine,
+            "max_live_quotes": args.max_quotes,
+            "quote_lifetime": args.quote_lifetime,
+        }
+        for i in range(args.games)
+    ]
+
+    started = time.perf_counter()
+    results = run_games(configs, args.workers)
+    report = summarize(results, time.perf_counter() - started)
+
+    print(f"Games: {report['games']}, fills: {report['fills']}, cancels: {report['cancels']}, expired: {report['expired']}, "
+          f"resting orders at the end: {report['mean_resting']:.0f} per game")
+    print(f"Fills/sec: {report['fills_per_second']:.0f} overall, {report['engine_fills_per_second']:.0f} per worker")
+    if report["mean_spread"] is not None:
+        print(f"Mean spread: {report['mean_spread']:.2%} of fair value")
+    if report["mean_discovery_error"] is not None:
+        print(f"Mean price discovery error: {report['mean_discovery_error']:.2%}")
+    for level, pnl in sorted(report["pnl_by_level"].items(), key=lambda item: -item[1]):
+        print(f"  {level}: mean P&L {pnl:+.2f}x fair value")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# test_commands.py contains the tests of the per-lobby command queue
+import threading
+
+import pytest
+
+from commands import CommandQueue, LobbyClosed
+
+
+def test_submit_runs_commands_in_order():
+    queue = CommandQueue()
+    ran = []
+    threads = [threading.Thread(target=queue.submit, args=(ran.append, i)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(ran) == list(range(20))
+    assert queue.submit(lambda: "result") == "result"
+
+
+def test_submit_raises_the_command_error():
+    queue = CommandQueue()
+    with pytest.raises(ZeroDivisionError):
+        queue.submit(lambda: 1 / 0)
+    assert queue.submit(lambda: 1) == 1
+
+
+def test_closed_queue_refuses_commands():
+    queue = CommandQueue()
+
+    def final():
+        queue.close()
+        return "closed"
+
+    assert queue.submit(final) == "closed"
+    with pytest.raises(LobbyClosed):
+        queue.submit(lambda: "too late")
+
+
+def test_commands_queued_behind_the_final_one_fail():
+    queue = CommandQueue()
+    started = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def slow():
+        started.set()
+        release.wait()
+
+    def late():
+        try:
+            results.append(queue.submit(lambda: "ran"))
+        except LobbyClosed:
+            results.append("refused")
+
+    writer = threading.Thread(target=queue.submit, args=(slow,))
+    writer.start()
+    started.wait()
+    closer = threading.Thread(target=queue.submit, args=(queue.close,))
+    closer.start()
+    while len(queue.queue) < 1:
+        pass
+    waiter = threading.Thread(target=late)
+    waiter.start()
+    while len(queue.queue) < 2 and waiter.is_alive():
+        pass
+    release.set()
+    for thread in (writer, closer, waiter):
+        thread.join()
+
+    assert results == ["refused"]
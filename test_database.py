@@ -0,0 +1,53 @@
+# test_database.py contains the tests of the pooled SQLite access layer
+import threading
+
+import pytest
+
+from database import Database
+
+
+def make_db(tmp_path, **kwargs):
+    db = Database(str(tmp_path / "test.db"), **kwargs)
+    db.execute("CREATE TABLE counters (name TEXT PRIMARY KEY, value INTEGER)")
+    return db
+
+
+def test_execute_return_values(tmp_path):
+    db = make_db(tmp_path)
+    assert db.execute("INSERT INTO counters (name, value) VALUES (:name, 1)", name="a") == 1
+    assert db.execute("UPDATE counters SET value = value + 1") == 1
+    assert db.execute("SELECT name, value FROM counters") == [{"name": "a", "value": 2}]
+    with pytest.raises(ValueError):
+        db.execute("INSERT INTO counters (name, value) VALUES (:name, 1)", name="a")
+
+
+def test_transaction_rolls_back_on_error(tmp_path):
+    db = make_db(tmp_path)
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.execute("INSERT INTO counters (name, value) VALUES ('a', 1)")
+            with db.transaction():  # Joins the outer transaction
+                db.execute("INSERT INTO counters (name, value) VALUES ('b', 1)")
+            raise RuntimeError("abort")
+
+    assert db.execute("SELECT * FROM counters") == []
+
+
+def test_pool_stays_bounded_across_threads(tmp_path):
+    db = make_db(tmp_path, pool_size=2)
+    db.execute("INSERT INTO counters (name, value) VALUES ('a', 0)")
+
+    def work():
+        for _ in range(50):
+            with db.transaction():
+                value = db.execute("SELECT value FROM counters WHERE name = 'a'")[0]["value"]
+                db.execute("UPDATE counters SET value = :value WHERE name = 'a'", value=value + 1)
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert db.execute("SELECT value FROM counters")[0]["value"] == 300
+    assert db.opened <= 2
@@ -0,0 +1,72 @@
+# test_history.py contains the tests of the keyset-paginated game history
+import pytest
+
+from database import Database
+from migrations import migrate
+
+
+@pytest.fixture
+def history(baseline_database, tmp_path, monkeypatch):
+    """
+    The utilities module reading game results from a new, migrated database
+    """
+    # Importing utilities opens ./gamefiles.db, which must never be the real one
+    monkeypatch.chdir(tmp_path)
+    import utilities
+
+    migrate(baseline_database)
+    db = Database(baseline_database)
+    monkeypatch.setattr(utilities, "db", db)
+    return utilities, db
+
+
+def add_result(db, user_id, scenario, created_at):
+    return db.execute("""
+        INSERT INTO game_results (user_id, game_id, scenario, pnl, accuracy, time_taken, created_at, trades_completed)
+        VALUES (:user_id, 'game', :scenario, 1, 50, 300, :created_at, 2)
+    """, user_id=user_id, scenario=scenario, created_at=created_at)
+
+
+def all_pages(utilities, limit, **filters):
+    pages, cursor = [], None
+    while True:
+        games, cursor = utilities.get_history_page(1, cursor=cursor, limit=limit, **filters)
+        pages.append([game["id"] for game in games])
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_every_game_once_newest_first(history):
+    utilities, db = history
+    # Games ending in the same second are ordered by id, so ties never repeat or drop a game across pages
+    ids = [add_result(db, 1, "a", created_at) for created_at in
+           ["2024-01-01 10:00:00", "2024-01-02 10:00:00", "2024-01-02 10:00:00", "2024-01-02 10:00:00",
+            "2024-01-03 10:00:00", "2024-01-04 10:00:00"]]
+    add_result(db, 2, "a", "2024-01-05 10:00:00")
+
+    newest_first = [ids[5], ids[4], ids[3], ids[2], ids[1], ids[0]]
+    assert all_pages(utilities, 2) == [newest_first[0:2], newest_first[2:4], newest_first[4:6]]
+    assert all_pages(utilities, 4) == [newest_first[0:4], newest_first[4:6]]
+    assert all_pages(utilities, 6) == [newest_first]
+    assert all_pages(utilities, 10) == [newest_first]
+
+
+def test_filters_by_scenario_and_inclusive_dates(history):
+    utilities, db = history
+    first = add_result(db, 1, "a", "2024-01-01 23:59:59")
+    add_result(db, 1, "b", "2024-01-01 12:00:00")
+    second = add_result(db, 1, "a", "2024-01-02 00:00:00")
+    third = add_result(db, 1, "a", "2024-01-03 00:00:00")
+
+    assert all_pages(utilities, 1, scenario="a", start="2024-01-01", end="2024-01-02") == [[second], [first]]
+    assert all_pages(utilities, 5, start="2024-01-03") == [[third]]
+
+
+def test_bad_cursors_and_dates_are_rejected(history):
+    utilities, _ = history
+    with pytest.raises(ValueError):
+        utilities.get_history_page(1, cursor="not a cursor")
+    with pytest.raises(ValueError):
+        utilities.get_history_page(1, start="01/02/2024")
+    assert utilities.decode_history_cursor(
+        utilities.encode_history_cursor({"created_at": "2024-01-02 10:00:00", "id": 7})) == ("2024-01-02 10:00:00", 7)
@@ -0,0 +1,49 @@
+# test_ledger.py contains the tests of the per-lobby ledger and its ranking
+from ledger import Ledger
+
+
+def test_fills_move_cash_and_contracts():
+    ledger = Ledger(1, fair_value=50)
+    ledger.record_fill("buyer", "seller", 48, 3)
+
+    assert ledger.portfolio("buyer")["contracts"] == 3
+    assert ledger.portfolio("buyer")["cash"] == -144
+    assert ledger.portfolio("seller")["contracts"] == -3
+    assert ledger.portfolio("seller")["cash"] == 144
+    assert ledger.portfolio("nobody") == {"contracts": 0, "cash": 0.0}
+    assert "pnl" not in ledger.portfolio("buyer")
+    assert ledger.version == 1
+
+
+def test_ranking_follows_pnl():
+    ledger = Ledger(1, fair_value=50)
+    ledger.record_fill("a", "b", 48, 3)  # a +6, b -6
+    ledger.record_fill("a", "c", 40, 1)  # a +16, c -10
+
+    assert [entry["user_id"] for entry in ledger.results()] == ["a", "b", "c"]
+    assert [entry["user_id"] for entry in ledger.results(limit=2)] == ["a", "b"]
+
+
+def test_accuracy_counts_trades_better_than_fair():
+    ledger = Ledger(1, fair_value=50)
+    ledger.record_fill("a", "b", 48, 1)
+    ledger.record_fill("b", "a", 45, 1)
+
+    entries = {entry["user_id"]: entry for entry in ledger.results()}
+    assert entries["a"]["accuracy"] == 50
+    assert entries["b"]["accuracy"] == 50
+    assert entries["a"]["trade_count"] == 2
+
+
+def test_live_standings_are_marked_to_the_given_price():
+    ledger = Ledger(1, fair_value=50)
+    ledger.record_fill("a", "b", 48, 3)
+
+    # At the last trade price both positions are flat; only the hidden fair value separates them
+    standings = ledger.standings(48)
+    assert [entry["pnl"] for entry in standings] == [0, 0]
+    assert all("accuracy" not in entry for entry in standings)
+
+    ledger.record_fill("c", "a", 60, 1)  # a sells one at 60, c buys it
+    assert [entry["user_id"] for entry in ledger.standings(60)] == ["a", "c", "b"]
+    assert [entry["user_id"] for entry in ledger.standings(60, limit=1)] == ["a"]
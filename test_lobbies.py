@@ -0,0 +1,48 @@
+# test_lobbies.py contains the tests of the lobby registry
+import threading
+import time
+
+from lobbies import LobbyRegistry
+
+
+def make_registry():
+    registry = LobbyRegistry()
+    registry.add({"id": "lobby", "status": "waiting", "players": [{"id": "1", "name": "alice"}]})
+    return registry
+
+
+def test_players_are_indexed_by_lobby():
+    registry = make_registry()
+    registry.add_player("lobby", {"id": "2", "name": "bob"})
+
+    assert registry.lobby_of("2")["id"] == "lobby"
+    assert registry.player_name("lobby", "2") == "bob"
+    registry.remove_player("lobby", "2")
+    assert registry.lobby_of("2") is None
+    assert [player["id"] for player in registry.get("lobby")["players"]] == ["1"]
+
+    registry.remove("lobby")
+    assert registry.lobby_of("1") is None
+    assert len(registry) == 0
+
+
+def test_a_lobby_is_started_once():
+    registry = make_registry()
+    opened = []
+
+    def open_market(lobby_id):
+        time.sleep(0.01)  # Give the other requests every chance to get in between
+        opened.append(lobby_id)
+
+    started = []
+    threads = [threading.Thread(target=lambda: started.append(registry.start("lobby", open_market)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert opened == ["lobby"]
+    assert sorted(started) == [False] * 7 + [True]
+    assert registry.get("lobby")["status"] == "in_progress"
+    assert not registry.start("missing", open_market)
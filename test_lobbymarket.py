@@ -0,0 +1,108 @@
+# test_lobbymarket.py contains the tests of a lobby market's order commands
+import pytest
+
+from lobbymarket import LobbyMarket
+
+
+def make_market(**kwargs):
+    now = [1000.0]
+    market = LobbyMarket("test", 50, clock=lambda: now[0], **kwargs)
+    return market, now
+
+
+def test_resting_order_cancels_own_crossing_orders():
+    market, _ = make_market()
+    market.place_order("u", "ask", 50, 5)
+    fills, order = market.place_order("u", "bid", 55, 3)
+
+    assert fills == []
+    assert market.book.best("ask") is None
+    assert market.book.best("bid").price == 55
+    assert market.book.user_orders("u", "ask") == []
+    assert market.stats.spread is None
+
+
+def test_sweep_cancels_own_orders_and_trades_with_others():
+    market, _ = make_market()
+    market.place_order("u", "ask", 50, 5)
+    market.place_order("v", "ask", 51, 5)
+    market.place_order("u", "ask", 53, 5)
+
+    fills = market.execute_trade("u", "buy", 52, 10)
+
+    assert [(fill["seller_id"], fill["price"], fill["quantity"]) for fill in fills] == [("v", 51, 5)]
+    assert market.book.user_orders("u", "ask") == [3]
+    assert market.cancelled == 1
+
+
+def test_self_trade_prevention_updates_snapshot():
+    market, _ = make_market()
+    market.place_order("u", "ask", 50, 5)
+    snapshot = market.snapshot()
+    market.place_order("u", "bid", 51, 2, snapshot=snapshot)
+
+    assert snapshot.best("ask") is None
+    assert snapshot.best("bid")["price"] == 51
+
+
+def test_never_crosses_own_orders():
+    market, _ = make_market()
+    for price, side in [(50, "ask"), (55, "bid"), (45, "ask"), (44, "bid"), (60, "ask")]:
+        market.place_order("u", side, price, 1)
+        best_bid, best_ask = market.book.best("bid"), market.book.best("ask")
+        assert not (best_bid and best_ask and best_bid.price >= best_ask.price)
+
+
+def test_immediate_or_cancel_never_rests():
+    market, _ = make_market()
+    market.place_order("v", "ask", 50, 2)
+    fills, order = market.place_order("u", "bid", 50, 5, "IOC")
+
+    assert sum(fill["quantity"] for fill in fills) == 2
+    assert order is None
+    assert market.book.best("bid") is None
+
+
+def test_good_till_time_orders_expire():
+    market, now = make_market()
+    market.place_order("u", "bid", 45, 2, "GTT", 10)
+
+    now[0] += 9
+    assert market.expire_orders() == 0
+    now[0] += 1
+    assert market.expire_orders() == 1
+    assert market.book.best("bid") is None
+
+
+
+@pytest.mark.parametrize("expires_in", [None, 0, -5, float("inf"), float("nan")])
+def test_good_till_time_needs_a_finite_lifetime(expires_in):
+    market, _ = make_market()
+    market.place_order("v", "ask", 50, 1)
+
+    with pytest.raises(ValueError):
+        market.place_order("u", "bid", 50, 3, "GTT", expires_in)
+    # Rejected before it could trade or rest
+    assert market.book.best("ask").quantity == 1
+    assert market.book.best("bid") is None
+    assert len(market.expiry) == 0
+
+
+def test_fills_update_ledger_stats_and_writer():
+    class Writer:
+        def __init__(self):
+            self.writes = []
+
+        def add(self, sql, **params):
+            self.writes.append(sql.split()[0])
+
+    writer = Writer()
+    published = []
+    market, _ = make_market(writer=writer, on_fills=published.append)
+    market.place_order("v", "ask", 50, 2)
+    market.execute_trade("u", "buy", 50, 2)
+
+    assert market.ledger.portfolio("u")["contracts"] == 2
+    assert market.stats.last_price == 50
+    assert writer.writes == ["INSERT", "INSERT", "DELETE"]
+    assert len(published) == 1
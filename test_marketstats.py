@@ -0,0 +1,41 @@
+# test_marketstats.py contains the tests of a market's streaming statistics
+import math
+
+from marketstats import MarketStats
+
+
+def test_trade_statistics():
+    stats = MarketStats()
+    assert stats.vwap() is None and stats.recent_average() is None and stats.volatility() is None
+
+    stats.record_trade(100, 1, 0)
+    stats.record_trade(110, 3, 10)
+    stats.record_trade(99, 1, 40)
+
+    assert stats.trade_count == 3
+    assert stats.vwap() == (100 + 330 + 99) / 5
+    assert stats.recent_average() == 103
+    assert stats.last_price == 99
+    assert math.isclose(stats.volatility(), abs(math.log(99 / 110) - math.log(110 / 100)) / math.sqrt(2))
+
+
+def test_rolling_trade_counts():
+    stats = MarketStats()
+    for at in (0, 10, 20, 45):
+        stats.record_trade(100, 1, at)
+
+    assert stats.trades_within(30, 45) == 2
+    assert stats.trades_within(60, 45) == 4
+    assert stats.trades_within(30, 100) == 0
+
+
+def test_mean_spread_is_weighted_by_time():
+    stats = MarketStats()
+    assert stats.mean_spread(0) is None
+
+    stats.record_spread(99, 101, 0)  # 2 wide for 10 seconds
+    stats.record_spread(None, 101, 10)  # One-sided for 10 seconds, which does not count
+    stats.record_spread(100, 101, 20)  # 1 wide for 30 seconds
+
+    assert stats.spread == 1
+    assert stats.mean_spread(50) == (2 * 10 + 1 * 30) / 40
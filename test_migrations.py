@@ -0,0 +1,37 @@
+# test_migrations.py contains the tests of the schema migrations
+import sqlite3
+
+from migrations import MIGRATIONS, check_query_plans, migrate
+
+
+def test_migrations_reach_the_latest_version_without_table_scans(baseline_database):
+    migrate(baseline_database)
+    migrate(baseline_database)  # Already up to date, nothing to apply
+
+    connection = sqlite3.connect(baseline_database)
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == MIGRATIONS[-1][0]
+    connection.close()
+    assert check_query_plans(baseline_database) == []
+
+
+def test_shifted_legacy_results_are_repaired(baseline_database):
+    connection = sqlite3.connect(baseline_database)
+    # As the old insert stored them: accuracy held the trade count, time_taken the accuracy,
+    # created_at the game length and trades_completed the time
+    connection.execute("""
+        INSERT INTO game_results (user_id, game_id, scenario, pnl, accuracy, time_taken, created_at, trades_completed)
+        VALUES (1, 7, 'scenario', 12.5, 4, 75.0, 300, '2024-12-09 03:27:53')
+    """)
+    connection.commit()
+    connection.close()
+
+    migrate(baseline_database)
+    connection = sqlite3.connect(baseline_database)
+    row = connection.execute("""
+        SELECT game_id, pnl, accuracy, time_taken, created_at, trades_completed FROM game_results
+    """).fetchone()
+    stats = connection.execute("SELECT games_played, recent_pnl FROM user_stats WHERE user_id = 1").fetchone()
+    connection.close()
+
+    assert row == ("7", 12.5, 75.0, 300.0, "2024-12-09 03:27:53", 4)
+    assert stats == (1, 12.5)
@@ -0,0 +1,108 @@
+# test_orderbook.py contains the tests of the order book's matching and market data
+from orderbook import OrderBook
+
+
+def test_match_fills_in_price_time_priority():
+    book = OrderBook(1)
+    book.add_order(1, "a", "ask", 51, 5)
+    book.add_order(2, "b", "ask", 50, 3)
+    book.add_order(3, "c", "ask", 50, 4)
+
+    fills = book.match("v", "buy", 51, 10)
+
+    assert [(fill["order_id"], fill["price"], fill["quantity"]) for fill in fills] == [(2, 50, 3), (3, 50, 4), (1, 51, 3)]
+    assert fills[-1]["remaining"] == 2
+    assert book.best("ask").price == 51
+    assert book.best("ask").quantity == 2
+
+
+def test_match_stops_at_limit_price():
+    book = OrderBook(1)
+    book.add_order(1, "a", "bid", 48, 5)
+
+    assert book.match("v", "sell", 49, 5) == []
+    assert book.best("bid").quantity == 5
+
+
+def test_cancel_removes_order_and_empty_level():
+    book = OrderBook(1)
+    book.add_order(1, "a", "bid", 48, 5)
+    book.add_order(2, "a", "bid", 47, 5)
+
+    assert book.cancel(1).id == 1
+    assert book.cancel(1) is None
+    assert book.best("bid").price == 47
+    assert book.user_orders("a", "bid") == [2]
+    assert book.match("v", "sell", 40, 10)[0]["order_id"] == 2
+
+
+def test_drain_deltas_reports_changed_levels():
+    book = OrderBook(1)
+    book.add_order(1, "a", "ask", 50, 5)
+    assert book.drain_deltas() == (1, [{"action": "add", "side": "ask", "price": 50, "quantity": 5, "orders": 1}])
+    assert book.drain_deltas() == (1, [])
+
+    book.match("v", "buy", 50, 2)
+    assert book.drain_deltas() == (2, [{"action": "modify", "side": "ask", "price": 50, "quantity": 3, "orders": 1}])
+
+    book.match("v", "buy", 50, 3)
+    assert book.drain_deltas() == (3, [{"action": "remove", "side": "ask", "price": 50}])
+
+
+def apply(snapshot, deltas):
+    """
+    Apply deltas to a snapshot the way the game page does, returning price -> (quantity, orders) per side
+    """
+    book = {side: {level["price"]: (level["quantity"], level["orders"]) for level in snapshot[side + "s"]}
+            for side in ("bid", "ask")}
+    for delta in deltas:
+        if delta["action"] == "remove":
+            del book[delta["side"]][delta["price"]]
+        else:
+            book[delta["side"]][delta["price"]] = (delta["quantity"], delta["orders"])
+    return book
+
+
+def test_snapshot_leaves_no_ghost_levels():
+    book = OrderBook(1)
+    book.add_order(1, "u", "ask", 50, 5)
+    snapshot = book.snapshot()
+    book.match("v", "buy", 50, 5)
+    seq, deltas = book.drain_deltas()
+
+    assert seq >= snapshot["seq"]
+    assert apply(snapshot, deltas) == {"bid": {}, "ask": {}}
+
+
+def test_snapshot_plus_deltas_is_live_book():
+    book = OrderBook(1)
+    book.add_order(1, "u", "ask", 51, 5)
+    book.add_order(2, "u", "ask", 50, 2)
+    book.add_order(3, "u", "bid", 48, 1)
+    book.add_order(4, "u", "bid", 49, 1)
+    book.drain_deltas()
+
+    book.match("v", "buy", 50, 2)
+    book.add_order(5, "w", "bid", 47, 3)
+    snapshot = book.snapshot()
+    assert snapshot["seq"] == 1
+    assert [level["price"] for level in snapshot["asks"]] == [50, 51]
+    assert [level["price"] for level in snapshot["bids"]] == [49, 48]
+
+    book.cancel(4)
+    seq, deltas = book.drain_deltas()
+    assert seq == 2
+    assert apply(snapshot, deltas) == {"bid": book.top_levels("bid"), "ask": book.top_levels("ask")}
+
+
+def test_crossing_orders_finds_own_orders_in_reach():
+    book = OrderBook(1)
+    book.add_order(1, "u", "ask", 50, 1)
+    book.add_order(2, "u", "ask", 52, 1)
+    book.add_order(3, "v", "ask", 49, 1)
+    book.add_order(4, "u", "bid", 48, 1)
+
+    assert book.crossing_orders("u", "buy", 51) == [1]
+    assert book.crossing_orders("u", "sell", 48) == [4]
+    assert book.crossing_orders("u", "sell", 49) == []
+    assert book.crossing_orders("w", "buy", 100) == []
@@ -0,0 +1,73 @@
+# test_publisher.py contains the tests of the per-room publisher's conflation
+import time
+
+from orderbook import OrderBook
+from publisher import RoomPublisher
+
+
+def make_publisher(window=60):
+    emitted = []
+    publisher = RoomPublisher(lambda event, payload, room: emitted.append((room, event, payload)), window=window)
+    return publisher, emitted
+
+
+def test_conflated_book_updates_never_skip_a_sequence_number():
+    publisher, emitted = make_publisher()
+    book = OrderBook("room")
+
+    def build():
+        seq, deltas = book.drain_deltas()
+        return {"seq": seq, "deltas": deltas} if deltas else None
+
+    # A burst of changes is sent as one update, and each update follows the last one sent
+    for order_id, price in enumerate([50, 51, 52], start=1):
+        book.add_order(order_id, "u", "bid", price, 1)
+        publisher.publish_latest("room", "market_update", build)
+    publisher.flush("room")
+    book.add_order(4, "u", "ask", 55, 1)
+    publisher.publish_latest("room", "market_update", build)
+    publisher.flush("room")
+
+    assert [payload["seq"] for _, _, payload in emitted] == [1, 2]
+    assert len(emitted[0][2]["deltas"]) == 3
+
+
+def test_nothing_to_send_uses_no_sequence_number():
+    publisher, emitted = make_publisher()
+    book = OrderBook("room")
+
+    def build():
+        seq, deltas = book.drain_deltas()
+        return {"seq": seq, "deltas": deltas} if deltas else None
+
+    book.add_order(1, "u", "bid", 50, 1)
+    book.cancel(1)
+    publisher.publish_latest("room", "market_update", build)
+    publisher.flush("room")
+    book.add_order(2, "u", "bid", 49, 1)
+    publisher.publish_latest("room", "market_update", build)
+    publisher.flush("room")
+
+    assert [payload["seq"] for _, _, payload in emitted] == [1]
+
+
+def test_in_order_events_go_before_the_latest_state():
+    publisher, emitted = make_publisher()
+    publisher.publish_latest("room", "market_update", lambda: "book")
+    publisher.publish_in_order("room", "trade_update", "first")
+    publisher.publish_in_order("room", "trade_update", "second")
+    publisher.publish_in_order("other", "trade_update", "elsewhere")
+    publisher.flush("room")
+
+    assert emitted == [("room", "trade_update", "first"), ("room", "trade_update", "second"),
+                       ("room", "market_update", "book")]
+
+
+def test_rooms_are_flushed_once_their_window_passes():
+    publisher, emitted = make_publisher(window=0.01)
+    publisher.publish_in_order("room", "trade_update", "trade")
+
+    deadline = time.monotonic() + 2
+    while not emitted and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert emitted == [("room", "trade_update", "trade")]
@@ -0,0 +1,58 @@
+# test_scheduler.py contains the tests of the shared job scheduler
+import threading
+import time
+
+from scheduler import Scheduler
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_a_key_never_runs_twice_at_once():
+    scheduler = Scheduler(workers=4)
+    lock = threading.Lock()
+    running = {"now": 0, "most": 0, "runs": 0}
+
+    def tick():
+        with lock:
+            running["now"] += 1
+            running["most"] = max(running["most"], running["now"])
+        time.sleep(0.03)  # Longer than the interval, as a slow bot tick would be
+        with lock:
+            running["now"] -= 1
+            running["runs"] += 1
+
+    assert scheduler.every("bots:lobby", 0.005, tick)
+    assert not scheduler.every("bots:lobby", 0.005, tick)  # Already scheduled
+    assert wait_for(lambda: running["runs"] >= 4)
+    scheduler.cancel("bots:lobby")
+    assert running["most"] == 1
+
+
+def test_returning_false_stops_a_repeating_job():
+    scheduler = Scheduler(workers=2)
+    runs = []
+
+    def tick():
+        runs.append(1)
+        return len(runs) < 3
+
+    scheduler.every("bots:lobby", 0.001, tick)
+    assert wait_for(lambda: not scheduler.is_scheduled("bots:lobby"))
+    time.sleep(0.02)
+    assert len(runs) == 3
+
+
+def test_call_later_replaces_the_pending_call():
+    scheduler = Scheduler(workers=2)
+    calls = []
+    scheduler.call_later("timer:lobby", 0.05, lambda: calls.append("first"))
+    scheduler.call_later("timer:lobby", 0.01, lambda: calls.append("second"))
+
+    assert wait_for(lambda: calls)
+    time.sleep(0.08)
+    assert calls == ["second"]
@@ -0,0 +1,44 @@
+# test_tickstore.py contains the tests of the memory-mapped tick log and its columnar archive
+import numpy as np
+
+from orderbook import Order
+from tickstore import CANCEL, FILL, GROWTH, NO_USER, ORDER, SIDES, TickLog, compact, load_archive
+
+
+def test_ticks_survive_a_reopen_and_growth(tmp_path):
+    path = str(tmp_path / "game.ticks")
+    log = TickLog(path)
+    for i in range(GROWTH + 5):  # Past the first allocation, so the file grows
+        log.record_order(Order(i, f"user-{i % 3}", "bid", 100.0 + i, 1.0))
+    log.close()
+
+    log = TickLog(path)
+    ticks = log.ticks()
+    assert len(ticks) == GROWTH + 5
+    assert log.participants == ["user-0", "user-1", "user-2"]
+    assert (ticks["order_id"] == np.arange(GROWTH + 5)).all()
+    assert (ticks["user"] == np.arange(GROWTH + 5) % 3).all()
+    del ticks
+    log.close()
+
+
+def test_compacted_archive_holds_every_column(tmp_path):
+    path = str(tmp_path / "game.ticks")
+    log = TickLog(path)
+    log.record_order(Order(1, "alice", "ask", 101.0, 5.0))
+    log.record_fill({"order_id": 1, "price": 101.0, "quantity": 2.0, "buyer_id": "bob", "seller_id": "alice"},
+                    "ask")
+    log.record_cancel(Order(1, "alice", "ask", 101.0, 3.0))
+    log.close()
+
+    archive = str(tmp_path / "game")
+    compact(path, archive, {"lobby_id": "game"})
+    metadata, columns = load_archive(archive)
+
+    assert metadata == {"lobby_id": "game", "ticks": 3, "participants": ["alice", "bob"]}
+    assert "padding" not in columns
+    assert columns["kind"].tolist() == [ORDER, FILL, CANCEL]
+    assert columns["side"].tolist() == [SIDES["ask"]] * 3
+    assert columns["quantity"].tolist() == [5.0, 2.0, 3.0]
+    assert columns["user"].tolist() == [0, 1, 0]  # The fill's user is the buyer
+    assert columns["counterparty"].tolist() == [NO_USER, 0, NO_USER]
@@ -0,0 +1,54 @@
+# test_timingwheel.py contains the tests of the timing wheel behind order expiry
+from timingwheel import TimingWheel
+
+
+def test_keys_fire_once_their_deadline_passes():
+    wheel = TimingWheel(100)
+    wheel.schedule("a", 102.5)
+    wheel.schedule("b", 101)
+
+    assert wheel.advance(100.9) == []
+    assert wheel.advance(101) == ["b"]
+    assert wheel.advance(102.9) == []
+    assert wheel.advance(103) == ["a"]
+    assert len(wheel) == 0
+
+
+def test_cancel_and_reschedule():
+    wheel = TimingWheel(0)
+    wheel.schedule("a", 5)
+    wheel.schedule("b", 5)
+    wheel.cancel("a")
+    wheel.cancel("missing")
+    wheel.schedule("b", 8)
+
+    assert wheel.advance(6) == []
+    assert wheel.advance(8) == ["b"]
+
+
+def test_deadlines_beyond_one_turn_wait_for_their_round():
+    wheel = TimingWheel(0, size=4)
+    wheel.schedule("far", 10)
+    wheel.schedule("near", 2)
+
+    assert wheel.advance(3) == ["near"]
+    assert wheel.advance(9) == []
+    assert wheel.advance(10) == ["far"]
+
+
+def test_long_pause_fires_everything_due():
+    wheel = TimingWheel(0, size=4)
+    for key in range(1, 10):
+        wheel.schedule(key, key)
+    wheel.schedule("later", 50)
+
+    assert sorted(wheel.advance(30)) == list(range(1, 10))
+    assert len(wheel) == 1
+
+
+def test_past_deadlines_fire_on_next_tick():
+    wheel = TimingWheel(10)
+    wheel.schedule("late", 3)
+
+    assert wheel.advance(10.5) == []
+    assert wheel.advance(11) == ["late"]
@@ -0,0 +1,65 @@
+# test_userstats.py contains the tests of the materialized per-user statistics and their cache
+from database import Database
+from migrations import migrate
+from userstats import EMPTY_STATS, RECENT_GAMES, UserStatsCache, record_results
+
+
+def record_game(db, game, pnls):
+    """
+    Record one game's results the way the app does, rows and statistics in one transaction
+    """
+    with db.transaction():
+        for user_id, pnl in pnls.items():
+            db.execute("""
+                INSERT INTO game_results (user_id, game_id, scenario, pnl, accuracy, time_taken, created_at, trades_completed)
+                VALUES (:user_id, :game_id, 'scenario', :pnl, 0, 300, datetime('2024-01-01', :offset), 0)
+            """, user_id=user_id, game_id=str(game), pnl=pnl, offset=f"+{game} minutes")
+        record_results(db, [{"user_id": user_id, "pnl": pnl} for user_id, pnl in pnls.items()])
+
+
+def test_statistics_match_the_full_history(baseline_database):
+    migrate(baseline_database)
+    db = Database(baseline_database)
+    pnls = [5.0, -3.0, 12.0, 0.0, -7.5, 4.0, 9.0, -1.0, 2.0, 6.0, -4.0, 8.0, 3.0, -2.0]
+    for game, pnl in enumerate(pnls):
+        record_game(db, game, {1: pnl, 2: -pnl})
+
+    for user_id, sign in ((1, 1), (2, -1)):
+        history = [sign * pnl for pnl in pnls]
+        stats = UserStatsCache(db).get(user_id)
+        assert stats["games_played"] == len(history)
+        assert stats["total_pnl"] == sum(history)
+        assert stats["wins"] == sum(pnl > 0 for pnl in history)
+        assert stats["best_pnl"] == max(history)
+        # The rolling window only holds the last RECENT_GAMES games
+        assert stats["recent_pnl"] == sum(history[-RECENT_GAMES:])
+
+
+def test_cache_serves_until_invalidated(baseline_database):
+    migrate(baseline_database)
+    db = Database(baseline_database)
+    cache = UserStatsCache(db)
+    assert cache.get(1) == EMPTY_STATS
+
+    record_game(db, 0, {1: 10.0})
+    assert cache.get(1) == EMPTY_STATS  # Still the cached entry
+    cache.invalidate([1])
+    assert cache.get("1")["total_pnl"] == 10.0
+
+
+def test_read_racing_an_invalidation_is_not_cached(baseline_database):
+    migrate(baseline_database)
+    db = Database(baseline_database)
+    cache = UserStatsCache(db)
+    execute = db.execute
+
+    def execute_then_invalidate(sql, **params):
+        # The results change and are invalidated while the read is in flight
+        rows = execute(sql, **params)
+        cache.invalidate([1])
+        return rows
+
+    db.execute = execute_then_invalidate
+    assert cache.get(1) == EMPTY_STATS
+    db.execute = execute
+    assert 1 not in cache.stats
@@ -0,0 +1,47 @@
+# test_vectorbots.py contains the tests of the vectorized bot engine against the Bot objects it stands in for
+import statistics
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from lobbymarket import LobbyMarket
+from markets import MARKETS
+from simulate import SimulatedGame
+from vectorbots import VectorBotEngine
+
+BOTS = {"easy": 8, "medium": 8, "hard": 8, "Jane Street": 6}
+QUESTIONS = list(MARKETS)
+
+
+def play(engine, games=40):
+    """
+    Mean fills, spread and absolute P&L (as a share of fair value) per game over seeded games
+    """
+    fills, spreads, pnl = [], [], []
+    for seed in range(games):
+        question = QUESTIONS[seed % len(QUESTIONS)]
+        result = SimulatedGame(question, BOTS, seed, game_length=200, engine=engine).run()
+        fills.append(result["fills"])
+        spreads.append(result["mean_spread"])
+        pnl.append(statistics.fmean(abs(entry["pnl"]) for entry in result["pnl"]) / MARKETS[question]
+                   if result["pnl"] else 0)
+    return statistics.fmean(fills), statistics.fmean(spreads), statistics.fmean(pnl)
+
+
+def test_vector_engine_plays_like_bot_objects():
+    objects = play("objects")
+    vector = play("vector")
+    for name, expected, actual in zip(("fills", "spread", "pnl"), objects, vector):
+        assert 0.7 < actual / expected < 1.4, (name, expected, actual)
+
+
+def test_batch_ends_at_the_first_bot_that_moves_the_book():
+    joined = datetime(2024, 1, 1)
+    engine = VectorBotEngine([f"bot-{i}" for i in range(8)], ["Jane Street"] * 8, 100, joined,
+                             np.random.default_rng(1))
+    snapshot = LobbyMarket("test", 100).snapshot()
+
+    # On an empty book the first bot to quote sets the best prices, so the bots after it must see them
+    actions, start = engine.tick(snapshot, joined + timedelta(seconds=10))
+    assert {bot_id for _, bot_id, *_ in actions} == {f"bot-{start - 1}"}
+    assert np.isnan(engine.current_bid[start:]).all()
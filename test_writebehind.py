@@ -0,0 +1,37 @@
+# test_writebehind.py contains the tests of the write-behind queue's group commit
+from database import Database
+from writebehind import WriteBehindQueue
+
+
+def make_queue(tmp_path):
+    db = Database(str(tmp_path / "test.db"))
+    db.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, quantity INTEGER)")
+    return db, WriteBehindQueue(db, interval=0)
+
+
+def test_writes_are_committed_in_order(tmp_path):
+    db, writer = make_queue(tmp_path)
+    writer.add("INSERT INTO orders (id, quantity) VALUES (:id, :quantity)", id=1, quantity=5)
+    writer.add("UPDATE orders SET quantity = :quantity WHERE id = :id", id=1, quantity=3)
+    writer.add("INSERT INTO orders (id, quantity) VALUES (:id, :quantity)", id=2, quantity=4)
+    writer.flush()
+
+    assert db.execute("SELECT id, quantity FROM orders ORDER BY id") == [
+        {"id": 1, "quantity": 3}, {"id": 2, "quantity": 4}]
+
+
+def test_failing_batch_is_retried_one_write_at_a_time(tmp_path):
+    db, writer = make_queue(tmp_path)
+    db.execute("INSERT INTO orders (id, quantity) VALUES (2, 1)")
+
+    # The second insert breaks the primary key, which rolls back the whole batch
+    writer._commit([
+        ("INSERT INTO orders (id, quantity) VALUES (:id, :quantity)", {"id": 1, "quantity": 5}),
+        ("INSERT INTO orders (id, quantity) VALUES (:id, :quantity)", {"id": 2, "quantity": 6}),
+        ("INSERT INTO orders (id, quantity) VALUES (:id, :quantity)", {"id": 3, "quantity": 7}),
+        ("DELETE FROM orders WHERE id = :id", {"id": 1}),
+    ])
+
+    # Only the failing write is lost; the others are applied, still in order
+    assert db.execute("SELECT id, quantity FROM orders ORDER BY id") == [
+        {"id": 2, "quantity": 1}, {"id": 3, "quantity": 7}]
@@ -0,0 +1,169 @@
+# tickstore.py contains the per-game tick store. While a game runs, every order, cancel and fill is appended as a fixed-width record to a memory-mapped log; once the game ends the log is compacted into one .npy file per column, which NumPy maps straight from disk for post-game analysis and replay without touching gamefiles.db.
+import json
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+# Tick kinds
+ORDER = 1
+CANCEL = 2
+FILL = 3
+
+# Sides, of the order for ORDER and CANCEL ticks and of the resting order for FILL ticks
+SIDES = {"bid": 0, "ask": 1}
+
+NO_USER = 0xFFFFFFFF  # Counterparty of ticks that only have one participant
+
+# One tick: time, order id, price, quantity, user, counterparty, kind, side, padding to 48 bytes
+RECORD = struct.Struct("<dqddIIBB6x")
+TICK_DTYPE = np.dtype([
+    ("time", "<f8"),
+    ("order_id", "<i8"),
+    ("price", "<f8"),
+    ("quantity", "<f8"),
+    ("user", "<u4"),  # Index into the game's participants
+    ("counterparty", "<u4"),  # Seller of a fill (the user is the buyer), NO_USER otherwise
+    ("kind", "u1"),
+    ("side", "u1"),
+    ("padding", "V6"),
+])
+
+# The log starts with a header holding a magic number and the number of ticks written
+HEADER = struct.Struct("<8sQ")
+MAGIC = b"MMMTICK1"
+GROWTH = 4096  # Ticks the log file grows by when it fills up
+
+
+class TickLog:
+    def __init__(self, path):
+        """
+        Open (or create) a game's append-only tick log. Appends must come from the lobby's single writer.
+        """
+        self.path = path
+        self.participants = []  # participant index -> participant id
+        self.index = {}  # participant id -> participant index
+
+        exists = os.path.exists(path)
+        self.file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self.file.truncate(HEADER.size + GROWTH * RECORD.size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        if exists:
+            magic, self.count = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a tick log")
+        else:
+            self.count = 0
+            HEADER.pack_into(self.map, 0, MAGIC, 0)
+
+        # Participants are appended to a text sidecar as they first appear, so the log survives a restart
+        users_path = path + ".users"
+        if exists and os.path.exists(users_path):
+            with open(users_path) as users:
+                for line in users:
+                    self._add_participant(line.rstrip("\n"))
+        self.users = open(users_path, "a")
+
+    def _add_participant(self, user_id):
+        self.index[user_id] = len(self.participants)
+        self.participants.append(user_id)
+        return self.index[user_id]
+
+    def _participant(self, user_id):
+        user_id = str(user_id)
+        index = self.index.get(user_id)
+        if index is None:
+            index = self._add_participant(user_id)
+            self.users.write(user_id + "\n")
+            self.users.flush()
+        return index
+
+    def _append(self, kind, side, order_id, price, quantity, user, counterparty=NO_USER):
+        """
+        Write one record after the last one, growing the file when it is full
+        """
+        offset = HEADER.size + self.count * RECORD.size
+        if offset + RECORD.size > len(self.map):
+            self.map.flush()
+            self.map.close()
+            self.file.truncate(offset + GROWTH * RECORD.size)
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        RECORD.pack_into(self.map, offset, time.time(), order_id, price, quantity, user, counterparty, kind, side)
+
+        # Publish the record by bumping the count only once it is fully written
+        self.count += 1
+        HEADER.pack_into(self.map, 0, MAGIC, self.count)
+
+    def record_order(self, order):
+        """
+        Log an order resting on the book
+        """
+        self._append(ORDER, SIDES[order.order_type], order.id, order.price, order.quantity,
+                     self._participant(order.user_id))
+
+    def record_cancel(self, order):
+        """
+        Log an order leaving the book without trading, with the quantity it had left
+        """
+        self._append(CANCEL, SIDES[order.order_type], order.id, order.price, order.quantity,
+                     self._participant(order.user_id))
+
+    def record_fill(self, fill, resting_type):
+        """
+        Log a fill against the resting order of the given side
+        """
+        self._append(FILL, SIDES[resting_type], fill["order_id"], fill["price"], fill["quantity"],
+                     self._participant(fill["buyer_id"]), self._participant(fill["seller_id"]))
+
+    def ticks(self):
+        """
+        View every tick written so far as a NumPy record array over the log, without copying it
+        """
+        return np.frombuffer(self.map, dtype=TICK_DTYPE, count=self.count, offset=HEADER.size)
+
+    def close(self):
+        """
+        Flush the log to disk and close it
+        """
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+        self.users.close()
+
+
+def compact(log_path, archive_path, metadata=None):
+    """
+    Turn a finished game's tick log into a columnar archive: a directory with one .npy file
+    per column, the participants and the game's metadata. The log is removed afterwards.
+    """
+    log = TickLog(log_path)
+    try:
+        ticks = log.ticks()
+        os.makedirs(archive_path, exist_ok=True)
+        for column in TICK_DTYPE.names:
+            if column != "padding":
+                np.save(os.path.join(archive_path, f"{column}.npy"), np.ascontiguousarray(ticks[column]))
+        with open(os.path.join(archive_path, "meta.json"), "w") as meta:
+            json.dump(dict(metadata or {}, ticks=log.count, participants=log.participants), meta)
+        del ticks  # Release the buffer before the map is closed
+    finally:
+        log.close()
+    os.remove(log_path)
+    os.remove(log_path + ".users")
+
+
+def load_archive(archive_path):
+    """
+    Open a compacted game. Columns are memory-mapped read-only, so nothing is read until it is used.
+    Returns the metadata and a dict of column name -> array.
+    """
+    with open(os.path.join(archive_path, "meta.json")) as meta:
+        metadata = json.load(meta)
+    columns = {
+        column: np.load(os.path.join(archive_path, f"{column}.npy"), mmap_mode="r")
+        for column in TICK_DTYPE.names if column != "padding"
+    }
+    return metadata, columns
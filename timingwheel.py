@@ -0,0 +1,54 @@
+# timingwheel.py contains the hashed timing wheel that drives order expiry. Deadlines are hashed into a ring of slots by the tick they fall due in, so scheduling and cancelling an expiry are O(1) and each advance only looks at the slots of the ticks that passed, never at every resting order.
+import math
+
+WHEEL_RESOLUTION = 1.0  # Seconds per tick of the wheel
+WHEEL_SIZE = 64  # Slots in the ring; deadlines further away than one turn wait in their slot for later rounds
+
+
+class TimingWheel:
+    def __init__(self, now, resolution=WHEEL_RESOLUTION, size=WHEEL_SIZE):
+        """
+        Initialize an empty wheel whose clock starts at `now` (epoch seconds)
+        """
+        self.resolution = resolution
+        self.slots = [{} for _ in range(size)]  # per slot: key -> tick it is due at
+        self.due = {}  # key -> slot holding it, so a key can be cancelled without searching
+        self.current = int(now // resolution)  # The last tick the wheel advanced through
+
+    def __len__(self):
+        return len(self.due)
+
+    def schedule(self, key, at):
+        """
+        Fire `key` once the wheel advances past epoch time `at`, never early. Rescheduling a key moves it.
+        """
+        self.cancel(key)
+        tick = max(math.ceil(at / self.resolution), self.current + 1)
+        slot = tick % len(self.slots)
+        self.slots[slot][key] = tick
+        self.due[key] = slot
+
+    def cancel(self, key):
+        """
+        Forget a key, if it is still waiting
+        """
+        slot = self.due.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def advance(self, now):
+        """
+        Move the wheel up to epoch time `now`, returning the keys that fell due
+        """
+        target = int(now // self.resolution)
+        expired = []
+        # After a long pause every slot needs visiting only once, however many ticks were missed
+        for tick in range(max(self.current + 1, target - len(self.slots) + 1), target + 1):
+            slot = self.slots[tick % len(self.slots)]
+            due = [key for key, due_tick in slot.items() if due_tick <= target]
+            for key in due:
+                del slot[key]
+                del self.due[key]
+            expired.extend(due)
+        self.current = max(self.current, target)
+        return expired
@@ -0,0 +1,69 @@
+# userstats.py contains the per-user statistics shown on the homepage and history page. They are kept in the user_stats table, upserted in the same transaction that records a game's results, and read through an in-process cache, so neither page ever aggregates a user's whole history.
+from threading import Lock
+
+RECENT_GAMES = 10  # Games in the rolling recent P&L window
+
+EMPTY_STATS = {"total_pnl": 0.0, "games_played": 0, "wins": 0, "best_pnl": 0.0, "recent_pnl": 0.0}
+
+
+def record_results(db, results):
+    """
+    Fold one game's results, a list of {user_id, pnl}, into each user's statistics.
+    Must run after the game's rows are in game_results, inside the same transaction.
+    """
+    db.executemany(f"""
+        INSERT INTO user_stats (user_id, total_pnl, games_played, wins, best_pnl, recent_pnl, updated_at)
+        VALUES (:user_id, :pnl, 1, :pnl > 0, :pnl, :pnl, CURRENT_TIMESTAMP)
+        ON CONFLICT (user_id) DO UPDATE SET
+            total_pnl = total_pnl + excluded.total_pnl,
+            games_played = games_played + 1,
+            wins = wins + excluded.wins,
+            best_pnl = MAX(best_pnl, excluded.best_pnl),
+            -- The game that just left the recent window is the one RECENT_GAMES places back
+            recent_pnl = recent_pnl + excluded.recent_pnl - IFNULL((
+                SELECT pnl FROM game_results WHERE user_id = excluded.user_id
+                ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET {RECENT_GAMES}
+            ), 0),
+            updated_at = CURRENT_TIMESTAMP
+    """, [{"user_id": int(result["user_id"]), "pnl": result["pnl"]} for result in results])
+
+
+class UserStatsCache:
+    def __init__(self, db):
+        """
+        Initialize an empty cache in front of the user_stats table
+        """
+        self.db = db
+        self.lock = Lock()
+        self.stats = {}  # user id -> statistics dict
+        self.generation = 0  # Bumped on every invalidation, so a read racing one is not cached
+
+    def get(self, user_id):
+        """
+        Get a user's statistics, loading them from the database on a miss
+        """
+        user_id = int(user_id)
+        stats = self.stats.get(user_id)
+        if stats is not None:
+            return stats
+
+        generation = self.generation
+        rows = self.db.execute("""
+            SELECT total_pnl, games_played, wins, best_pnl, recent_pnl
+            FROM user_stats WHERE user_id = :user_id
+        """, user_id=user_id)
+        stats = rows[0] if rows else dict(EMPTY_STATS)
+        with self.lock:
+            if generation == self.generation:
+                self.stats[user_id] = stats
+        return stats
+
+    def invalidate(self, user_ids):
+        """
+        Forget the cached statistics of users whose results just changed.
+        Call after the transaction that changed them has committed.
+        """
+        with self.lock:
+            self.generation += 1
+            for user_id in user_ids:
+                self.stats.pop(int(user_id), None)
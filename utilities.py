@@ -1,15 +1,23 @@
 # utilities.py contains helper functions and routes that are used in the main application file (app.py) but are not directly related to the main application logic. This file is used to keep the main application file clean and organized.
 import os
-from cs50 import SQL
+import math
 from flask import Flask, flash, redirect, render_template, request, session, url_for
 from flask_socketio import SocketIO, join_room, leave_room
 import uuid
 from werkzeug.security import check_password_hash, generate_password_hash
 from functools import wraps
 from markets import get_random_market
+from commands import CommandQueue, LobbyClosed
+from lobbymarket import TIME_IN_FORCE, LobbyMarket
+from vectorbots import VectorBotEngine
+from userstats import record_results
+from tickstore import TickLog, compact
+from publisher import RoomPublisher
 import bots
 from bots import create_bot, get_bots_in_lobby
 import random
+import itertools
+import base64
 from datetime import datetime
 import time
 import threading
@@ -17,153 +25,390 @@ from threading import Lock
 import logging
 
 import globals
-from globals import db, bot_lock
+from globals import db
 socketio = None  # Private variable to store the SocketIO instance
+publisher = None  # Per-room publisher that conflates market updates
 
 
 def set_socketio(socketio_instance):
     """Setter function to initialize the socketio instance."""
-    global socketio
+    global socketio, publisher
     socketio = socketio_instance
+    publisher = RoomPublisher(socketio.emit, window=globals.MARKET_UPDATE_WINDOW)
 
 
-# More Bot Helper Functions and Routes that cant be in bots.py
-def get_current_market_state(lobby_id):
-    """
-    Retrieve the current market state for a specific lobby.
-    """
-    # Get the best bid and ask
-    best_bid = db.execute("""
-        SELECT price, user_id, quantity FROM orders
-        WHERE game_id = :game_id AND order_type = 'bid'
-        ORDER BY price DESC, created_at ASC LIMIT 1
-    """, game_id=lobby_id)
-
-    best_ask = db.execute("""
-        SELECT price, user_id, quantity FROM orders
-        WHERE game_id = :game_id AND order_type = 'ask'
-        ORDER BY price ASC, created_at ASC LIMIT 1
-    """, game_id=lobby_id)
-
-    # Get the full market depth
-    all_bids = db.execute("""
-        SELECT price, user_id, quantity FROM orders
-        WHERE game_id = :game_id AND order_type = 'bid'
-        ORDER BY price DESC, created_at ASC
-    """, game_id=lobby_id)
-
-    all_asks = db.execute("""
-        SELECT price, user_id, quantity FROM orders
-        WHERE game_id = :game_id AND order_type = 'ask'
-        ORDER BY price ASC, created_at ASC
-    """, game_id=lobby_id)
-
-    # Find recent trades
-    recent_trades = db.execute("""
-        SELECT buyer_id, seller_id, price, quantity, created_at FROM transactions
-        WHERE game_id = :game_id
-        ORDER BY created_at DESC LIMIT 10
-    """, game_id=lobby_id)
+# Order ids are assigned by the matching engine, carrying on from the last id recorded in the database
+order_ids = itertools.count(db.execute("SELECT IFNULL(MAX(id), 0) AS max_id FROM orders")[0]["max_id"] + 1)
+
+
+# Order Book Helper Functions
+def open_lobby_market(lobby_id):
+    """
+    Set up the market of a lobby whose game is starting, with its order book, ledger, statistics and expiry wheel,
+    and the command queue every read and write of it goes through. Its orders and fills are persisted by the
+    write-behind queue, logged as ticks and published to the room.
+    """
+    os.makedirs(globals.TICK_DIRECTORY, exist_ok=True)
+    globals.lobby_markets[lobby_id] = LobbyMarket(
+        lobby_id, get_fair_value(lobby_id), depth=globals.MARKET_DEPTH_LEVELS, order_ids=order_ids,
+        writer=globals.writer, tick_log=TickLog(os.path.join(globals.TICK_DIRECTORY, f"{lobby_id}.ticks")),
+        on_fills=lambda fills: emit_fills(lobby_id, fills), on_book_change=lambda: emit_market_update(lobby_id),
+        max_live_quotes=globals.MAX_LIVE_QUOTES_PER_SIDE, quote_lifetime=globals.BOT_QUOTE_LIFETIME)
+    globals.command_queues[lobby_id] = CommandQueue()
+
+
+def get_lobby_market(lobby_id):
+    """
+    Get the market of a running lobby. It must only be touched from inside a lobby command.
+    """
+    return globals.lobby_markets[lobby_id]
+
+
+def get_command_queue(lobby_id):
+    """
+    Get the queue that serializes every command on a lobby's market. Raises LobbyClosed if the lobby is not running.
+    """
+    queue = globals.command_queues.get(lobby_id)
+    if queue is None:
+        raise LobbyClosed(f"Lobby {lobby_id} is not running")
+    return queue
+
+
+def run_lobby_command(lobby_id, command, *args):
+    """
+    Run a command as the lobby's single writer. Its database writes are persisted in the background.
+    Raises LobbyClosed if the lobby is not running, or stopped before the command's turn came.
+    """
+    return get_command_queue(lobby_id).submit(command, *args)
+
+
+def get_player_name(game_id, player_id):
+    """
+    Find the display name of a player (or bot) in a lobby
+    """
+    return globals.lobbies.player_name(game_id, str(player_id))
+
 
+def _drain_market_update(lobby_id):
+    """
+    Lobby command: take the price levels that changed since the last update, with the current market statistics
+    """
+    market = get_lobby_market(lobby_id)
+    seq, deltas = market.book.drain_deltas()
+    return seq, deltas, market.stats.summary(time.time())
+
+
+def build_market_update(lobby_id):
+    """
+    Collect the price levels that changed since the last update, or None if nothing changed or the lobby closed
+    """
+    try:
+        seq, deltas, stats = run_lobby_command(lobby_id, _drain_market_update, lobby_id)
+    except LobbyClosed:
+        return None
+    if not deltas:
+        return None
     return {
-        "best_bid": best_bid[0] if best_bid else None,
-        "best_ask": best_ask[0] if best_ask else None,
-        "all_bids": all_bids,
-        "all_asks": all_asks,
-        "recent_trades": recent_trades,
+        'seq': seq,
+        'deltas': deltas,
+        'stats': stats,
     }
 
 
+def emit_market_update(lobby_id):
+    """
+    Let the room know its book changed. Updates within the conflation window are sent as one.
+    """
+    publisher.publish_latest(lobby_id, 'market_update', lambda: build_market_update(lobby_id))
+
+
+def get_market_snapshot(lobby_id):
+    """
+    Get the full versioned book of a lobby and its market statistics, for clients joining or recovering from a gap
+    """
+    def read():
+        market = get_lobby_market(lobby_id)
+        return dict(market.book.snapshot(), stats=market.stats.summary(time.time()))
+    return run_lobby_command(lobby_id, read)
+
+
+def portfolio_room(lobby_id, user_id):
+    """
+    Name of the Socket.IO room that only one player's own updates are sent to
+    """
+    return f"{lobby_id}:{user_id}"
+
+
+def emit_portfolio_updates(game_id, fills):
+    """
+    Send each player who took part in the fills their new position, once per aggressive order
+    """
+    ledger = get_lobby_market(game_id).ledger
+    user_ids = {fill["buyer_id"] for fill in fills} | {fill["seller_id"] for fill in fills}
+    for user_id in user_ids:
+        if user_id in bots.BOTS:
+            continue
+        publisher.publish_in_order(portfolio_room(game_id, user_id), "portfolio_update", ledger.portfolio(user_id))
+
+
+def get_portfolio(lobby_id, user_id):
+    """
+    Get a player's contracts and cash in a lobby
+    """
+    return run_lobby_command(lobby_id, lambda: get_lobby_market(lobby_id).ledger.portfolio(str(user_id)))
+
+
+def emit_trade_update(game_id, fills):
+    """
+    Send every fill of one aggressive order to the room as a single trade update
+    """
+    trades = []
+    for fill in fills:
+        buyer_name = get_player_name(game_id, fill["buyer_id"])
+        seller_name = get_player_name(game_id, fill["seller_id"])
+        trades.append({'price': fill['price'], 'quantity': fill["quantity"], 'buyer_name': buyer_name, 'buyer_id': fill["buyer_id"],
+                       'seller_name': seller_name, 'seller_id': fill["seller_id"]})
+    publisher.publish_in_order(game_id, "trade_update", {
+        'trades': trades,
+        'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    })
+
+
+def emit_fills(game_id, fills):
+    """
+    Queue the real-time trade update of one aggressive order and the new positions of everyone in it
+    """
+    emit_trade_update(game_id, fills)
+    emit_portfolio_updates(game_id, fills)
+
+
+def place_order(lobby_id, user_id, order_type, price, quantity, time_in_force="GTC", expires_in=None):
+    """
+    Submit a new bid or ask to the lobby's book. Any part that crosses the
+    opposite side trades immediately, the rest is rested and recorded, for
+    as long as its time in force allows. Returns the fills and the quantity
+    left resting, 0 if none was.
+    """
+    if time_in_force not in TIME_IN_FORCE:
+        raise ValueError(f"Unknown time in force: {time_in_force}")
+    if time_in_force == "GTT" and not (expires_in and math.isfinite(expires_in)
+                                       and 0 < expires_in <= globals.MAX_ORDER_LIFETIME):
+        raise ValueError(f"A good-till-time order needs between 0 and {globals.MAX_ORDER_LIFETIME} seconds")
+
+    def place():
+        fills, order = get_lobby_market(lobby_id).place_order(
+            str(user_id), order_type, price, quantity, time_in_force, expires_in)
+        return fills, order.quantity if order else 0
+    return run_lobby_command(lobby_id, place)
+
+
+def expire_orders(lobby_id):
+    """
+    Drop a lobby's expired orders from its book.
+    Returns False once the game is over so the scheduler stops calling it.
+    """
+    lobby = globals.lobbies.get(lobby_id)
+    if not lobby or lobby["status"] != "in_progress":
+        return False
+    try:
+        run_lobby_command(lobby_id, lambda: get_lobby_market(lobby_id).expire_orders())
+    except LobbyClosed:
+        return False
+    return True
+
+
+def start_order_expiry(lobby_id):
+    """
+    Sweep the lobby's timing wheel for expired orders on the shared scheduler
+    """
+    globals.scheduler.every(f"expiry:{lobby_id}", globals.ORDER_EXPIRY_INTERVAL, lambda: expire_orders(lobby_id))
+
+
+# More Bot Helper Functions and Routes that cant be in bots.py
+def get_vector_bots(lobby_id, lobby_bots):
+    """
+    Lobby command: get the lobby's vectorized bot engine, built from its Bot objects the first time
+    """
+    engine = globals.vector_bots.get(lobby_id)
+    if engine is None:
+        joined = min(bot.last_trade_time for bot in lobby_bots)
+        engine = globals.vector_bots.setdefault(lobby_id, VectorBotEngine(
+            [bot.bot_id for bot in lobby_bots], [bot.level for bot in lobby_bots], get_fair_value(lobby_id), joined))
+    return engine
+
+
+def _bot_tick(lobby_id, lobby_bots):
+    """
+    Lobby command: one round of trading actions for all bots in a lobby. The bots share one market snapshot,
+    which each bot's orders and fills keep up to date for the bots after it. The whole tick is one command,
+    so nothing else changes the book under the snapshot; player orders go in between ticks.
+    """
+    market = get_lobby_market(lobby_id)
+    snapshot = market.snapshot()
+
+    # Large populations decide in vectorized batches
+    if len(lobby_bots) >= globals.VECTOR_BOT_THRESHOLD:
+        market.vector_bot_tick(get_vector_bots(lobby_id, lobby_bots), snapshot)
+        return
+
+    for bot in lobby_bots:
+        market.bot_turn(bot, snapshot)
+
+
 def bot_action(lobby_id):
     """
-    Perform trading actions for all bots in a lobby
-    """
-
-    # Get the bots in this lobby
-    bots = get_bots_in_lobby(lobby_id)
-
-    while True:
-        with bot_lock:
-            print(f"Bot action running for lobby {lobby_id}")
-            # Find the lobby to operate in, stop if needed
-            lobby = next((lobby for lobby in globals.lobbies if lobby["id"] == lobby_id), None)
-            if not lobby or lobby["status"] != "in_progress":
-                print(
-                    f"Stopping bot action for lobby {lobby_id} (lobby not found or game not in progress)")
-                break
-
-            # Update market state for each bot
-            for bot in bots:
-                market_state = get_current_market_state(lobby_id)
-                bot.update_market_state(market_state)
-
-                # Decide whether to post new bid/ask prices
-                if bot.should_update_quotes():
-                    # Get the new bid and ask prices and post orders
-                    bid, ask = bot.generate_bid_ask()
-                    for price, order_type in [(bid, "bid"), (ask, "ask")]:
-                        order_quantity = random.randint(1, 10)
-                        print(
-                            f"logging bot trade of lobby id: {lobby_id}, bot id: {bot.bot_id}, price: {price}, order_type: {order_type}, quantity: {random.randint(1, 10)}")
-                        print(
-                            f"{type(lobby_id)}, {type(bot.bot_id)}, {type(price)}, {type(random.randint(1, 10))}, {type(order_type)}")
-                        db.execute("""
-                            INSERT INTO orders (game_id, user_id, price, quantity, order_type, created_at)
-                            VALUES (:game_id, :user_id, :price, :quantity, :order_type, CURRENT_TIMESTAMP)
-                        """, game_id=lobby_id, user_id=bot.bot_id, price=price, quantity=order_quantity, order_type=order_type)
-
-                        # Emit real-time market update
-                        # Get market data
-                        asks = db.execute("""
-                            SELECT price, quantity FROM orders
-                            WHERE game_id = :game_id AND order_type = 'ask'
-                            ORDER BY price ASC, created_at ASC
-                        """, game_id=lobby_id)
-                        bids = db.execute("""
-                            SELECT price, quantity FROM orders
-                            WHERE game_id = :game_id AND order_type = 'bid'
-                            ORDER BY price DESC, created_at ASC
-                        """, game_id=lobby_id)
-                        socketio.emit('market_update', {
-                            'bids': bids,
-                            'asks': asks,
-                        }, room=lobby_id)
-                        print(f"New order emitted for bot {bot.bot_id} in lobby {lobby_id}")
-
-                # Decide to trade or not
-                trade = bot.decide_to_trade()
-                if trade:
-                    execute_trade(lobby_id, bot.bot_id,
-                                  trade["type"], trade["price"], random.randint(1, 10))
-
-        time.sleep(5)  # Sleep for 5 seconds between bot actions
-
-
-def countdown_timer(lobby_id, redirect_url):
-    """
-    Handle the countdown timer for the lobby
-    """
-    while True:
-        # Find the lobby
-        lobby = next((lobby for lobby in globals.lobbies if lobby["id"] == lobby_id), None)
-        if not lobby:
-            print("breaking out of timer")
-            break
-
-        # Countdown logic
-        if lobby["game_length"] > 0:
-            time.sleep(1)  # Wait for 1 second
-            lobby["game_length"] -= 1
-            # Emit timer update to all clients in the lobby
-            socketio.emit('timer_update', {'game_length': lobby["game_length"]}, room=lobby_id)
-        else:
-            # Timer reaches zero
-            socketio.emit('timer_ended', {'message': 'Time is up! Game over!',
-                          'redirect_url': redirect_url}, room=lobby_id)
-
-            # End the game
-            end_game_helper(lobby_id)
-            break
+    Perform one round of trading actions for all bots in a lobby.
+    Returns False once the game is over so the scheduler stops calling it.
+    """
+    # Find the lobby to operate in, stop if needed
+    lobby = globals.lobbies.get(lobby_id)
+    if not lobby or lobby["status"] != "in_progress":
+        print(
+            f"Stopping bot action for lobby {lobby_id} (lobby not found or game not in progress)")
+        return False
+
+    try:
+        run_lobby_command(lobby_id, _bot_tick, lobby_id, get_bots_in_lobby(lobby_id))
+    except LobbyClosed:
+        # The game ended before the tick
+        print(f"Stopping bot action for lobby {lobby_id} (lobby closed)")
+        return False
+    return True
+
+
+def start_bot_trading_cycles(lobby_id):
+    """
+    Schedule the lobby's bots on the shared scheduler. Returns False if they are already running.
+    """
+    return globals.scheduler.every(f"bots:{lobby_id}", globals.BOT_TICK_INTERVAL,
+                                   lambda: bot_action(lobby_id))
+
+
+def format_leaderboard(lobby_id, entries, final=False):
+    """
+    Turn ledger entries, best first, into ranked leaderboard rows with display names.
+    Only the final leaderboard shows accuracy: it counts trades against the fair value.
+    """
+    leaderboard = []
+    for rank, entry in enumerate(entries, start=1):
+        row = {
+            "rank": rank,
+            "user_id": get_player_name(lobby_id, entry["user_id"]),
+            "pnl": round(entry["pnl"], 2),
+            "contracts": entry["contracts"],
+            "trade_count": entry["trade_count"],
+        }
+        if final:
+            row["accuracy"] = entry["accuracy"]
+        leaderboard.append(row)
+    return leaderboard
+
+
+def _read_leaderboard(lobby_id, limit):
+    """
+    Lobby command: the live standings from the lobby's ledger (the top `limit`, or everyone).
+    They are marked to the last trade price, so they never reveal the fair value.
+    """
+    market = get_lobby_market(lobby_id)
+    entries = market.ledger.standings(market.stats.last_price or 0, limit)
+    return market.ledger.version, format_leaderboard(lobby_id, entries)
+
+
+def get_leaderboard(lobby_id, limit=None):
+    """
+    Get the live standings of a lobby, best P&L first
+    """
+    _, leaderboard = run_lobby_command(lobby_id, _read_leaderboard, lobby_id, limit)
+    return leaderboard
+
+
+def emit_leaderboard(lobby_id, published):
+    """
+    Send the lobby its standings if they changed since the last emission.
+    Returns False once the game is over.
+    """
+    lobby = globals.lobbies.get(lobby_id)
+    if not lobby or lobby["status"] != "in_progress":
+        return False
+    market = globals.lobby_markets.get(lobby_id)
+    if market is None or market.ledger.version == published["version"]:
+        return True
+
+    try:
+        published["version"], leaderboard = run_lobby_command(
+            lobby_id, _read_leaderboard, lobby_id, globals.LEADERBOARD_SIZE)
+    except LobbyClosed:
+        return False
+    socketio.emit('leaderboard_update', {'leaderboard': leaderboard}, room=lobby_id)
+    return True
+
+
+def start_leaderboard_updates(lobby_id):
+    """
+    Stream the lobby's standings, at most once per leaderboard interval
+    """
+    published = {"version": 0}
+    globals.scheduler.every(f"leaderboard:{lobby_id}", globals.LEADERBOARD_UPDATE_INTERVAL,
+                            lambda: emit_leaderboard(lobby_id, published))
+
+
+def get_time_remaining(lobby):
+    """
+    Seconds left in a lobby's game, from its absolute end deadline
+    """
+    if "ends_at" not in lobby:
+        return lobby["game_length"]
+    return max(0, lobby["ends_at"] - time.time())
+
+
+def start_game_timer(lobby_id, redirect_url):
+    """
+    Set the lobby's end deadline and schedule the end of the game for it.
+    Clients count down locally from the broadcast deadline, with sparse resyncs.
+    """
+    lobby = globals.lobbies.get(lobby_id)
+    if not lobby:
+        return
+    lobby["ends_at"] = time.time() + lobby["game_length"]
+
+    # End the game exactly at the deadline
+    globals.scheduler.call_later(f"timer:{lobby_id}", lobby["game_length"],
+                                 lambda: game_timer_expired(lobby_id, redirect_url))
+
+    # Resend the remaining time every so often to correct client drift
+    globals.scheduler.every(f"timer_sync:{lobby_id}", globals.TIMER_RESYNC_INTERVAL,
+                            lambda: sync_game_timer(lobby_id), delay=globals.TIMER_RESYNC_INTERVAL)
+
+    socketio.emit('timer_update', {'game_length': lobby["game_length"]}, room=lobby_id)
+
+
+def sync_game_timer(lobby_id):
+    """
+    Send the remaining time to the lobby. Returns False once the game is over.
+    """
+    lobby = globals.lobbies.get(lobby_id)
+    if not lobby or lobby["status"] != "in_progress":
+        return False
+    socketio.emit('timer_update', {'game_length': round(get_time_remaining(lobby))}, room=lobby_id)
+    return True
+
+
+def game_timer_expired(lobby_id, redirect_url):
+    """
+    Tell the lobby time is up and end the game
+    """
+    globals.scheduler.cancel(f"timer_sync:{lobby_id}")
+    lobby = globals.lobbies.get(lobby_id)
+    if not lobby:
+        print("breaking out of timer")
+        return
+
+    socketio.emit('timer_ended', {'message': 'Time is up! Game over!',
+                  'redirect_url': redirect_url}, room=lobby_id)
+
+    # End the game
+    end_game_helper(lobby_id)
+
 
 # Helper Functions for Databases and globals.lobbies
 
@@ -185,51 +430,26 @@ def create_game(lobby_id, scenario, lobby_name, game_length):
     """, id=lobby_id, scenario=scenario, lobby_name=lobby_name, status="waiting", game_length=game_length)
 
 
-def finalize_game_results(game_id, lobby):
+def finalize_game_results(game_id, lobby, results):
     """
-    Populate the game_results table with the final results of the game
+    Populate the game_results table with the final results of the game, as read from the lobby's ledger,
+    and fold them into each player's statistics. Returns the ids of the players whose statistics changed.
     """
-    # Get the scenario and fair value from the lobby dictionary
-    print("retrieve scenario and fair value")
+    # Get the scenario from the lobby dictionary
     scenario = lobby.get("market_question")
-    lobby_id = lobby.get("id")
-    fair_value = get_fair_value(lobby_id)
 
-    # Aggregate performance data for each user based on the fair market value
-    print("aggregating performance data")
-    db.execute("""
+    print("recording results from the ledger")
+    db.executemany("""
         INSERT INTO game_results (user_id, game_id, scenario, pnl, accuracy, time_taken, created_at, trades_completed)
-        SELECT
-            user_id,
-            :game_id AS game_id,
-            :scenario AS scenario,
-            SUM(pnl) AS pnl,
-            COUNT(*) AS trades_completed,
-            ROUND(CASE WHEN COUNT(*) > 0
-                THEN SUM(CASE WHEN pnl > 0 THEN 1 ELSE 0 END) * 100.0 / COUNT(*)
-                ELSE 0
-            END, 2) AS accuracy,
-            g.game_length AS time_taken,
-            g.created_at AS created_at
-        FROM (
-            -- Buyer Data
-            SELECT
-                t.buyer_id AS user_id,
-                (:fair_value - t.price) AS pnl
-            FROM transactions t
-            WHERE t.game_id = :game_id
-            UNION ALL
-            -- Seller Data
-            SELECT
-                t.seller_id AS user_id,
-                (t.price - :fair_value) AS pnl
-            FROM transactions t
-            WHERE t.game_id = :game_id
-        ) AS combined
-        JOIN games g ON g.id = :game_id
-        GROUP BY user_id
-
-    """, game_id=game_id, scenario=scenario, fair_value=fair_value)
+        SELECT :user_id, :game_id, :scenario, :pnl, :accuracy, g.game_length, g.created_at, :trade_count
+        FROM games g WHERE g.id = :game_id
+    """, [{"user_id": entry["user_id"], "game_id": game_id, "scenario": scenario, "pnl": entry["pnl"],
+           "accuracy": entry["accuracy"], "trade_count": entry["trade_count"]} for entry in results])
+
+    # Bots have no account, so only players get statistics
+    player_results = [entry for entry in results if entry["user_id"] not in bots.BOTS]
+    record_results(db, player_results)
+    return [entry["user_id"] for entry in player_results]
 
 
 def mark_game_as_completed(game_id):
@@ -242,6 +462,71 @@ def mark_game_as_completed(game_id):
         WHERE id = :game_id
     """, game_id=game_id)
 
+def encode_history_cursor(game):
+    """
+    Turn the last game of a history page into the opaque cursor of the next page
+    """
+    return base64.urlsafe_b64encode(f"{game['created_at']}|{game['id']}".encode()).decode()
+
+
+def decode_history_cursor(cursor):
+    """
+    Turn a history cursor back into the (created_at, id) key to continue after
+    """
+    try:
+        created_at, game_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return created_at, int(game_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid history cursor")
+
+
+def parse_history_date(value):
+    """
+    Check a YYYY-MM-DD history filter date, None if empty
+    """
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"Invalid date {value}, expected YYYY-MM-DD")
+
+
+def get_history_page(user_id, scenario=None, start=None, end=None, cursor=None, limit=None):
+    """
+    Find one page of a user's game results, newest first, optionally filtered by scenario and date range.
+    Pages continue from a cursor on (created_at, id), so every page costs the same however long the history.
+    Returns the games and the cursor of the next page, or None on the last page.
+    """
+    limit = limit or globals.HISTORY_PAGE_SIZE
+    conditions = ["user_id = :user_id"]
+    params = {"user_id": user_id, "limit": limit + 1}
+    if scenario:
+        conditions.append("scenario = :scenario")
+        params["scenario"] = scenario
+    if start:
+        conditions.append("created_at >= :start")
+        params["start"] = parse_history_date(start)
+    if end:
+        conditions.append("created_at < date(:end, '+1 day')")
+        params["end"] = parse_history_date(end)
+    if cursor:
+        conditions.append("(created_at, id) < (:cursor_created_at, :cursor_id)")
+        params["cursor_created_at"], params["cursor_id"] = decode_history_cursor(cursor)
+
+    # Fetch one extra row to tell whether there is a next page
+    games = db.execute(f"""
+        SELECT id, game_id, scenario, pnl, accuracy, trades_completed, time_taken, created_at
+        FROM game_results
+        WHERE {" AND ".join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT :limit
+    """, **params)
+    if len(games) <= limit:
+        return games, None
+    games = games[:limit]
+    return games, encode_history_cursor(games[-1])
+
 # Lobby and Game Logic Helper Functions
 
 
@@ -262,133 +547,8 @@ def execute_trade(game_id, user_id, trade_type, trade_price, trade_quantity):
     """
     print(
         f"executing trade for {game_id}, {user_id}, {trade_type}, {trade_price}, {trade_quantity}")
-    if trade_type == "buy":
-        # Match with the best ask
-        best_ask = db.execute("""
-            SELECT id, user_id, price, quantity FROM orders
-            WHERE game_id = :game_id AND order_type = 'ask' AND price <= :trade_price
-            ORDER BY price ASC, created_at ASC LIMIT 1
-        """, game_id=game_id, trade_price=trade_price)
-        print("best ask: ", best_ask)
-
-        # If a best ask exists
-        if best_ask:
-            ask = best_ask[0]
-            print("ask: ", ask)
-            quantity_to_trade = min(ask["quantity"], trade_quantity)
-
-            print("trade is: ", user_id, ask['user_id'], ask["price"], quantity_to_trade)
-            # Record the transaction
-            db.execute("""
-                INSERT INTO transactions (game_id, buyer_id, seller_id, price, quantity, created_at)
-                VALUES (:game_id, :buyer_id, :seller_id, :price, :quantity, CURRENT_TIMESTAMP)
-            """, game_id=game_id, buyer_id=user_id, seller_id=ask["user_id"], price=ask["price"], quantity=quantity_to_trade)
-
-            # Update the remaining quantity or delete the order if fulfilled
-            if ask["quantity"] > quantity_to_trade:
-                db.execute("""
-                    UPDATE orders SET quantity = quantity - :quantity WHERE id = :id
-                """, quantity=quantity_to_trade, id=ask["id"])
-            else:
-                db.execute("DELETE FROM orders WHERE id = :id", id=ask["id"])
-
-            # Get the buyer and seller names
-            for lobby in globals.lobbies:
-                if lobby["id"] == game_id:
-                    print("Players: ", lobby["players"])
-                    buyer_name = next(
-                        (player["name"] for player in lobby["players"] if player["id"] == str(user_id)), None)
-                    seller_name = next(
-                        (player["name"] for player in lobby["players"] if player["id"] == ask["user_id"]), None)
-                    break
-            # Emit real-time trade update
-            print("completing trade with price: ", ask['price'], " quantity: ", quantity_to_trade, "buyer: ", buyer_name, str(
-                user_id), " and seller: ", seller_name, ask["user_id"])
-            print("types: ", type(seller_name), type(buyer_name))
-            socketio.emit("trade_update",
-                          {'price': ask['price'], 'quantity': quantity_to_trade, 'buyer_name': buyer_name, 'buyer_id': user_id, 'seller_name': seller_name, 'seller_id': ask["user_id"], 'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                           }, room=game_id)
-            # Emit real-time market update
-            # Get market data
-            asks = db.execute("""
-                SELECT price, quantity FROM orders
-                WHERE game_id = :game_id AND order_type = 'ask'
-                ORDER BY price ASC, created_at ASC
-            """, game_id=game_id)
-            bids = db.execute("""
-                SELECT price, quantity FROM orders
-                WHERE game_id = :game_id AND order_type = 'bid'
-                ORDER BY price DESC, created_at ASC
-            """, game_id=game_id)
-            socketio.emit('market_update', {
-                'bids': bids,
-                'asks': asks,
-            }, room=game_id)
-        else:
-            flash("No matching ask found", "danger")
-
-    elif trade_type == "sell":
-        # Match with the best bid
-        best_bid = db.execute("""
-            SELECT id, user_id, price, quantity FROM orders
-            WHERE game_id = :game_id AND order_type = 'bid' AND price >= :trade_price
-            ORDER BY price DESC, created_at ASC LIMIT 1
-        """, game_id=game_id, trade_price=trade_price)
-        print("best bid: ", best_bid)
-
-        # If a best bid exists
-        if best_bid:
-            bid = best_bid[0]
-            quantity_to_trade = min(bid["quantity"], trade_quantity)
-
-            # Record the transaction
-            db.execute("""
-                INSERT INTO transactions (game_id, buyer_id, seller_id, price, quantity, created_at)
-                VALUES (:game_id, :buyer_id, :seller_id, :price, :quantity, CURRENT_TIMESTAMP)
-            """, game_id=game_id, buyer_id=bid["user_id"], seller_id=user_id, price=bid["price"], quantity=quantity_to_trade)
-
-            # Update the remaining quantity or delete the order if fulfilled
-            if bid["quantity"] > quantity_to_trade:
-                db.execute("""
-                    UPDATE orders SET quantity = quantity - :quantity WHERE id = :id
-                """, quantity=quantity_to_trade, id=bid["id"])
-            else:
-                db.execute("DELETE FROM orders WHERE id = :id", id=bid["id"])
-
-            # Get the buyer and seller names
-            for lobby in globals.lobbies:
-                if lobby["id"] == game_id:
-                    print("Players: ", lobby["players"])
-                    buyer_name = next(
-                        (player["name"] for player in lobby["players"] if player["id"] == bid["user_id"]), None)
-                    seller_name = next(
-                        (player["name"] for player in lobby["players"] if player["id"] == str(user_id)), None)
-                    break
-            # Emit real-time trade update
-            print("completing trade with price: ", bid['price'], " quantity: ", quantity_to_trade,
-                  "buyer: ", buyer_name, bid["user_id"], " and seller: ", seller_name, user_id)
-            print("types: ", type(seller_name), type(buyer_name))
-            socketio.emit("trade_update",
-                          {'price': bid['price'], 'quantity': quantity_to_trade, 'buyer_name': buyer_name, 'buyer_id': bid["user_id"], 'seller_name': seller_name, 'seller_id': user_id, 'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                           }, room=game_id)
-            # Emit real-time market update
-            # Get market data
-            asks = db.execute("""
-                SELECT price, quantity FROM orders
-                WHERE game_id = :game_id AND order_type = 'ask'
-                ORDER BY price ASC, created_at ASC
-            """, game_id=game_id)
-            bids = db.execute("""
-                SELECT price, quantity FROM orders
-                WHERE game_id = :game_id AND order_type = 'bid'
-                ORDER BY price DESC, created_at ASC
-            """, game_id=game_id)
-            socketio.emit('market_update', {
-                'bids': bids,
-                'asks': asks,
-            }, room=game_id)
-        else:
-            flash("No matching bid found", "danger")
+    return run_lobby_command(game_id, lambda: get_lobby_market(game_id).execute_trade(
+        str(user_id), trade_type, trade_price, trade_quantity))
 
 # Lobby / Game Cleanup Functions
 
@@ -398,9 +558,15 @@ def cleanup_lobby(lobby_id):
     Remove the lobby and associated data from memory
     """
 
-    # Remove lobby from lobbies array
-    globals.lobbies = [lobby for lobby in globals.lobbies if lobby['id'] != lobby_id]
-    print(globals.lobbies)
+    # Stop the lobby's bots and timers
+    globals.scheduler.cancel(f"bots:{lobby_id}")
+    globals.scheduler.cancel(f"timer:{lobby_id}")
+    globals.scheduler.cancel(f"timer_sync:{lobby_id}")
+    globals.scheduler.cancel(f"leaderboard:{lobby_id}")
+    globals.scheduler.cancel(f"expiry:{lobby_id}")
+
+    # Remove lobby from the lobby registry
+    globals.lobbies.remove(lobby_id)
 
     # Remove bots associated with the lobby
     bots.BOTS = {bot_id: bot for bot_id, bot in bots.BOTS.items() if bot.lobby_id != lobby_id}
@@ -409,18 +575,25 @@ def cleanup_lobby(lobby_id):
     if lobby_id in globals.markets:
         del globals.markets[lobby_id]
 
+    # Remove the lobby's market, bot engine and command queue
+    globals.lobby_markets.pop(lobby_id, None)
+    globals.vector_bots.pop(lobby_id, None)
+    globals.command_queues.pop(lobby_id, None)
+
 
-def cleanup_game_data(game_id, lobby):
+def cleanup_game_data(game_id, lobby, results=None):
     """
-    Perform database cleanup
+    Perform database cleanup, recording the final results if the game was played.
+    Returns the ids of the players whose statistics changed.
     """
     # Check the lobby status
-    if lobby["status"] == "waiting":
+    updated_players = []
+    if results is None:
         print(f"Skipping finalizing game results for game ID {game_id}. Game was never started.")
     else:
         # Finalize game results only if the game was started
         print("finalizizing game results")
-        finalize_game_results(game_id, lobby)
+        updated_players = finalize_game_results(game_id, lobby, results)
 
     # Mark game as completed in the database
     print("marking game as completed")
@@ -443,26 +616,88 @@ def cleanup_game_data(game_id, lobby):
     db.execute("""
         DELETE FROM game_participants WHERE game_id = :game_id
     """, game_id=game_id)
+    return updated_players
+
+
+def _close_lobby_market(lobby_id):
+    """
+    Lobby command, the lobby's last: close its command queue so nothing touches the market again, and stop
+    logging its ticks. Returns every participant's final results and the closed tick log.
+    """
+    get_command_queue(lobby_id).close()
+    market = get_lobby_market(lobby_id)
+    log, market.tick_log = market.tick_log, None
+    if log:
+        log.close()
+    return market.ledger.results(), log
+
+
+def archive_game_ticks(lobby_id, lobby, log):
+    """
+    Compact a finished game's closed tick log into a columnar archive in the background
+    """
+    metadata = {
+        "lobby_id": lobby_id,
+        "scenario": lobby.get("market_question"),
+        "fair_value": globals.markets.get(lobby_id, {}).get("fair_value"),
+        "game_length": lobby.get("game_length"),
+        "ended_at": time.time(),
+    }
+    archive_path = os.path.join(globals.TICK_DIRECTORY, lobby_id)
+    globals.scheduler.call_later(f"compact:{lobby_id}", 0, lambda: compact(log.path, archive_path, metadata))
 
 
-def cleanup_all(lobby_id):
+def close_lobby(lobby_id):
     """
-    Perform a full cleanup for a given lobby
+    Stop the lobby's bots and scheduled jobs and close its market with a final command, after which no
+    bot, timer or player command can change it or queue a write. Returns every participant's final
+    results and the closed tick log, or None for both if the game never started and has no market.
+    Raises LobbyClosed if the lobby is already being closed.
+    """
+    for job in ("bots", "expiry", "leaderboard", "timer_sync"):
+        globals.scheduler.cancel(f"{job}:{lobby_id}")
+    if lobby_id not in globals.command_queues:
+        return None, None
+    return run_lobby_command(lobby_id, _close_lobby_market, lobby_id)
+
+
+def cleanup_all(lobby_id, closed=None):
+    """
+    Perform a full cleanup for a given lobby. `closed` is what close_lobby returned, if it was already called.
     """
     try:
         # Find the lobby in the global `lobbies` list
-        lobby = next((lobby for lobby in globals.lobbies if lobby["id"] == lobby_id), None)
+        lobby = globals.lobbies.get(lobby_id)
         if not lobby:
             print(f"No lobby found with ID {lobby_id}. Skipping cleanup.")
             return
 
         print(f"Starting full cleanup for lobby ID: {lobby_id}")
 
-        # Perform database cleanup
+        if closed is None:
+            print("closing market")
+            try:
+                closed = close_lobby(lobby_id)
+            except LobbyClosed:
+                print(f"Lobby ID {lobby_id} is already being cleaned up. Skipping cleanup.")
+                return
+        results, log = closed
+
+        # Persist any orders and fills still waiting to be written
+        globals.writer.flush()
+
+        # Perform database cleanup, committing results and deletions together
         print("cleaning database")
-        cleanup_game_data(lobby_id, lobby)
+        with db.transaction():
+            updated_players = cleanup_game_data(lobby_id, lobby, results)
+        globals.user_stats.invalidate(updated_players)
         print("cleaned database successfully")
 
+        # Keep the game's orders and fills as an archive of ticks
+        if log:
+            print("archiving ticks")
+            archive_game_ticks(lobby_id, lobby, log)
+
         # Perform memory cleanup
         print("cleaning memory")
         cleanup_lobby(lobby_id)
@@ -482,62 +717,27 @@ def end_game_helper(lobby_id):
     try:
         # Find the lobby
         print("finding lobby to end")
-        lobby = next((lobby for lobby in globals.lobbies if lobby["id"] == lobby_id), None)
+        lobby = globals.lobbies.get(lobby_id)
         if not lobby:
             print("Lobby not found. Unable to end the game.")
             return
 
-        # If the game is in progress, generate the leaderboard
-        if lobby["status"] == "in_progress":
-            print("generating leaderboard")
-            # Fetch P&L leaderboard from transactions
-            leaderboard = db.execute("""
-                SELECT
-                    user_id,
-                    SUM(pnl) AS pnl,
-                    COUNT(*) AS trade_count,
-                    ROUND(CASE WHEN COUNT(*) > 0
-                        THEN SUM(CASE WHEN (pnl > 0) THEN 1 ELSE 0 END) * 100.0 / COUNT(*)
-                        ELSE 0
-                    END, 2) AS accuracy
-                FROM (
-                    -- Buyer Data
-                    SELECT
-                        t.buyer_id AS user_id,
-                        (:fair_value - t.price) AS pnl  -- PnL for buyers
-                    FROM transactions t
-                    WHERE t.game_id = :game_id
-
-                    UNION ALL
-
-                    -- Seller Data
-                    SELECT
-                        t.seller_id AS user_id,
-                        (t.price - :fair_value) AS pnl  -- PnL for sellers
-                    FROM transactions t
-                    WHERE t.game_id = :game_id
-                ) AS combined
-                GROUP BY user_id
-                ORDER BY pnl DESC
-            """, game_id=lobby_id, fair_value=globals.markets[lobby_id]["fair_value"])
-            print("leaderboard generated")
-
-            print("converting leaderboard")
-            # Convert leaderboard to a list of dictionaries
-            leaderboard_data = [
-                {
-                    "user_id": next((player["name"] for player in lobby["players"] if player["id"] == entry["user_id"]), None),
-                    "pnl": round(entry["pnl"], 2),
-                    "trade_count": entry["trade_count"],
-                    "accuracy": entry["accuracy"],
-                }
-                for entry in leaderboard
-            ]
-            print("leaderboard converted")
-
-            # Notify all players in the lobby about the leaderboard
+        # Stop trading first, so the results sent out are exactly the ones recorded
+        print("closing market")
+        try:
+            results, log = close_lobby(lobby_id)
+        except LobbyClosed:
+            print(f"Lobby ID {lobby_id} is already ending.")
+            return
+
+        # Deliver any trades and market updates still waiting in the conflation window
+        publisher.flush(lobby_id)
+
+        # If the game was played, send out the final P&L leaderboard
+        if results is not None:
             print("sending out leaderboard")
-            socketio.emit("game_end_leaderboard", {"leaderboard": leaderboard_data}, room=lobby_id)
+            socketio.emit("game_end_leaderboard", {"leaderboard": format_leaderboard(lobby_id, results, final=True)},
+                          room=lobby_id)
 
         # Notify all players in the lobby about the game ending
         print("send out game end")
@@ -545,7 +745,7 @@ def end_game_helper(lobby_id):
 
         # Perform memory and database cleanup
         print("Performing memory and database cleanup")
-        cleanup_all(lobby_id)
+        cleanup_all(lobby_id, (results, log))
 
         print("Game has been ended and data cleaned up successfully")
 
@@ -0,0 +1,175 @@
+# vectorbots.py contains the vectorized bot engine for stress games with hundreds of bots. It keeps every bot of a lobby in NumPy arrays (fair value estimates, current quotes, level parameters) and makes each tick's quote and trade decisions for whole batches of them at once, following the same rules as bots.Bot. A batch only runs as far as the bots in it could not have seen each other's quotes and trades anyway, so the outcome matches Bot turns taken one by one.
+import numpy as np
+
+from marketstats import RECENT_TRADES
+
+LEVELS = ["easy", "medium", "hard", "Jane Street"]
+LEVEL_INDEX = {level: i for i, level in enumerate(LEVELS)}
+DEFAULT_LEVEL = LEVEL_INDEX["medium"]  # Unknown levels behave like medium, as they do in Bot
+
+# Per-level parameters in LEVELS order, the same numbers Bot uses
+FAIR_VALUE_NOISE = np.array([0.20, 0.10, 0.05, 0.02])  # Initial error of the fair value estimate
+ADJUST_NOISE = np.array([0.05, 0.02, 0.01, 0.005])  # Noise added when the estimate follows trades
+QUOTE_NOISE_LOW = np.array([5, 2, 1, 0.5])
+QUOTE_NOISE_HIGH = np.array([10, 5, 2, 1])
+MARGIN = np.array([0.1, 0.05, 0.02, 0.01])  # Quote and trade margin, as a fraction of fair value
+UPDATE_PROBABILITY = np.array([0.1, 0.25, 0.5, 0.7])
+
+ADJUSTMENT_FACTOR = 0.1  # How far the estimate moves towards the average trade price
+QUOTE_DELAY = 5  # Seconds after joining before a bot quotes
+BATCH_SIZE = 32  # Most bots deciding together; a batch ends early at the first bot that changes what the others see
+
+
+class VectorBotEngine:
+    def __init__(self, bot_ids, levels, fair_value, now, rng=None):
+        """
+        Initialize the state of every bot in a lobby. `now` is the datetime the bots join at.
+        """
+        self.ids = list(bot_ids)
+        self.level = np.array([LEVEL_INDEX.get(level, DEFAULT_LEVEL) for level in levels], dtype=np.intp)
+        self.fair_value = fair_value
+        self.rng = rng or np.random.default_rng()
+
+        n = len(self.ids)
+        self.estimated_fair_value = fair_value * (1 + self.rng.uniform(-1, 1, n) * FAIR_VALUE_NOISE[self.level])
+        self.current_bid = np.full(n, np.nan)  # NaN while the bot has never quoted
+        self.current_ask = np.full(n, np.nan)
+        self.joined = now.timestamp()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _side(self, snapshot, order_type, start, stop):
+        """
+        For one side of the book, find the best price and average order size each bot from start to stop sees
+        in the snapshot, excluding its own orders. Bots with nothing to look at get NaN and 1.
+        """
+        best = np.full(stop - start, np.nan)
+        depth = np.ones(stop - start)
+        for i, bot_id in enumerate(self.ids[start:stop]):
+            row = snapshot.best(order_type, bot_id)
+            if row:
+                best[i] = row["price"]
+                depth[i] = snapshot.average_quantity(order_type, bot_id)
+        return best, depth
+
+    def _trade_frequency_modifier(self, stats, maturity, now):
+        """
+        How eager bots are to trade into a wide spread, from recent market activity
+        """
+        if maturity < 5:
+            return 0.8
+        activity = stats.trades_within(30, now.timestamp())
+        if activity > 5:
+            return 0.6
+        if activity > 2:
+            return 0.4
+        return 0.2
+
+    def tick(self, snapshot, now, start=0, size=BATCH_SIZE):
+        """
+        Decide the actions of a batch of up to `size` bots from `start` for one tick, from the tick's
+        MarketSnapshot. Like Bot turns, every bot must see the quotes and trades of the bots before it, so the
+        batch is cut after the first bot whose actions would change the best prices a later one sees; the bots
+        after it decide again, in the next batch, once its actions are in the snapshot.
+        Returns the actions in bot order, each ("order", bot id, "bid"/"ask", price, quantity) or
+        ("trade", bot id, "buy"/"sell", price, quantity), and where the next batch starts.
+        """
+        stop = min(start + size, len(self.ids))
+        n = stop - start
+        rng = self.rng
+        fair_value = self.fair_value
+        level = self.level[start:stop]
+        current_bid = self.current_bid[start:stop]
+        current_ask = self.current_ask[start:stop]
+        best_bid, bid_depth = self._side(snapshot, "bid", start, stop)
+        best_ask, ask_depth = self._side(snapshot, "ask", start, stop)
+        has_bid = ~np.isnan(best_bid)
+        has_ask = ~np.isnan(best_ask)
+        stats = snapshot.stats
+        maturity = min(stats.trade_count, RECENT_TRADES)
+
+        # Move the estimates towards the recent trades
+        average_price = stats.recent_average()
+        estimated_fair_value = self.estimated_fair_value[start:stop]
+        if average_price is not None:
+            estimated_fair_value = (
+                (1 - ADJUSTMENT_FACTOR) * estimated_fair_value + ADJUSTMENT_FACTOR * average_price
+            ) * (1 + rng.uniform(-1, 1, n) * ADJUST_NOISE[level])
+
+        # Decide who requotes: a level-dependent coin flip, once settled in, unless still at the top
+        quoting_bid = ~np.isnan(current_bid) & (current_bid != 0)
+        quoting_ask = ~np.isnan(current_ask) & (current_ask != 0)
+        competitive = (quoting_bid & has_bid & (current_bid >= best_bid)) | \
+                      (quoting_ask & has_ask & (current_ask <= best_ask))
+        update = (rng.random(n) < UPDATE_PROBABILITY[level]) & \
+                 (now.timestamp() - self.joined >= QUOTE_DELAY) & ~competitive
+
+        # New quotes, weighing fair value against the market as it matures
+        noise = QUOTE_NOISE_LOW[level] + (QUOTE_NOISE_HIGH[level] - QUOTE_NOISE_LOW[level]) * rng.random(n)
+        margin = MARGIN[level] * fair_value
+        weight_on_market = min(maturity / 20, 1)
+        best_bid_price = np.where(has_bid, best_bid, fair_value - noise)
+        best_ask_price = np.where(has_ask, best_ask, fair_value + noise)
+        bid = (weight_on_market * (best_bid_price + rng.uniform(-1, 0.5, n))
+               + (1 - weight_on_market) * (fair_value - margin - noise)
+               + rng.uniform(-1, 1, n) * bid_depth / 10)
+        ask = (weight_on_market * (best_ask_price + rng.uniform(0.5, 1, n))
+               + (1 - weight_on_market) * (fair_value + margin + noise)
+               + rng.uniform(-1, 1, n) * ask_depth / 10)
+        reluctant = (quoting_bid & has_bid & (current_bid >= best_bid_price)) | \
+                    (quoting_ask & has_ask & (current_ask <= best_ask_price))
+        bid -= np.where(reluctant, rng.random(n) * noise / 2, 0)
+        ask += np.where(reluctant, rng.random(n) * noise / 2, 0)
+        ask = np.where(ask <= bid, bid + rng.uniform(0.5, 1, n), ask)
+        new_bid = np.where(update, np.maximum(0, bid), current_bid)
+        new_ask = np.where(update, np.maximum(0, ask), current_ask)
+
+        # Trade against mispriced quotes first, then into wide spreads while the market is young
+        trade_margin = MARGIN[level] * fair_value
+        buy = has_ask & (best_ask <= fair_value - trade_margin) & \
+              (np.isnan(new_ask) | (best_ask < new_ask))
+        sell = ~buy & has_bid & (best_bid >= fair_value + trade_margin) & \
+               (np.isnan(new_bid) | (best_bid > new_bid))
+        spread = best_ask - best_bid
+        undecided = ~buy & ~sell & has_bid & has_ask & (spread != 0)
+        tight = undecided & (spread < 0.02 * fair_value) & (maturity > 10)
+        wide = undecided & ~tight & (spread > 0.05 * fair_value) & \
+               (rng.random(n) < self._trade_frequency_modifier(stats, maturity, now))
+        wide_buy = wide & (rng.random(n) < 0.6)
+        buy |= tight | wide_buy
+        sell |= wide & ~wide_buy
+
+        # Cut the batch after the first bot that trades, or whose new or cancelled quotes would
+        # reach the best bid or ask seen by any bot after it
+        seen_bid = np.where(has_bid, best_bid, -np.inf)
+        seen_ask = np.where(has_ask, best_ask, np.inf)
+        later_bid = np.append(np.minimum.accumulate(seen_bid[::-1])[::-1][1:], np.inf)
+        later_ask = np.append(np.maximum.accumulate(seen_ask[::-1])[::-1][1:], -np.inf)
+        moves = buy | sell | (update & ((new_bid > later_bid) | (new_ask < later_ask) |
+                                        (quoting_bid & (current_bid >= later_bid)) |
+                                        (quoting_ask & (current_ask <= later_ask))))
+        n = int(np.argmax(moves)) + 1 if moves.any() else n
+
+        # Only the bots in the batch keep their decisions
+        self.estimated_fair_value[start:start + n] = estimated_fair_value[:n]
+        current_bid[:n] = new_bid[:n]  # Views, so this updates the engine's state
+        current_ask[:n] = new_ask[:n]
+
+        # Quantities are drawn like the live tick draws them, 1 to 10 per order and trade
+        quote_quantities = rng.integers(1, 11, size=(n, 2))
+        trade_quantities = rng.integers(1, 11, size=n)
+        bid_prices = np.round(current_bid, 2)
+        ask_prices = np.round(current_ask, 2)
+
+        actions = []
+        for i in np.flatnonzero(update[:n] | buy[:n] | sell[:n]):
+            bot_id = self.ids[start + i]
+            if update[i]:
+                actions.append(("order", bot_id, "bid", float(bid_prices[i]), int(quote_quantities[i, 0])))
+                actions.append(("order", bot_id, "ask", float(ask_prices[i]), int(quote_quantities[i, 1])))
+            if buy[i]:
+                actions.append(("trade", bot_id, "buy", float(best_ask[i]), int(trade_quantities[i])))
+            elif sell[i]:
+                actions.append(("trade", bot_id, "sell", float(best_bid[i]), int(trade_quantities[i])))
+        return actions, start + n
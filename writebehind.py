@@ -0,0 +1,83 @@
+# writebehind.py contains the write-behind queue that persists orders and fills. Lobby commands queue their writes and carry on; a background writer commits whatever piled up every few milliseconds as one transaction, so matching and emitting never wait on the disk.
+import atexit
+import itertools
+import threading
+import time
+from collections import deque
+
+
+class WriteBehindQueue:
+    def __init__(self, db, capacity=10000, interval=0.005):
+        """
+        Initialize the queue with the database it writes to, how many writes may wait
+        before producers block, and how long writes pile up before a group commit
+        """
+        self.db = db
+        self.capacity = capacity
+        self.interval = interval
+        self.condition = threading.Condition()
+        self.writes = deque()  # (sql, params) in the order they were queued
+        self.queued = 0  # Writes queued since startup
+        self.done = 0  # Writes committed (or given up on) since startup
+        self.thread = None
+        atexit.register(self.flush)
+
+    def add(self, sql, **params):
+        """
+        Queue a write. Blocks only while the queue is full.
+        """
+        with self.condition:
+            while len(self.writes) >= self.capacity:
+                self.condition.wait()
+            self.writes.append((sql, params))
+            self.queued += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def flush(self):
+        """
+        Wait until every write queued so far has been committed
+        """
+        with self.condition:
+            target = self.queued
+            self.condition.wait_for(lambda: self.done >= target)
+
+    def _run(self):
+        """
+        Commit queued writes in batches, forever
+        """
+        while True:
+            with self.condition:
+                while not self.writes:
+                    self.condition.wait()
+
+            # Let a few milliseconds of writes pile up so they share one commit
+            time.sleep(self.interval)
+
+            with self.condition:
+                batch = list(self.writes)
+                self.writes.clear()
+                self.condition.notify_all()  # Wake producers waiting for room
+            self._commit(batch)
+            with self.condition:
+                self.done += len(batch)
+                self.condition.notify_all()  # Wake flushes waiting for these writes
+
+    def _commit(self, batch):
+        """
+        Run a batch as one transaction. Runs of the same statement go through executemany.
+        If the batch fails, retry its writes one at a time so only the failing ones are lost.
+        """
+        try:
+            with self.db.transaction():
+                for sql, writes in itertools.groupby(batch, key=lambda write: write[0]):
+                    self.db.executemany(sql, [params for _, params in writes])
+        except Exception as e:
+            print(f"Error persisting {len(batch)} writes as one batch, retrying one by one: {e}")
+            for sql, params in batch:
+                try:
+                    self.db.execute(sql, **params)
+                except Exception as e:
+                    print(f"Error persisting write {sql.strip()} with {params}: {e}")